@@ -0,0 +1,385 @@
+function toggleDarkMode() {
+const body = document.body;
+const toggle = document.querySelector('.theme-toggle .toggle-icon');
+body.classList.toggle('dark-mode');
+if (body.classList.contains('dark-mode')) {
+toggle.textContent = '☀️';
+localStorage.setItem('darkMode', 'enabled');
+} else {
+toggle.textContent = '🌙';
+localStorage.setItem('darkMode', 'disabled');
+}
+}
+window.addEventListener('load', () => {
+const darkMode = localStorage.getItem('darkMode');
+const toggle = document.querySelector('.theme-toggle .toggle-icon');
+if (darkMode !== 'disabled') {
+document.body.classList.add('dark-mode');
+toggle.textContent = '☀️';
+}
+});
+let commandCount = 0;
+function getTimestamp() {
+const now = new Date();
+const hours = String(now.getHours()).padStart(2, '0');
+const minutes = String(now.getMinutes()).padStart(2, '0');
+const seconds = String(now.getSeconds()).padStart(2, '0');
+return `[${hours}:${minutes}:${seconds}]`;
+}
+function addFeedback(message, type = 'completed') {
+const feedbackContent = document.getElementById('feedback-content');
+const entry = document.createElement('div');
+entry.className = `command-entry ${type}`;
+entry.innerHTML = `<span class="timestamp">${getTimestamp()}</span> ${message}`;
+feedbackContent.appendChild(entry);
+feedbackContent.scrollTop = feedbackContent.scrollHeight;
+const entries = feedbackContent.querySelectorAll('.command-entry');
+if (entries.length > 15) {
+entries[0].remove();
+}
+commandCount++;
+}
+function clearFeedback() {
+const feedbackContent = document.getElementById('feedback-content');
+feedbackContent.innerHTML = '';
+addFeedback('Command history cleared', 'completed');
+}
+let ledTimeout = null;
+function setLEDState(active) {
+const led = document.getElementById('status-led');
+if (active) {
+led.classList.add('active');
+if (ledTimeout) {
+clearTimeout(ledTimeout);
+ledTimeout = null;
+}
+} else {
+led.classList.remove('active');
+}
+}
+function flashLED() {
+const led = document.getElementById('status-led');
+led.classList.add('active');
+if (ledTimeout) {
+clearTimeout(ledTimeout);
+}
+ledTimeout = setTimeout(() => {
+led.classList.remove('active');
+ledTimeout = null;
+}, 1000);
+}
+const microstepValues = [1, 2, 4, 8, 16, 32];
+function updateMicrostepping(sliderValue) {
+const microsteps = microstepValues[parseInt(sliderValue)];
+const valueDisplay = document.getElementById('microstep-value');
+valueDisplay.textContent = `${microsteps}x`;
+fetch(`/microsteps?microsteps=${microsteps}`)
+.then(response => response.text())
+.then(result => {
+addFeedback(`Motor smoothness set to ${microsteps}x microsteps`, 'completed');
+})
+.catch(error => {
+addFeedback(`Failed to set microstepping: ${error}`, 'error');
+});
+}
+let videoTimeout = null;
+function updateVideoSpeed(value) {
+const dps = parseFloat(value);
+document.getElementById('video-value').textContent = dps === 0 ? 'Off' : `${dps}°/s`;
+if (videoTimeout) {
+clearTimeout(videoTimeout);
+}
+videoTimeout = setTimeout(() => {
+fetch(`/video?dps=${dps}`)
+.then(response => response.text())
+.then(result => addFeedback(result, dps === 0 ? 'completed' : 'executing'))
+.catch(error => addFeedback(`Video mode failed: ${error}`, 'error'));
+}, 150);
+}
+function setupHoldToJog(id, direction) {
+const button = document.getElementById(id);
+let holdTimeout = null;
+let heartbeat = null;
+let held = false;
+const beat = () => fetch(`/jog?dir=${direction}`).catch(() => {});
+button.addEventListener('pointerdown', () => {
+held = false;
+holdTimeout = setTimeout(() => {
+held = true;
+addFeedback(direction > 0 ? 'Jogging clockwise...' : 'Jogging counter-clockwise...', 'executing');
+beat();
+heartbeat = setInterval(beat, 150);
+}, 300);
+});
+const release = () => {
+clearTimeout(holdTimeout);
+if (heartbeat) {
+clearInterval(heartbeat);
+heartbeat = null;
+fetch('/jog?dir=0').catch(() => {});
+}
+};
+button.addEventListener('pointerup', release);
+button.addEventListener('pointerleave', release);
+button.addEventListener('click', (event) => {
+if (held) {
+held = false;
+event.stopImmediatePropagation();
+event.preventDefault();
+}
+}, true);
+}
+window.addEventListener('load', () => {
+const slider = document.getElementById('microstep-slider');
+updateMicrostepping(slider.value);
+});
+async function executeCommand(url, description) {
+try {
+setLEDState(true);
+if (!progressInterval) {
+startProgressPolling();
+}
+addFeedback(`${description}...`, 'executing');
+const response = await fetch(url);
+const result = await response.text();
+if (response.ok) {
+const message = result && result !== 'OK' ? result : `${description} ✓`;
+addFeedback(message, 'completed');
+} else {
+addFeedback(`${description} ✗ (HTTP ${response.status})`, 'error');
+}
+} catch (error) {
+addFeedback(`${description} ✗ (${error.message})`, 'error');
+setLEDState(false);
+}
+}
+let progressInterval = null;
+let lastProgressStep = 0;
+let pollingActive = false;
+function stopProgressPolling() {
+console.log('DEBUG: Stopping progress polling');
+if (progressInterval) {
+clearInterval(progressInterval);
+progressInterval = null;
+}
+pollingActive = false;
+console.log('DEBUG: Progress polling stopped');
+}
+function startProgressPolling() {
+console.log('DEBUG: startProgressPolling called! Active:', pollingActive);
+if (pollingActive) {
+console.log('DEBUG: Polling already active - skipping');
+return;
+}
+stopProgressPolling();
+pollingActive = true;
+lastProgressStep = 0;
+setTimeout(() => {
+if (progressInterval) {
+console.log('Progress polling timeout - forcing cleanup');
+setLEDState(false);
+stopProgressPolling();
+const timelapseBtn = document.getElementById('timelapse-btn');
+if (timelapseBtn.disabled) {
+timelapseBtn.disabled = false;
+timelapseBtn.textContent = 'Start Timelapse';
+addFeedback('Timelapse completed (timeout)', 'completed');
+}
+}
+}, 120000);
+console.log('DEBUG: Creating new polling interval');
+progressInterval = setInterval(async () => {
+try {
+const controller = new AbortController();
+const timeoutId = setTimeout(() => controller.abort(), 2000);
+console.log('DEBUG: Fetching /progress...');
+const response = await fetch('/progress', {
+signal: controller.signal,
+cache: 'no-cache'
+});
+clearTimeout(timeoutId);
+console.log('DEBUG: Progress response status:', response.status);
+if (!response.ok) {
+throw new Error(`HTTP ${response.status}`);
+}
+const progressText = await response.text();
+console.log('DEBUG: Raw progress response:', progressText);
+const progress = JSON.parse(progressText);
+setLEDState(progress.command_executing || progress.running);
+if (progress.running || progress.command_executing) {
+if (progress.current_step !== lastProgressStep && progress.total_steps > 0) {
+lastProgressStep = progress.current_step;
+addFeedback(`Timelapse progress: Step ${progress.current_step} of ${progress.total_steps} (${progress.percentage}%)`, 'executing');
+}
+} else if (!progress.command_executing && !progress.running) {
+const timelapseBtn = document.getElementById('timelapse-btn');
+if (timelapseBtn.disabled) {
+addFeedback('Timelapse completed successfully', 'completed');
+timelapseBtn.disabled = false;
+timelapseBtn.textContent = 'Start Timelapse';
+}
+stopProgressPolling();
+lastProgressStep = 0;
+}
+} catch (error) {
+console.log('Progress polling error:', error);
+const timelapseBtn = document.getElementById('timelapse-btn');
+if (!timelapseBtn.disabled) {
+setLEDState(false);
+if (progressInterval) {
+stopProgressPolling();
+lastProgressStep = 0;
+}
+}
+}
+}, 1000);
+}
+window.addEventListener('load', () => {
+console.log('DEBUG: Page loaded - checking for ongoing timelapse');
+fetch('/progress')
+.then(response => response.json())
+.then(data => {
+console.log('DEBUG: Initial progress check:', data);
+if (data.timelapse_running) {
+console.log('DEBUG: Timelapse detected on page load - starting polling');
+startProgressPolling();
+} else {
+console.log('DEBUG: No timelapse running on page load');
+}
+})
+.catch(error => console.log('DEBUG: Initial progress check failed:', error));
+});
+window.addEventListener('load', function() {
+const timelapseBtn = document.getElementById('timelapse-btn');
+if (!timelapseBtn) {
+console.error('ERROR: Could not find timelapse-btn element');
+return;
+}
+timelapseBtn.onclick = null;
+timelapseBtn.removeEventListener('click', executeCommand);
+timelapseBtn.addEventListener('click', async function() {
+alert('🚀 NEW HANDLER WORKS!');
+try {
+this.disabled = true;
+this.textContent = 'Running Timelapse...';
+const angle = document.getElementById('angle-input').value || '10';
+const steps = document.getElementById('steps-input').value || '5';
+const pause = document.getElementById('pause-input').value || '1';
+console.log('DEBUG: Ensuring fresh progress polling for timelapse');
+if (progressInterval) {
+console.log('DEBUG: Stopping existing polling');
+clearInterval(progressInterval);
+progressInterval = null;
+}
+console.log('DEBUG: Starting fresh progress polling');
+startProgressPolling();
+setLEDState(true);
+addFeedback(`Starting timelapse: ${angle}° in ${steps} steps, ${pause}s per step`, 'executing');
+const response = await fetch(`/timelapse?angle=${angle}&steps=${steps}&pause=${pause}`);
+const result = await response.text();
+if (response.ok) {
+addFeedback(`Timelapse initiated: ${result}`, 'executing');
+} else {
+addFeedback(`Failed to start timelapse (HTTP ${response.status})`, 'error');
+this.disabled = false;
+this.textContent = 'Start Timelapse';
+setLEDState(false);
+}
+} catch (error) {
+addFeedback(`Failed to start timelapse: ${error.message}`, 'error');
+this.disabled = false;
+this.textContent = 'Start Timelapse';
+setLEDState(false);
+}
+});
+document.getElementById('stop-btn').onclick = async function() {
+document.getElementById('video-slider').value = 0;
+document.getElementById('video-value').textContent = 'Off';
+await executeCommand('/stop', 'Stop');
+};
+setupHoldToJog('butt-right', 1);
+setupHoldToJog('butt-left', -1);
+document.getElementById('butt-bott').onclick = async function() {
+await executeCommand('/cw_360', 'Clockwise 360° rotation');
+};
+document.getElementById('butt-right').onclick = async function() {
+await executeCommand('/cw_a_bit', 'Clockwise nudge');
+};
+document.getElementById('butt-top').onclick = async function() {
+await executeCommand('/ccw_360', 'Counter-clockwise 360°');
+};
+document.getElementById('butt-left').onclick = async function() {
+await executeCommand('/ccw_a_bit', 'Counter-clockwise nudge');
+};
+});
+window.addEventListener('load', function() {
+setTimeout(() => {
+addFeedback('Turntable system initialized', 'completed');
+}, 500);
+setInterval(async () => {
+try {
+const response = await fetch('/status');
+if (!response.ok) {
+addFeedback('WARNING: System check failed', 'error');
+}
+} catch (error) {
+addFeedback('WARNING: Connection lost', 'error');
+}
+}, 30000);
+});
+document.addEventListener('keydown', function(event) {
+if (event.target.tagName.toLowerCase() === 'input') return;
+switch(event.key.toLowerCase()) {
+case 'arrowleft':
+event.preventDefault();
+document.getElementById('butt-left').click();
+break;
+case 'arrowright':
+event.preventDefault();
+document.getElementById('butt-right').click();
+break;
+case 'arrowup':
+event.preventDefault();
+document.getElementById('butt-top').click();
+break;
+case 'arrowdown':
+event.preventDefault();
+document.getElementById('butt-bott').click();
+break;
+case ' ':
+case 'escape':
+event.preventDefault();
+document.getElementById('stop-btn').click();
+break;
+case 't':
+event.preventDefault();
+document.getElementById('timelapse-btn').click();
+break;
+}
+});
+document.querySelectorAll('.button, .control-button').forEach(element => {
+element.addEventListener('mousedown', function() {
+this.style.transform = (this.style.transform || '') + ' scale(0.95)';
+});
+element.addEventListener('mouseup', function() {
+this.style.transform = this.style.transform.replace(' scale(0.95)', '');
+});
+element.addEventListener('mouseleave', function() {
+this.style.transform = this.style.transform.replace(' scale(0.95)', '');
+});
+if (element.id === 'timelapse-btn') {
+element.addEventListener('click', function() {
+console.log('🎯 TIMELAPSE CLICK INTERCEPTED - Starting progress polling');
+if (progressInterval) {
+clearInterval(progressInterval);
+progressInterval = null;
+}
+startProgressPolling();
+console.log('✅ Progress polling started for timelapse');
+}, true);
+}
+});
+;
+document.addEventListener('DOMContentLoaded', function() {
+addFeedback('System ready - Microstepping enabled', 'completed');
+});
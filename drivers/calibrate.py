@@ -0,0 +1,241 @@
+"""
+    Speed calibration of a DRV8825 driven axis with an encoder
+
+    calibrate() sweeps the step frequency of each microstep mode upwards
+    in velocity mode and measures the rotation with an Encoder
+    (encoder_portable.py) on the axis at every frequency:
+
+    - a stall: far fewer counts than the steps sent, the mode's sweep
+      ends there and its maximum is the last good frequency, less a
+      safety margin. A mode that doesn't stall up to the end of its
+      sweep (max_full_hz, or the driver's max_tick_hz pulse rate) keeps
+      that frequency as its maximum
+    - resonance: some counts lost, or the rotation speed fluctuating
+      strongly within the measurement, the frequencies are recorded as
+      a band to avoid
+
+    The result is a SpeedTable, a few bytes per mode, that limit() uses
+    to bring any requested speed to the fastest safe one. It's packed
+    for storing on flash and loaded at boot.
+
+    The calibration turns the axis continuously (alternating direction
+    per mode) and may stall it: run it with a load like the real one,
+    and set the position again afterwards.
+
+    Usage:
+        table = calibrate(mot, encoder, counts_per_step=4)
+        speed = table.limit(32, 2400)  # (micro)steps per second
+
+"""
+
+import struct
+import time
+
+_MAGIC = b"TWSP"
+_VERSION = 1
+
+
+class SpeedTable(object):
+    """Fastest safe step frequency and resonant bands per microstep mode"""
+
+    def __init__(self, modes=None):
+        """
+        <modes> (dict) microsteps: (max step frequency, ((low, high), ...))
+                frequencies in (micro-)steps per second of that mode
+        """
+        self.modes = modes or {}
+
+    def calibrated(self, microsteps=None):
+        """True when the table has <microsteps>, or any mode if None"""
+        return microsteps in self.modes if microsteps is not None else bool(self.modes)
+
+    def max_hz(self, microsteps, default=None):
+        """fastest safe step frequency of the mode, <default> when not
+        calibrated
+        """
+        entry = self.modes.get(microsteps)
+        return entry[0] if entry else default
+
+    def limit(self, microsteps, hz):
+        """<hz> (micro-)steps per second brought to the calibrated maximum
+        of the mode and below any resonant band it falls in, the sign is
+        kept. Unchanged when the mode isn't calibrated.
+        """
+        entry = self.modes.get(microsteps)
+        if entry is None:
+            return hz
+        speed = min(abs(hz), entry[0])
+        for low, high in entry[1]:
+            if low < speed < high:
+                speed = low
+                break
+        return speed if hz >= 0 else -speed
+
+    def pack(self):
+        """the table as bytes, for storing on flash"""
+        data = _MAGIC + struct.pack("<BB", _VERSION, len(self.modes))
+        for microsteps, (max_hz, bands) in sorted(self.modes.items()):
+            data += struct.pack("<BBH", microsteps, len(bands), max_hz)
+            for low, high in bands:
+                data += struct.pack("<HH", low, high)
+        return data
+
+    @classmethod
+    def unpack(cls, data):
+        """table from pack() bytes, empty when they aren't one"""
+        modes = {}
+        if data[:4] != _MAGIC or len(data) < 6 or data[4] != _VERSION:
+            return cls()
+        offset = 6
+        for _ in range(data[5]):
+            microsteps, count, max_hz = struct.unpack_from("<BBH", data, offset)
+            offset += 4
+            bands = []
+            for _ in range(count):
+                bands.append(struct.unpack_from("<HH", data, offset))
+                offset += 4
+            modes[microsteps] = (max_hz, tuple(bands))
+        return cls(modes)
+
+    @classmethod
+    def load(cls, path):
+        """table stored in file <path>, empty when there is none"""
+        try:
+            with open(path, "rb") as f:
+                return cls.unpack(f.read())
+        except (OSError, ValueError):
+            return cls()
+
+
+def _measure(encoder, expected, measure_ms):
+    """encoder counts over <measure_ms> split into windows
+    returns (count ratio to <expected>, fluctuation of the windows)
+    """
+    # windows long enough for ~20 counts each, so quantisation doesn't
+    # pass for fluctuation
+    windows = max(2, min(8, int(expected / 20)))
+    window_ms = measure_ms // windows
+    counts = []
+    last = encoder.value()
+    for _ in range(windows):
+        time.sleep_ms(window_ms)
+        position = encoder.value()
+        counts.append(abs(position - last))
+        last = position
+    total = sum(counts)
+    mean = total / windows
+    fluctuation = (max(counts) - min(counts)) / mean if mean else 0
+    return total / expected if expected else 0, fluctuation
+
+
+def _sweep(motor, encoder, microsteps, direction, counts_per_step, start_hz, limit_hz,
+           step_factor, measure_ms, stall_ratio, max_loss, max_fluctuation, on_progress,
+           should_continue):
+    """sweep one mode, returns (last good frequency, bands, stalled),
+    None when stopped
+    """
+    last_good = None
+    bands = []
+    band_start = None
+    stalled = False
+    hz = start_hz
+    try:
+        while hz <= limit_hz:
+            if should_continue is not None and not should_continue():
+                return None
+            if on_progress is not None:
+                on_progress(microsteps, hz)
+            motor.velocity(direction * hz, microsteps, accel=hz * 2)
+            while motor.is_moving() and abs(motor.get_velocity()) < hz - 1:  # ramping up
+                time.sleep_ms(10)
+            time.sleep_ms(100)  # let the ramp's transient die down
+            expected = hz / microsteps * counts_per_step * measure_ms / 1000
+            ratio, fluctuation = _measure(encoder, expected, measure_ms)
+            if ratio < stall_ratio:
+                stalled = True
+                break
+            # a count or two short is quantisation, not lost steps
+            if ratio < 1 - max_loss - 2 / expected or fluctuation > max_fluctuation:
+                if band_start is None:
+                    band_start = last_good if last_good is not None else hz
+            else:
+                if band_start is not None:
+                    bands.append((band_start, hz))
+                    band_start = None
+                last_good = hz
+            if hz < limit_hz:  # the limit itself is tried last
+                hz = min(limit_hz, max(hz + 1, int(hz * step_factor)))
+            else:
+                hz += 1
+    finally:
+        if stalled:  # it can't follow a ramp down, stop it at once
+            motor.stop()
+        else:
+            motor.velocity(0, accel=hz * 2)
+            while motor.is_moving():
+                time.sleep_ms(10)
+    if band_start is not None:  # resonant up to the end, that's the limit
+        last_good = band_start
+        stalled = True  # a limit of the motor, not of the sweep
+    return last_good, bands, stalled
+
+
+def calibrate(
+    motor,
+    encoder,
+    counts_per_step,
+    modes=(1, 2, 4, 8, 16, 32),
+    start_full_hz=20,
+    max_full_hz=1000,
+    step_factor=1.15,
+    measure_ms=400,
+    stall_ratio=0.5,
+    max_loss=0.03,
+    max_fluctuation=0.3,
+    margin=0.8,
+    on_progress=None,
+    should_continue=None,
+):
+    """Sweep the step frequency of each microstep mode, returns a SpeedTable
+    <motor>     (DRV8825) the axis, must be idle
+    <encoder>   (Encoder) on the axis
+    <counts_per_step> (number) encoder counts per full step of the motor
+    <modes>     (tuple) microstep modes to calibrate
+    <start_full_hz> (number) first frequency, in full steps per second
+    <max_full_hz> (number) highest frequency tried, in full steps per
+                second, within the driver's max_tick_hz (micro-)steps per
+                second
+    <step_factor> (number) ratio between the frequencies tried
+    <measure_ms> (number) measurement time per frequency
+    <stall_ratio> (number) stalled below this ratio of counts to steps
+    <max_loss> (number) resonant when more than this fraction of the
+                counts is missing...
+    <max_fluctuation> (number) ...or the counts of the windows vary by
+                more than this fraction of their mean
+    <margin>    (number) fraction of the last good frequency stored as
+                the maximum of a mode that stalled
+    <on_progress> (function) optional, called with (microsteps, hz) at
+                every frequency
+    <should_continue> (function) optional, the calibration stops early
+                when it returns False
+    returns None when stopped early
+    """
+    table = {}
+    direction = 1
+    for microsteps in modes:
+        limit_hz = min(motor.max_tick_hz, max_full_hz * microsteps)
+        result = _sweep(motor, encoder, microsteps, direction, counts_per_step,
+                        start_full_hz * microsteps, limit_hz, step_factor, measure_ms,
+                        stall_ratio, max_loss, max_fluctuation, on_progress, should_continue)
+        if result is None:
+            return None
+        last_good, bands, stalled = result
+        direction = -direction
+        if last_good is None:  # stalled at the first frequency
+            print("calibrate: no usable speed at", microsteps, "microsteps")
+            continue
+        max_hz = min(0xFFFF, int(last_good * margin) if stalled else last_good)
+        table[microsteps] = (max_hz, tuple((low, high) for low, high in bands if low < max_hz))
+        print("calibrate:", microsteps, "microsteps, max", max_hz, "Hz, resonant", bands)
+        time.sleep_ms(500)  # let the axis come to rest
+    return SpeedTable(table)
@@ -56,17 +56,62 @@ This driver was developed after some examples:
     Note: ENABLE pin of DRV8825 may be left unconnected or must be
           pulled low externally for the DRV8825 to become operational.
 
-    Three modes of operation are forseen:
+    Five modes of operation are foreseen:
         - performing a number of steps
         - performing a number of full rotations
         - stepping indefinitely (until stopped)
+        - continuous rotation at a (fractional) speed that can be changed
+          while running, changes are ramped without stopping
+        - moving to a position with an acceleration profile, optionally
+          switching microstep resolution by speed on the way
     In all cases stepping direction, frequency and micro-stepping can be selected
 
+    Positions of the profiled modes are counted in units of 1/32 step
+    (the finest microstep) from the indexer home position at power up
+    or reset, so they stay consistent across resolution changes.
+
+    Idle power: with the "sleep" policy (set_idle_policy) the DRV8825 is
+    put asleep after being idle for a while, but only on a full step
+    position, where the rotor rests in a detent of the unpowered motor
+    and the position count stays valid. idle_poll() must be called
+    periodically for this. Waking never blocks the caller of the
+    velocity/move modes: the timer holds off stepping until the wake-up
+    time has passed, and prewake() wakes the driver ahead of a move.
+
 """
 
 from machine import Pin, Timer
 from time import sleep_ms
 import utime
+try:  # native code hot paths, when the firmware has the native emitter
+    from . import drv8825_native as _native
+except Exception:
+    _native = None
+
+# Fixed point format of the velocity and move mode phase accumulator:
+# velocities are units (1/32 steps) per timer tick scaled by
+# 2**_FRAC_BITS, a (micro)step is taken each time the accumulated phase
+# passes the number of units of one step at the current resolution.
+# Values stay below 2**30 so no long integers are created in the callback.
+_FRAC_BITS = 20
+_ONE = 1 << _FRAC_BITS
+_UNITS = 32  # units per full step (finest microstep resolution)
+
+_WAKE_US = 2000  # wake-up time from sleep, datasheet: maximum 1.7 ms
+
+# The velocity/move mode timer runs at tick_hz >> shift, shift chosen per
+# profile for at least _TICKS_PER_STEP ticks per step at its peak speed,
+# so slow moves don't pay for callbacks that don't step. The profile is
+# planned at the slowest rate (most precise), the per tick values of the
+# running rate are shifted from those without any allocation.
+_TICKS_PER_STEP = 4
+_MAX_TICK_SHIFT = 4  # slowest rate tick_hz / 16, velocities stay < 2**30
+
+# timer callback modes
+_MODE_IDLE = 0
+_MODE_VELOCITY = 1
+_MODE_MOVE = 2
+_MODE_FOLLOW = 3  # stepped by a StepEngine coordinated move
 
 
 class DRV8825(object):
@@ -91,6 +136,8 @@ class DRV8825(object):
         reset_pin=None,
         timer_id=-1,
         steps_per_revolution=200,
+        tick_hz=4000,
+        engine=None,
     ):
         """
         <step_pin>  (number) pin connected to STEP of DRV8825
@@ -102,6 +149,13 @@ class DRV8825(object):
         <timer_id>  (number) timer to use for step timing, the default
                     value -1 (last timer) usually works on most boards
         <steps_per_revolution> (number) Full steps for 360 degrees revolution
+        <tick_hz>   (number) highest timer rate of the velocity and move
+                    modes, the highest step frequency in those modes. The
+                    timer runs slower (down to 1/16) when a profile steps
+                    slowly, a multiple of 16 keeps the rates exact
+        <engine>    (StepEngine) optional, step from this shared engine
+                    (see stepgen.py) instead of a timer of its own,
+                    <timer_id> and <tick_hz> are then ignored
         Notes: - <step_pin> is mandatory.
                - other pins are optional (presumably fixed wired)
                - instances of DRV8825 are started enabled.
@@ -123,35 +177,189 @@ class DRV8825(object):
         if reset_pin is not None:
             self._reset_pin = Pin(reset_pin, Pin.OUT)
         self.steps_per_revolution = steps_per_revolution  # full steps for 360 degrees
-        self._timer = Timer(
-            timer_id, mode=Timer.PERIODIC
-        )  # interval timer for stepping
+        self._max_shift = _MAX_TICK_SHIFT
+        if engine is not None:  # shared timer, a channel stands in for it
+            self._timer = engine.channel()
+            tick_hz = engine.tick_hz
+            self._max_shift = 0  # at the engine's rate
+        else:
+            self._timer = Timer(
+                timer_id, mode=Timer.PERIODIC
+            )  # interval timer for stepping
         self._timer_running = False  # timer is not running yet
         self._free_run_mode = 0  # not running free
         self._actual_pos = 0  # actual position
         self._target_pos = 0  # target position
-
-    def enable(self):
+        self._stepfreq = 0  # steps()/freerun() step frequency, signed
+        self._microsteps = 1  # current resolution
+        self._unit = _UNITS  # units per step at current resolution
+        self._unit_one = _UNITS << _FRAC_BITS  # phase of one step
+        self._abs_pos = 0  # absolute position (units)
+        self._home_pos = 0  # absolute position of the indexer home state
+        # velocity/move mode timer: rate of the slowest shift, highest
+        # rate (a step per tick at most) and the running rate
+        self._slow_hz = tick_hz >> self._max_shift
+        self.max_tick_hz = self._slow_hz << self._max_shift
+        self._tick_shift = self._max_shift
+        self._tick_hz = self._slow_hz
+        self._callback = None  # velocity/move mode timer callback
+        self._mode = _MODE_IDLE  # velocity/move mode not active
+        self._velocity = 0  # current velocity (fixed point units/tick)
+        self._velocity_target = 0  # velocity being ramped towards
+        self._accel = 1  # velocity change per tick (fixed point)
+        self._cruise_shift = self._max_shift  # velocity mode shift at the target
+        # the same per tick of the slowest rate, see _retick()
+        self._target_slow = 0
+        self._accel_slow = 1
+        self._vmax_slow = 0
+        self._vmin_slow = 0
+        self._estop_slow = 1
+        self._phase = 0  # fractional step accumulator
+        self._move_target = 0  # move mode target position (units)
+        self._move_vmax = 0  # move mode cruise velocity
+        self._move_vmin = 0  # move mode start/stop velocity
+        self._ramp_units = 0  # units travelled while accelerating
+        self._final_microsteps = 32  # resolution to end a move with
+        self._jogging = False  # the running move was started by a jog
+        self._bands = ()  # (max velocity (slowest rate), microsteps) fine to coarse
+        # automatic microstep selection: highest step pulse rate before a
+        # coarser resolution is used, and the coarsest resolution allowed
+        self.max_step_hz = self.max_tick_hz // 4
+        self.coarsest_microsteps = 2
+        # emergency stop: requested by emergency_stop(), ramp rate set by
+        # set_stop_decel(), request to standstill time of the last stop
+        self._estop = False
+        self._estop_us = 0
+        self._estop_accel = 1
+        self.stop_count = 0
+        self.last_stop_latency_us = None
+        self.set_stop_decel(20000)
+        # idle power management, see set_idle_policy() and idle_poll()
+        self.idle_policy = "hold"
+        self.idle_ms = 30000
+        self.enabled_watts = 0  # supply power while energised, for stats
+        self._asleep = sleep_pin is not None  # pin starts low
+        self._waking = False  # wake-up time still running
+        self._wake_us = 0  # time of the last wake-up
+        self._wake_ticks = 0  # timer ticks to wait before stepping
+        self._idle_since = utime.ticks_ms()
+        self._stats_ms = self._idle_since
+        self.moving_ms = 0
+        self.holding_ms = 0
+        self.asleep_ms = 0
+        self.sleep_count = 0
+        self.wake_count = 0
+
+    def enable(self, wait=True):
         """Enable the DRV8825
         When pins for sleep and reset are not specified
         reset and sleep pins must be pulled high externally,
         Enable pin may be left unconnected or must be pulled
         low externally.
+        <wait> (bool) wait until the DRV8825 has woken up, when False
+                use wake_remaining_us() to find out when it may step
         """
-        if self._sleep_pin is not None:
-            self._sleep_pin.on()  # wake up
+        self.prewake()
         if self._reset_pin is not None:
+            if not self._reset_pin.value():  # indexer was reset to home
+                self._home_pos = self._abs_pos
             self._reset_pin.on()  # leave reset state
-        sleep_ms(3)  # datasheet: minimum 1.7 ms
+        if wait:
+            utime.sleep_us(self.wake_remaining_us())
 
     def disable(self):
         """Disable the DRV8825"""
         self.stop()  # stop stepping
         if self._sleep_pin is not None:
             self._sleep_pin.off()  # put asleep
+            self._asleep = True
+            self._waking = False
         if self._reset_pin is not None:
             self._reset_pin.off()  # enter reset state
 
+    def prewake(self):
+        """wake the DRV8825 from sleep without waiting for it
+        Call this ahead of a move, the wake-up time then passes before
+        the move starts instead of delaying its first step.
+        Also restarts the idle timeout.
+        """
+        if self._asleep:
+            self._sleep_pin.on()
+            self._wake_us = utime.ticks_us()
+            self._waking = True
+            self._asleep = False
+            self.wake_count += 1
+        self._idle_since = utime.ticks_ms()
+
+    def wake_remaining_us(self):
+        """microseconds until the DRV8825 has woken up, 0 when awake"""
+        if self._waking:
+            remaining = _WAKE_US - utime.ticks_diff(utime.ticks_us(), self._wake_us)
+            if remaining > 0:
+                return remaining
+            self._waking = False
+        return 0
+
+    def set_idle_policy(self, policy="hold", idle_s=30, enabled_watts=None):
+        """what to do when the motor is idle
+        <policy> "hold": stay energised, holding torque at any position
+                 "sleep": put the DRV8825 asleep after <idle_s> seconds
+                 idle, on a full step position only (see module notes)
+        <enabled_watts> (number) supply power while energised, only used
+                 to estimate the energy in power_stats()
+        """
+        if policy not in ("hold", "sleep"):
+            raise ValueError("idle policy must be 'hold' or 'sleep'")
+        self.idle_policy = policy
+        self.idle_ms = int(idle_s * 1000)
+        if enabled_watts is not None:
+            self.enabled_watts = enabled_watts
+
+    def idle_poll(self):
+        """account the time spent moving, holding and asleep since the
+        previous call, and apply the idle policy. Call periodically,
+        the idle timeout is as precise as the calling interval.
+        """
+        now = utime.ticks_ms()
+        elapsed = utime.ticks_diff(now, self._stats_ms)
+        self._stats_ms = now
+        if self._timer_running:
+            self.moving_ms += elapsed
+            self._idle_since = now
+        elif self._asleep:
+            self.asleep_ms += elapsed
+        else:
+            self.holding_ms += elapsed
+            if (self.idle_policy == "sleep"
+                    and self._sleep_pin is not None
+                    and utime.ticks_diff(now, self._idle_since) >= self.idle_ms
+                    and (self._abs_pos - self._home_pos) % _UNITS == 0):
+                self._sleep_pin.off()
+                self._asleep = True
+                self._waking = False
+                self.sleep_count += 1
+
+    def power_state(self):
+        """'moving', 'holding' or 'asleep'"""
+        if self._timer_running:
+            return "moving"
+        return "asleep" if self._asleep else "holding"
+
+    def power_stats(self):
+        """idle and energy statistics accumulated by idle_poll()"""
+        energised_ms = self.moving_ms + self.holding_ms
+        return {
+            "state": self.power_state(),
+            "policy": self.idle_policy,
+            "idle_s": self.idle_ms // 1000,
+            "moving_s": self.moving_ms // 1000,
+            "holding_s": self.holding_ms // 1000,
+            "asleep_s": self.asleep_ms // 1000,
+            "sleeps": self.sleep_count,
+            "wakes": self.wake_count,
+            "energy_wh": round(energised_ms * self.enabled_watts / 3600000, 3),
+        }
+
     def reset(self, state=True, interval=None):
         """Reset the DRV8825 (True) or undo previous reset (False)
         When interval (milliseconds) is specified
@@ -164,8 +372,11 @@ class DRV8825(object):
                 self._reset_pin.off()
                 sleep_ms(interval)  # milliseconds
                 self._reset_pin.on()
+                self._home_pos = self._abs_pos
             else:
                 self._reset_pin.value(state)  # negative logic
+                if state:
+                    self._home_pos = self._abs_pos
 
     def stop(self):
         """Stop stepping, but keep motor enabled (in position),
@@ -173,6 +384,10 @@ class DRV8825(object):
         """
         self._timer.deinit()  # (running or not)
         self._timer_running = False
+        self._mode = _MODE_IDLE
+        self._velocity = 0
+        self._velocity_target = 0
+        self._jogging = False
 
     def resolution(self, microsteps=1):
         """method to set step number of microsteps per full step
@@ -184,15 +399,20 @@ class DRV8825(object):
                 self._microstep_pins[i].value(microstep[i])
             # print("M0,M1,M2: ", ",".join(["{:d}"
             #      .format(self._microstep_pins[m].value()) for m in range(3)]))
+        if microsteps in __class__.microstep_dict:
+            self._microsteps = microsteps
+            self._unit = _UNITS // microsteps
+            self._unit_one = self._unit << _FRAC_BITS
         return microsteps
 
-    def one_step(self, direction):
+    def _one_step_py(self, direction):
         """perform one step (forward if direction > 0, backward if direction < 0)"""
         if direction > 0:
             self._direction_pin.on()   # BACK TO ORIGINAL: positive = HIGH
             utime.sleep_us(2)  # Direction setup time
             self._step_pin.on()  # actual step (rising edge)
             self._actual_pos += 1
+            self._abs_pos += self._unit
             utime.sleep_us(2)  # Minimum 1.9us high pulse for DRV8825
             self._step_pin.off()
             utime.sleep_us(2)  # Minimum 1.9us low pulse for DRV8825
@@ -201,19 +421,33 @@ class DRV8825(object):
             utime.sleep_us(2)  # Direction setup time
             self._step_pin.on()
             self._actual_pos -= 1
+            self._abs_pos -= self._unit
             utime.sleep_us(2)  # Minimum 1.9us high pulse for DRV8825
             self._step_pin.off()
             utime.sleep_us(2)  # Minimum 1.9us low pulse for DRV8825
 
-    def _timer_callback(self, t):
+    def _timer_callback_py(self, t):
         """determine if stepping action opportune
         if true perform one step forward or backward
         """
-        if self._free_run_mode != 0:
+        if self._estop:  # fixed rate modes can't ramp, stop right away
+            self._free_run_mode = 0
+            self._target_pos = self._actual_pos
+            self._halt()
+        elif self._free_run_mode != 0:
             self.one_step(1 if self._free_run_mode > 0 else -1)
         elif self._target_pos != self._actual_pos:  # target not reached yet
             self.one_step(1 if self._target_pos > self._actual_pos else -1)
 
+    # the step hot paths: native code versions (drv8825_native.py) where
+    # available, the Python versions above otherwise
+    if _native is not None:
+        one_step = _native.one_step
+        _timer_callback = _native.timer_callback
+    else:
+        one_step = _one_step_py
+        _timer_callback = _timer_callback_py
+
     def steps(self, steps, microsteps=1, stepfreq=200):
         """move stepper motor a number of steps:
         <steps> (number)
@@ -226,9 +460,11 @@ class DRV8825(object):
         """
         self.resolution(microsteps)  # microstepping (?)
         self.enable()  # enable drv8825 hardware
+        self._mode = _MODE_IDLE
         self._free_run_mode = 0
         self._actual_pos = 0  # new starting point
         self._target_pos = steps  # new target (pos/neg)
+        self._stepfreq = abs(stepfreq) if steps >= 0 else -abs(stepfreq)
         self._timer.init(freq=abs(stepfreq), callback=self._timer_callback)
         self._timer_running = True
 
@@ -259,15 +495,437 @@ class DRV8825(object):
         """
         self._timer.deinit()  # disable timer
         self._timer_running = False
+        self._mode = _MODE_IDLE
         if stepfreq == 0:  # motor stopped
             return
         self.enable()  # enable drv8825 hardware
         self.resolution(microsteps)
         self._free_run_mode = 1 if stepfreq > 0 else -1  # forward/backward
+        self._stepfreq = stepfreq
         self._timer.init(freq=abs(stepfreq), callback=self._timer_callback)
         self._timer_running = True
         return
 
+    def _halt(self):
+        """stop the timer at standstill, completes an emergency stop"""
+        self._timer.deinit()
+        self._timer_running = False
+        self._mode = _MODE_IDLE
+        self._velocity = 0
+        self._phase = 0
+        self._ramp_units = 0
+        self._jogging = False
+        if self._estop:
+            self.last_stop_latency_us = utime.ticks_diff(utime.ticks_us(), self._estop_us)
+            self._estop = False
+
+    def _estop_callback(self):
+        """emergency stop in progress: brake at the maximum deceleration"""
+        v = self._velocity
+        speed = (v if v >= 0 else -v) - self._estop_accel
+        if speed <= 0:
+            self._halt()
+            return
+        self._velocity = speed if v > 0 else -speed
+        self._phase += speed
+        if self._phase >= self._unit_one:
+            self._phase -= self._unit_one
+            self.one_step(1 if v > 0 else -1)
+
+    def _velocity_callback(self, t):
+        """velocity mode: ramp the velocity towards its target and
+        accumulate phase, step when a whole step has accumulated
+        """
+        if self._estop:
+            self._estop_callback()
+            return
+        if self._wake_ticks:  # DRV8825 still waking up
+            self._wake_ticks -= 1
+            return
+        v = self._velocity
+        target = self._velocity_target
+        if v != target:  # ramping
+            a = self._accel
+            if v < target:
+                v = v + a if v + a < target else target
+            else:
+                v = v - a if v - a > target else target
+            self._velocity = v
+            if v == target and target != 0 and self._tick_shift != self._cruise_shift:
+                self._retick(self._cruise_shift)  # ramp done, cruise rate
+                v = self._velocity
+        if v > 0:
+            self._phase += v
+            if self._phase >= self._unit_one:
+                self._phase -= self._unit_one
+                self.one_step(1)
+        elif v < 0:
+            self._phase -= v
+            if self._phase >= self._unit_one:
+                self._phase -= self._unit_one
+                self.one_step(-1)
+        elif target == 0:  # ramped down to a standstill
+            self._halt()
+
+    def _start_profile(self, mode, callback, shift):
+        """start the timer of the velocity/move modes at tick shift <shift>"""
+        self._timer.deinit()
+        self._timer_running = False
+        self._velocity = 0
+        self._retick(shift)
+        self.enable(False)  # enable drv8825 hardware, don't wait for it
+        # hold off stepping for the rest of the wake-up time
+        remaining = self.wake_remaining_us()
+        self._wake_ticks = (remaining * self._tick_hz + 999999) // 1000000
+        self._free_run_mode = 0
+        self._target_pos = self._actual_pos  # no pending steps() move
+        self._phase = 0
+        self._mode = mode
+        self._callback = callback
+        self._timer.init(freq=self._tick_hz, callback=callback)
+        self._timer_running = True
+
+    def _retick(self, shift):
+        """run the velocity/move mode timer at max_tick_hz >> <shift>:
+        the per tick values of the profile follow from those at the
+        slowest rate, the current velocity and wake-up wait are rescaled.
+        Allocates nothing, so a running move can change its rate.
+        """
+        change = shift - self._tick_shift
+        if change > 0:  # slower, more per tick
+            self._velocity <<= change
+            self._wake_ticks >>= change
+        elif change < 0:
+            self._velocity >>= -change
+            self._wake_ticks <<= -change
+        self._tick_shift = shift
+        self._tick_hz = self.max_tick_hz >> shift
+        down = self._max_shift - shift
+        self._velocity_target = self._target_slow >> down
+        self._move_vmax = max(1, self._vmax_slow >> down)
+        self._move_vmin = max(1, self._vmin_slow >> down)
+        self._accel = max(1, self._accel_slow >> (down + down))
+        self._estop_accel = max(1, self._estop_slow >> (down + down))
+        if change and self._timer_running and self._callback is not None:
+            self._timer.init(freq=self._tick_hz, callback=self._callback)
+
+    def _shift_for(self, peak):
+        """the largest tick shift (slowest rate) with at least
+        _TICKS_PER_STEP ticks per step at the current resolution for
+        velocity <peak> (per tick of the slowest rate)
+        """
+        shift = self._max_shift
+        step = self._unit_one // _TICKS_PER_STEP
+        while shift and (peak >> (self._max_shift - shift)) > step:
+            shift -= 1
+        return shift
+
+    def _move_shift(self):
+        """tick shift for the move's peak speed in the current resolution:
+        the cruise speed, or the speed the resolution is left at for a
+        coarser one (see _select_resolution)
+        """
+        peak = self._vmax_slow
+        if self._microsteps != self._final_microsteps:
+            coarsest = self._bands[-1][1]  # taken at any speed
+            for vmax, band_microsteps in self._bands:
+                if band_microsteps == self._microsteps and band_microsteps != coarsest:
+                    peak = vmax if vmax < peak else peak
+                    break
+        return self._shift_for(peak)
+
+    def _to_velocity(self, units_per_second):
+        """units per second to fixed point units per tick of the
+        slowest rate
+        """
+        return int(units_per_second * _ONE / self._slow_hz)
+
+    def velocity(self, stepfreq, microsteps=None, accel=400):
+        """rotate continuously at a speed that can be changed on the fly
+        <stepfreq> (number)
+                (micro-)steps per second, fractions allowed,
+                positive value: forward, negative: backward
+                When already rotating the speed (and direction) is ramped
+                from the current speed to the new one without stopping,
+                0 ramps down and stops the timer at standstill.
+        <microsteps> (integer)
+                Supported values: 1,2,4,8,16,32
+                Only applied when starting from standstill.
+        <accel> (number)
+                ramp rate in (micro-)steps per second per second
+        """
+        running = self._mode == _MODE_VELOCITY
+        if not running:
+            if stepfreq == 0:
+                return
+            self.resolution(microsteps if microsteps is not None else 1)
+        unit = self._unit
+        target = self._to_velocity(stepfreq * unit)
+        limit = self._unit_one << self._max_shift  # a step per tick at max_tick_hz
+        target = max(-limit, min(limit, target))
+        self._target_slow = target
+        self._accel_slow = max(1, int(accel * unit * _ONE / (self._slow_hz * self._slow_hz)))
+        self._cruise_shift = self._shift_for(target if target >= 0 else -target)
+        if not running:
+            self._start_profile(_MODE_VELOCITY, self._velocity_callback, self._cruise_shift)
+            return
+        # ramping from the current speed, at the rate of the faster one
+        v = self._velocity
+        v = (v if v >= 0 else -v) << (self._max_shift - self._tick_shift)
+        self._retick(min(self._cruise_shift, self._shift_for(v)))
+
+    def get_velocity(self):
+        """getter method
+        return the current speed in (micro-)steps per second
+        """
+        if self._mode == _MODE_IDLE:  # steps()/freerun() at a fixed rate
+            return self._stepfreq if self.is_moving() else 0
+        return self._velocity * self._tick_hz / self._unit_one
+
+    def _select_resolution(self, distance, speed):
+        """called on full step boundaries during a move: pick the finest
+        resolution whose step rate at this speed stays within max_step_hz,
+        and the final resolution for the last full steps
+        """
+        microsteps = self._final_microsteps
+        if distance >= 2 * _UNITS or distance <= -2 * _UNITS:
+            for vmax, band_microsteps in self._bands:
+                microsteps = band_microsteps
+                if speed <= vmax:
+                    break
+        if microsteps != self._microsteps:
+            self.resolution(microsteps)
+            self._phase %= self._unit_one
+            shift = self._move_shift()
+            if shift != self._tick_shift:
+                self._retick(shift)
+
+    def _move_callback(self, t):
+        """move mode: trapezoidal profile towards the (changeable) target.
+        The distance needed to brake equals the distance travelled while
+        accelerating (_ramp_units), so the profile re-plans every tick from
+        the current velocity whatever the target or speed limit is now.
+        """
+        if self._estop:
+            self._estop_callback()
+            return
+        if self._wake_ticks:  # DRV8825 still waking up
+            self._wake_ticks -= 1
+            return
+        v = self._velocity
+        distance = self._move_target - self._abs_pos
+        speed = v if v >= 0 else -v
+        vmin = self._move_vmin
+        a = self._accel
+        if distance == 0 and speed <= vmin:  # arrived
+            self._halt()
+            return
+        if v != 0 and (distance == 0 or (v > 0) != (distance > 0)):
+            # moving the wrong way (overshoot or target moved behind us),
+            # brake and turn around
+            direction = 1 if v > 0 else -1
+            new_speed = speed - a
+            if new_speed <= vmin:
+                new_speed = 0
+                self._ramp_units = 0
+        else:
+            direction = 1 if distance > 0 else -1
+            remaining = distance if distance > 0 else -distance
+            if speed < vmin:
+                new_speed = vmin
+            elif remaining <= self._ramp_units:  # brake
+                new_speed = speed - a if speed - a > vmin else vmin
+            elif speed < self._move_vmax:
+                new_speed = speed + a if speed + a < self._move_vmax else self._move_vmax
+            elif speed > self._move_vmax:
+                new_speed = speed - a if speed - a > self._move_vmax else self._move_vmax
+            else:
+                new_speed = speed
+        self._velocity = new_speed if direction > 0 else -new_speed
+        if new_speed == 0:
+            return
+        self._phase += new_speed
+        if self._phase >= self._unit_one:
+            self._phase -= self._unit_one
+            unit = self._unit
+            if new_speed > speed:
+                self._ramp_units += unit
+            elif new_speed < speed:
+                self._ramp_units = self._ramp_units - unit if self._ramp_units > unit else 0
+            self.one_step(direction)
+            if not (self._abs_pos - self._home_pos) & (_UNITS - 1):  # full step boundary
+                self._select_resolution(self._move_target - self._abs_pos, new_speed)
+
+    def move_to(self, target, speed, accel=None, min_speed=None, microsteps=32, auto_microsteps=True):
+        """move to an absolute position with acceleration and deceleration
+        <target> (number)
+                position in units of 1/32 step, see position()
+        <speed> (number)
+                cruise speed in units (1/32 steps) per second
+        <accel> (number)
+                units per second per second, default reaches <speed>
+                in half a second
+        <min_speed> (number)
+                start and stop speed in units per second, default
+                1/5 of <speed>
+        <microsteps> (integer)
+                resolution the move ends with, <target> is rounded to it
+        <auto_microsteps> (bool)
+                when True the resolution is switched on the way by speed,
+                coarse while fast (fewer step pulses) and back to
+                <microsteps> while decelerating into the final position.
+                Coarser resolutions are only selected on full step
+                boundaries where all resolutions share an indexer state,
+                so the switch is glitch free and the position exact.
+        """
+        unit = _UNITS // microsteps
+        target = self._home_pos + ((target - self._home_pos) // unit) * unit
+        self._final_microsteps = microsteps
+        self._jogging = False  # until jog() or jog_hold() says otherwise
+        if accel is None:
+            accel = speed * 2
+        if min_speed is None:
+            min_speed = speed / 5
+        slow_hz = self._slow_hz
+        limit = _UNITS << (_FRAC_BITS + self._max_shift)  # a full step per tick at max_tick_hz
+        self._vmax_slow = max(1, min(limit, self._to_velocity(speed)))
+        self._vmin_slow = max(1, min(self._vmax_slow, self._to_velocity(min_speed)))
+        self._accel_slow = max(1, int(accel * _ONE / (slow_hz * slow_hz)))
+        bands = []
+        if auto_microsteps:
+            for band_microsteps in (32, 16, 8, 4, 2, 1):
+                if self.coarsest_microsteps <= band_microsteps <= microsteps:
+                    bands.append((self._to_velocity(self.max_step_hz * (_UNITS // band_microsteps)), band_microsteps))
+        else:
+            bands.append((self._vmax_slow, microsteps))
+        self._bands = bands
+        self._move_target = target
+        if self._mode == _MODE_MOVE:
+            self._retick(self._move_shift())
+            return  # running profile re-plans towards the new target
+        # start in the current resolution when the move can be made in it,
+        # else in the final one if the position is on its grid, else in
+        # the finest which is valid anywhere. coarser resolutions follow
+        # on full step boundaries
+        if not auto_microsteps:
+            self.resolution(microsteps)
+        elif (target - self._abs_pos) % self._unit or not (
+                self.coarsest_microsteps <= self._microsteps <= microsteps):
+            self.resolution(microsteps if not (self._abs_pos - self._home_pos) % unit else 32)
+        self._ramp_units = 0
+        self._start_profile(_MODE_MOVE, self._move_callback, self._move_shift())
+
+    def _follow_start(self):
+        """become a follower of a StepEngine coordinated move, which steps
+        this axis and ends the mode with _halt()
+        returns microseconds until the DRV8825 has woken up
+        """
+        self.stop()
+        self.enable(False)
+        self._mode = _MODE_FOLLOW
+        self._timer_running = True  # for emergency_stop() and idle_poll()
+        return self.wake_remaining_us()
+
+    def move(self, units, speed, **kwargs):
+        """move a relative distance in units of 1/32 step,
+        see move_to() for the other arguments
+        """
+        self.move_to(self._abs_pos + units, speed, **kwargs)
+
+    def set_stop_decel(self, decel):
+        """set the emergency stop deceleration in units (1/32 steps) per
+        second per second, the fastest the load can be braked without
+        losing steps. Converted once here so a stop costs nothing extra.
+        """
+        self._estop_slow = max(1, int(decel * _ONE / (self._slow_hz * self._slow_hz)))
+        self._estop_accel = max(1, self._estop_slow >> 2 * (self._max_shift - self._tick_shift))
+
+    def emergency_stop(self):
+        """stop as fast as possible without losing steps
+        Safe to call from a (hard) interrupt handler: it only flags the
+        request, the step timer callback then brakes at the emergency
+        deceleration. The time from this call to standstill is stored in
+        last_stop_latency_us, stop_count counts the requests.
+        """
+        self._estop_us = utime.ticks_us()
+        self.stop_count += 1
+        if self._timer_running:
+            self._estop = True
+        else:
+            self.last_stop_latency_us = 0
+
+    def jog(self, units, speed, **kwargs):
+        """add <units> (1/32 steps) to the target of the running move,
+        or start a move when idle. Repeated jogs extend the move in place
+        without slowing down in between, see move_to() for the arguments
+        """
+        base = self._move_target if self._mode == _MODE_MOVE else self._abs_pos
+        self.move_to(base + units, speed, **kwargs)
+        self._jogging = self._mode == _MODE_MOVE
+
+    def jog_hold(self, direction, speed, lease_ms=500, **kwargs):
+        """press-and-hold jogging: keep moving in <direction> (1 or -1)
+        at <speed> units per second. Each call is a heartbeat that moves
+        the target <lease_ms> of travel plus the braking distance ahead,
+        so the motor keeps going while heartbeats arrive and decelerates
+        to a stop if they cease, see move_to() for the other arguments
+        """
+        ahead = speed * lease_ms // 1000 + self._ramp_units
+        self.move_to(self._abs_pos + (ahead if direction > 0 else -ahead), speed, **kwargs)
+        self._jogging = self._mode == _MODE_MOVE
+
+    def jog_release(self):
+        """end press-and-hold jogging: stop after the braking distance.
+        Does nothing unless the running move was started by jog() or
+        jog_hold(), other moves keep their target
+        """
+        if self._mode != _MODE_MOVE or not self._jogging:
+            return
+        v = self._velocity
+        brake = self._ramp_units if v > 0 else -self._ramp_units if v < 0 else 0
+        self._move_target = self._abs_pos + brake
+        unit = _UNITS // self._final_microsteps  # keep target on the final grid
+        self._move_target = self._home_pos + ((self._move_target - self._home_pos) // unit) * unit
+
+    def is_moving(self):
+        """True while the step timer runs and has steps to take: a
+        velocity, move or follow mode profile, freerun(), or a steps()
+        move that hasn't reached its target yet
+        """
+        return self._timer_running and (
+            self._mode != _MODE_IDLE
+            or self._free_run_mode != 0
+            or self._target_pos != self._actual_pos
+        )
+
+    def position(self):
+        """getter method
+        return absolute position in units of 1/32 step
+        """
+        return self._abs_pos
+
+    def home_position(self):
+        """getter method
+        return the position of the indexer home state, see recover_position()
+        """
+        return self._home_pos
+
+    def recover_position(self, units, home=0):
+        """set the position after the indexer was reset, e.g. by a power
+        loss, with the motor standing at a known position
+        <units> (number) last known position in units of 1/32 step
+        <home> (number) indexer home position that <units> relates to
+        The indexer restarts in its home state, which is repeated every
+        4 full steps: energising the motor pulls the rotor to the nearest
+        such position, the position counter is set to it. So <units> must
+        be within 2 full steps of where the rotor really is, e.g. the
+        middle of an interrupted move shorter than 4 full steps.
+        """
+        period = 4 * _UNITS
+        units = home + ((units - home + period // 2) // period) * period
+        self._abs_pos = units
+        self._home_pos = units
+
     def get_progress(self):
         """getter method
         return steps taken so far to reach target (negative with CCW!)
@@ -284,4 +942,3 @@ class DRV8825(object):
 
 
 #
-
@@ -0,0 +1,46 @@
+"""
+    Native code versions of the DRV8825 step hot paths
+
+    Same logic as DRV8825._one_step_py and DRV8825._timer_callback_py,
+    compiled to machine code by the MicroPython native emitter.
+    drv8825.py uses these when this module can be imported, that fails
+    on firmware without the native emitter and on CPython.
+    Keep in step with the Python versions in drv8825.py.
+"""
+
+import micropython
+import utime
+
+
+@micropython.native
+def one_step(self, direction):
+    if direction > 0:
+        self._direction_pin.on()
+        utime.sleep_us(2)  # Direction setup time
+        self._step_pin.on()  # actual step (rising edge)
+        self._actual_pos += 1
+        self._abs_pos += self._unit
+        utime.sleep_us(2)  # Minimum 1.9us high pulse for DRV8825
+        self._step_pin.off()
+        utime.sleep_us(2)  # Minimum 1.9us low pulse for DRV8825
+    elif direction < 0:
+        self._direction_pin.off()
+        utime.sleep_us(2)  # Direction setup time
+        self._step_pin.on()
+        self._actual_pos -= 1
+        self._abs_pos -= self._unit
+        utime.sleep_us(2)  # Minimum 1.9us high pulse for DRV8825
+        self._step_pin.off()
+        utime.sleep_us(2)  # Minimum 1.9us low pulse for DRV8825
+
+
+@micropython.native
+def timer_callback(self, t):
+    if self._estop:  # fixed rate modes can't ramp, stop right away
+        self._free_run_mode = 0
+        self._target_pos = self._actual_pos
+        self._halt()
+    elif self._free_run_mode != 0:
+        self.one_step(1 if self._free_run_mode > 0 else -1)
+    elif self._target_pos != self._actual_pos:  # target not reached yet
+        self.one_step(1 if self._target_pos > self._actual_pos else -1)
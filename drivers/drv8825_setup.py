@@ -10,8 +10,10 @@ from .drv8825 import DRV8825
 from .switch import Switch
 
 
-def setup_stepper():
-    """setup for DRV8825 stepper driver, returns an instance or None"""
+def setup_stepper(engine=None):
+    """setup for DRV8825 stepper driver, returns an instance or None
+    <engine> optional StepEngine (stepgen.py) to step from a shared timer
+    """
     if sys.platform == "esp32":  # ====== ESP32 wiring ====
         direction_pin = 2  # DIR
         step_pin = 5  # STEP
@@ -28,7 +30,7 @@ def setup_stepper():
         print("Provide pin wiring of DRV8825 for", sys.platform)
         return None
     # Instance of DRV8825 class
-    return DRV8825(step_pin, direction_pin, resolution_pins, sleep_pin, reset_pin)
+    return DRV8825(step_pin, direction_pin, resolution_pins, sleep_pin, reset_pin, engine=engine)
 
 
 def setup_rotary():
@@ -45,14 +47,16 @@ def setup_rotary():
     return Encoder(sw1, sw2)  # rotary with push button
 
 
-def setup_switches():
-    """setup for 2 end switches, returns a tuple or None"""
+def setup_switches(button_callback=None):
+    """setup for button and 2 end switches, returns a tuple or None
+    <button_callback> is called from the button interrupt handler
+    """
     if sys.platform == "esp32":  # ====== ESP32 wiring ====
-        button = Switch(34)
+        button = Switch(34, button_callback)
         switch1 = Switch(13)
         switch2 = Switch(15)
     elif sys.platform == "rp2":  # ====== RP2040 wiring ====
-        button = Switch(2)
+        button = Switch(2, button_callback)
         switch1 = Switch(14)
         switch2 = Switch(15)
     else:
@@ -0,0 +1,24 @@
+# encoder_native.py
+
+# Native code versions of the Encoder pin interrupt handlers, same logic
+# as Encoder._x_callback_py and Encoder._y_callback_py. encoder_portable.py
+# uses these when this module can be imported, that fails on firmware
+# without the native emitter and on CPython.
+
+import micropython
+
+
+@micropython.native
+def x_callback(self, pin_x):
+    if (x := pin_x()) != self._x:  # Reject short pulses
+        self._x = x
+        self.forward = x ^ self.pin_y()
+        self._pos += 1 if self.forward else -1
+
+
+@micropython.native
+def y_callback(self, pin_y):
+    if (y := pin_y()) != self._y:
+        self._y = y
+        self.forward = y ^ self.pin_x() ^ 1
+        self._pos += 1 if self.forward else -1
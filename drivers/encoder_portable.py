@@ -7,6 +7,10 @@
 # Released under the MIT License (MIT) - see LICENSE file
 
 from machine import Pin
+try:  # native code interrupt handlers, when the firmware has the native emitter
+    from . import encoder_native as _native
+except Exception:
+    _native = None
 
 class Encoder:
     def __init__(self, pin_x, pin_y, scale=1):
@@ -24,18 +28,25 @@ class Encoder:
             self.x_interrupt = pin_x.irq(trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, handler=self.x_callback)
             self.y_interrupt = pin_y.irq(trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, handler=self.y_callback)
 
-    def x_callback(self, pin_x):
+    def _x_callback_py(self, pin_x):
         if (x := pin_x()) != self._x:  # Reject short pulses
             self._x = x
             self.forward = x ^ self.pin_y()
             self._pos += 1 if self.forward else -1
 
-    def y_callback(self, pin_y):
+    def _y_callback_py(self, pin_y):
         if (y := pin_y()) != self._y:
             self._y = y
             self.forward = y ^ self.pin_x() ^ 1
             self._pos += 1 if self.forward else -1
 
+    if _native is not None:  # see encoder_native.py
+        x_callback = _native.x_callback
+        y_callback = _native.y_callback
+    else:
+        x_callback = _x_callback_py
+        y_callback = _y_callback_py
+
     def position(self, value=None):
         if value is not None:
             self._pos = round(value / self.scale)  # Improvement provided by @IhorNehrutsa
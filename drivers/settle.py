@@ -0,0 +1,179 @@
+"""
+    Settle detection after a move, to fire a frame as soon as the platter
+    is still
+
+    A loaded platter overshoots and rocks for a while after the last
+    step. With an Encoder (encoder_portable.py) on the platter its
+    position is sampled every few milliseconds and the platter counts as
+    settled once, over the last window, it moved less than
+    <max_velocity> and rocked less than <max_oscillation>. Without an
+    encoder the settle time is assumed: <step_settle_ms> after the last
+    step. Either way the wait is kept between <min_dwell_ms> and
+    <max_dwell_ms>.
+
+    The settle times are collected in a histogram, stats() reports their
+    distribution so the dwell bounds (and the total capture time) can be
+    trimmed with confidence.
+
+    Usage:
+        settle = SettleDetector(mot, encoder)
+        mot.move(3200, 1600)
+        while mot.is_moving():
+            time.sleep_ms(10)
+        settle.wait()  # returns the settle time in ms
+        fire_frame()
+
+"""
+
+import time
+
+_BUCKET_MS = 10  # histogram resolution
+
+
+class SettleDetector(object):
+    """Waits until the platter has settled after a move"""
+
+    def __init__(
+        self,
+        motor,
+        encoder=None,
+        window_ms=60,
+        max_velocity=20,
+        max_oscillation=1,
+        step_settle_ms=400,
+        min_dwell_ms=100,
+        max_dwell_ms=3000,
+        sample_ms=5,
+    ):
+        """
+        <motor>     (DRV8825) the motor that moved, the wait starts when
+                    it has stopped stepping
+        <encoder>   (Encoder) optional, on the platter, None to assume
+                    <step_settle_ms> instead of measuring
+        <window_ms> (number) length of the measuring window
+        <max_velocity> (number) settled below this drift, encoder counts
+                    per second over the window
+        <max_oscillation> (number) settled when the encoder position
+                    varied by at most this many counts over the window
+        <step_settle_ms> (number) settle time assumed without an encoder
+        <min_dwell_ms> (number) shortest wait, e.g. for the camera
+        <max_dwell_ms> (number) longest wait, the frame fires anyway then
+        <sample_ms> (number) encoder sampling interval
+        """
+        self.motor = motor
+        self.encoder = encoder
+        self.window_ms = window_ms
+        self.max_velocity = max_velocity
+        self.max_oscillation = max_oscillation
+        self.step_settle_ms = step_settle_ms
+        self.min_dwell_ms = min_dwell_ms
+        self.max_dwell_ms = max_dwell_ms
+        self.sample_ms = sample_ms
+        self.last_settle_ms = None
+        self._samples = [0] * max(2, window_ms // sample_ms + 1)
+        self.reset_stats()
+
+    def reset_stats(self):
+        """clear the settle time distribution"""
+        self._histogram = [0] * (self.max_dwell_ms // _BUCKET_MS + 1)
+        self._count = 0
+        self._total_ms = 0
+        self._min_ms = None
+        self._max_ms = 0
+        self.timeouts = 0  # waits that ended at <max_dwell_ms>
+
+    def _settled(self):
+        """True when the window of encoder samples is still enough"""
+        samples = self._samples
+        oscillation = max(samples) - min(samples)
+        velocity = abs(samples[-1] - samples[0]) * 1000 // self.window_ms
+        return oscillation <= self.max_oscillation and velocity <= self.max_velocity
+
+    def _measure(self, start, should_continue):
+        """wait for a still window of encoder samples, returns True when
+        settled, False at <max_dwell_ms> or when stopped
+        """
+        samples = self._samples
+        length = len(samples)
+        filled = 0
+        while time.ticks_diff(time.ticks_ms(), start) < self.max_dwell_ms:
+            if should_continue is not None and not should_continue():
+                return False
+            position = self.encoder.value()
+            if filled < length:
+                samples[filled] = position
+                filled += 1
+            else:  # slide the window, it's a few samples only
+                samples.pop(0)
+                samples.append(position)
+            if filled == length and self._settled():
+                return True
+            time.sleep_ms(self.sample_ms)
+        return False
+
+    def wait(self, should_continue=None):
+        """Block until the platter has settled, within the dwell bounds
+        <should_continue> optional function, the wait ends early (and
+        isn't counted) when it returns False
+        returns the time waited in ms, None if ended early
+        """
+        while self.motor.is_moving():
+            time.sleep_ms(1)
+        start = time.ticks_ms()
+        if self.encoder is not None:
+            settled = self._measure(start, should_continue)
+        else:
+            settled = True
+            while time.ticks_diff(time.ticks_ms(), start) < self.step_settle_ms:
+                if should_continue is not None and not should_continue():
+                    return None
+                time.sleep_ms(min(20, self.step_settle_ms))
+        if should_continue is not None and not should_continue():
+            return None
+        elapsed = time.ticks_diff(time.ticks_ms(), start)
+        if elapsed < self.min_dwell_ms:
+            time.sleep_ms(self.min_dwell_ms - elapsed)
+            elapsed = self.min_dwell_ms
+        self._record(elapsed, settled)
+        return elapsed
+
+    def _record(self, settle_ms, settled):
+        self.last_settle_ms = settle_ms
+        if not settled:
+            self.timeouts += 1
+        self._histogram[min(settle_ms, self.max_dwell_ms) // _BUCKET_MS] += 1
+        self._count += 1
+        self._total_ms += settle_ms
+        if self._min_ms is None or settle_ms < self._min_ms:
+            self._min_ms = settle_ms
+        if settle_ms > self._max_ms:
+            self._max_ms = settle_ms
+
+    def percentile(self, fraction):
+        """settle time in ms that <fraction> (0..1) of the waits stayed
+        within, to the histogram resolution
+        """
+        if self._count == 0:
+            return None
+        target = fraction * self._count
+        seen = 0
+        for bucket, count in enumerate(self._histogram):
+            seen += count
+            if seen >= target:
+                return (bucket + 1) * _BUCKET_MS
+        return self.max_dwell_ms
+
+    def stats(self):
+        """settle time distribution of the waits so far"""
+        return {
+            "mode": "encoder" if self.encoder is not None else "step timing",
+            "frames": self._count,
+            "last_ms": self.last_settle_ms,
+            "min_ms": self._min_ms,
+            "mean_ms": self._total_ms // self._count if self._count else None,
+            "p50_ms": self.percentile(0.5),
+            "p90_ms": self.percentile(0.9),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self._max_ms if self._count else None,
+            "timeouts": self.timeouts,
+        }
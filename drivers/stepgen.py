@@ -0,0 +1,188 @@
+"""
+    Shared step generator for several DRV8825 axes
+
+    A StepEngine runs one fixed rate timer for any number of steppers,
+    instead of a machine.Timer per DRV8825. Each axis gets a channel
+    that stands in for its timer: at every tick the engine calls the
+    callbacks of the active channels in turn, so the interrupt load
+    grows linearly with the number of moving axes and all axes step on
+    the same tick grid.
+
+    Channels started at a lower rate than the tick rate (the legacy
+    steps(), revolutions() and freerun() modes) are divided down with a
+    DDA phase accumulator, their rate is rounded to the tick grid.
+
+    move_linear() makes a coordinated move: the axis with the longest
+    distance runs the acceleration profile and the other axes follow
+    it with Bresenham error accumulators, one step at most per step of
+    the leading axis. All axes start on the same tick and finish on the
+    same step, the path is a straight line whatever the speed profile.
+    An emergency stop of any axis brakes the whole group along the line.
+
+    Usage:
+        engine = StepEngine()
+        pan = DRV8825(7, 6, (12, 11, 10), 8, 9, engine=engine)
+        tilt = DRV8825(3, 4, (13, 16, 17), 18, 19, engine=engine)
+        engine.move_linear(((pan, 3200), (tilt, -800)), 1600)
+
+"""
+
+from machine import Timer
+
+_FRAC_BITS = 20  # fixed point of the channel rate divider
+_ONE = 1 << _FRAC_BITS
+
+
+class _Channel(object):
+    """timer replacement of one axis: init(freq, callback) and deinit()"""
+
+    def __init__(self, engine):
+        self._engine = engine
+        self.callback = None  # None while stopped
+        self._rate = _ONE  # fraction of the ticks that call back
+        self._phase = 0
+
+    def init(self, freq=None, callback=None, **kwargs):
+        """start calling <callback> <freq> times per second"""
+        tick_hz = self._engine.tick_hz
+        self._rate = min(_ONE, max(1, int(abs(freq) * _ONE / tick_hz)))
+        self._phase = 0
+        self.callback = callback
+        self._engine._start()
+
+    def deinit(self):
+        """stop calling back"""
+        self.callback = None
+
+
+class _Group(object):
+    """axes of a coordinated move: the leader and its followers"""
+
+    def __init__(self, leader, distance, followers):
+        self.leader = leader
+        self.last_pos = leader.position()
+        self.forward = distance > 0  # leader direction along the path
+        self.distance = abs(distance)  # leader distance in steps
+        # per follower: [axis, distance in steps, Bresenham error, direction]
+        self.followers = [[axis, abs(steps), abs(distance) // 2, 1 if steps > 0 else -1]
+                          for axis, steps in followers]
+
+
+class StepEngine(object):
+    """One timer stepping any number of DRV8825 axes"""
+
+    def __init__(self, timer_id=-1, tick_hz=4000):
+        """
+        <timer_id>  (number) timer to use, see DRV8825
+        <tick_hz>   (number) tick rate, the highest step frequency of
+                    every axis
+        """
+        self.tick_hz = tick_hz
+        self._timer = Timer(timer_id, mode=Timer.PERIODIC)
+        self._timer_running = False
+        self._channels = []
+        self._groups = []
+
+    def channel(self):
+        """a new channel, for DRV8825(engine=...) which calls this"""
+        channel = _Channel(self)
+        self._channels.append(channel)
+        return channel
+
+    def _start(self):
+        if not self._timer_running:
+            self._timer_running = True
+            self._timer.init(freq=self.tick_hz, callback=self._tick)
+
+    def _tick(self, t):
+        """step all active channels, then the followers of coordinated moves"""
+        active = False
+        for channel in self._channels:
+            callback = channel.callback
+            if callback is not None:
+                active = True
+                if channel._rate == _ONE:
+                    callback(channel)
+                else:
+                    channel._phase += channel._rate
+                    if channel._phase >= _ONE:
+                        channel._phase -= _ONE
+                        callback(channel)
+        if self._groups:
+            self._follow()
+        elif not active:  # nothing to step, rest until a channel starts
+            self._timer.deinit()
+            self._timer_running = False
+
+    def _follow(self):
+        """Bresenham: advance the followers for each step of the leader"""
+        groups = self._groups
+        for i in range(len(groups) - 1, -1, -1):
+            group = groups[i]
+            leader = group.leader
+            pos = leader._abs_pos
+            if pos != group.last_pos:
+                along = (pos > group.last_pos) == group.forward
+                group.last_pos = pos
+                distance = group.distance
+                for follower in group.followers:
+                    if along:
+                        follower[2] += follower[1]
+                        if follower[2] >= distance:
+                            follower[2] -= distance
+                            follower[0].one_step(follower[3])
+                    else:  # leader stepped back, retrace
+                        follower[2] -= follower[1]
+                        if follower[2] < 0:
+                            follower[2] += distance
+                            follower[0].one_step(-follower[3])
+            if not leader.is_moving():  # leader arrived or stopped
+                for follower in group.followers:
+                    follower[0]._halt()
+                groups.pop(i)
+            else:
+                for follower in group.followers:
+                    if follower[0]._estop:  # brake the whole group
+                        if not leader._estop:
+                            leader.emergency_stop()
+                        break
+
+    def move_linear(self, moves, speed, accel=None, min_speed=None, microsteps=32):
+        """coordinated relative move of several axes along a straight line
+        <moves> (sequence) (axis, units) pairs, units of 1/32 step
+        <speed> (number) cruise speed of the axis with the longest
+                distance, units per second
+        <accel>, <min_speed> see DRV8825.move_to(), for that axis
+        <microsteps> (integer) resolution of all axes during the move,
+                distances are rounded to it
+        Axes must be attached to this engine and idle.
+        """
+        unit = 32 // microsteps
+        steps = []
+        for axis, units in moves:
+            if getattr(axis._timer, "_engine", None) is not self:
+                raise ValueError("axis is not attached to this engine")
+            if axis.is_moving():
+                raise ValueError("axis is moving")
+            axis.resolution(microsteps)
+            # distance to the target on the <microsteps> grid, in steps
+            target = axis._home_pos + ((axis._abs_pos + units - axis._home_pos) // unit) * unit
+            steps.append((axis, (target - axis._abs_pos) // unit))
+        leader, distance = steps[0]
+        for axis, axis_steps in steps:
+            if abs(axis_steps) > abs(distance):
+                leader, distance = axis, axis_steps
+        if distance == 0:
+            return
+        followers = [(axis, axis_steps) for axis, axis_steps in steps
+                     if axis is not leader and axis_steps != 0]
+        wake_us = 0
+        for axis, axis_steps in followers:
+            wake_us = max(wake_us, axis._follow_start())
+        group = _Group(leader, distance, followers)  # before the leader moves
+        # followers step on the leader's steps, so at most one per step
+        leader.move(distance * unit, speed, accel=accel, min_speed=min_speed,
+                    microsteps=microsteps, auto_microsteps=False)
+        leader._wake_ticks = max(leader._wake_ticks, (wake_us * self.tick_hz + 999999) // 1000000)
+        if followers:
+            self._groups.append(group)
@@ -10,9 +10,14 @@ from machine import Pin
 from time import ticks_ms
 
 class Switch(object):
-    def __init__(self, switch):
-        """ <switch> (number) GPIO pin """
+    def __init__(self, switch, callback=None):
+        """ <switch> (number) GPIO pin
+            <callback> (callable) optional, called without arguments from
+                       the interrupt handler on each accepted press, so it
+                       must be interrupt safe (no memory allocation)
+        """
         self._switch = Pin(switch, Pin.IN, Pin.PULL_UP)
+        self._user_callback = callback
         self._switch_interrupt = False              # set by switch-ISR, reset by switch() method
         self._debounce_ticks_ms = ticks_ms()        # remember last switch interrupt time
         try:
@@ -25,6 +30,8 @@ class Switch(object):
         if (ticks_ms() - self._debounce_ticks_ms) > 500:    # skip switch bounces
             self._switch_interrupt = True           # mark 'interrupt occurred'
             self._debounce_ticks_ms = ticks_ms()    # update time of last accepted interrupt
+            if self._user_callback is not None:
+                self._user_callback()
 
     def switch(self):
         """ Indicator of Pin interrupt
@@ -0,0 +1,186 @@
+"""
+    Motion telemetry recorder
+
+    Samples what the motor actually did: the commanded position, the
+    position of an Encoder (encoder_portable.py) if there is one, the step
+    rate and the lag of the loop taking the samples. The records are packed
+    into a preallocated ring buffer, so recording allocates nothing and the
+    newest <capacity> samples are kept.
+
+    With a <spill_path> every block of <spill_records> samples is also
+    appended to that file, in one write, so a recording can be longer than
+    the buffer. <write> can defer the block (e.g. while a flash write would
+    stall the motor): it's retried with the next sample, and records
+    overwritten in the buffer before they could be written are counted as
+    lost.
+
+    csv() generates the recording as CSV rows, a few at a time, to stream
+    it without building the whole file in memory.
+
+    Usage:
+        telemetry = TelemetryRecorder(mot, encoder, capacity=512)
+        telemetry.start()
+        # every few ms, from the loop being measured:
+        telemetry.sample(lag_ms)
+        for chunk in telemetry.csv():
+            ...
+
+"""
+
+import struct
+import time
+
+# ms since start, commanded position (1/32 steps), encoder counts,
+# step rate ((micro-)steps per second at the active resolution), loop lag ms
+RECORD = "<IiifH"
+RECORD_SIZE = struct.calcsize(RECORD)
+CSV_HEADER = "ms,position,encoder,step_hz,lag_ms\n"
+_CSV_ROWS = 16  # rows per generated chunk
+
+
+class TelemetryRecorder(object):
+    """Ring buffer of packed motion samples"""
+
+    def __init__(self, motor, encoder=None, capacity=512, spill_path=None, write=None,
+                 spill_records=128, max_spill_bytes=256 * 1024):
+        """
+        <motor>     (DRV8825) the motor to record
+        <encoder>   (Encoder) optional, recorded as 0 without one
+        <capacity>  (number) samples kept in RAM, RECORD_SIZE bytes each
+        <spill_path> (str) optional file the samples are appended to in
+                    blocks, restarted by start()
+        <write>     (function) optional, write(path, data) appends a block
+                    and returns False to keep it for later, <data> None
+                    empties the file. By default the file is written
+                    directly
+        <spill_records> (number) samples per block, at most <capacity>
+        <max_spill_bytes> (number) spilling ends when the file is this long
+        """
+        self.motor = motor
+        self.encoder = encoder
+        self.capacity = capacity
+        self.spill_path = spill_path
+        self.write = write or self._append
+        self.spill_records = min(spill_records, capacity)
+        self.max_spill_bytes = max_spill_bytes
+        self._buffer = bytearray(capacity * RECORD_SIZE)
+        self.recording = False
+        self._start_ms = time.ticks_ms()
+        self._total = 0  # samples since start, the next one's sequence number
+        self._spilled = 0  # sequence number of the first sample not written
+        self._written = 0  # samples handed to write()
+        self.lost = 0  # samples overwritten before they were written
+
+    def start(self):
+        """Clear the buffer (and the spill file) and start recording"""
+        self._start_ms = time.ticks_ms()
+        self._total = 0
+        self._spilled = 0
+        self._written = 0
+        self.lost = 0
+        if self.spill_path is not None:
+            self.write(self.spill_path, None)  # truncate
+        self.recording = True
+
+    def stop(self):
+        """Stop recording, writing the samples still in RAM"""
+        self.recording = False
+        self._spill()
+
+    def sample(self, lag_ms=0):
+        """Record a sample, <lag_ms> late on its schedule"""
+        if not self.recording:
+            return
+        struct.pack_into(
+            RECORD,
+            self._buffer,
+            (self._total % self.capacity) * RECORD_SIZE,
+            time.ticks_diff(time.ticks_ms(), self._start_ms),
+            self.motor.position(),
+            self.encoder.value() if self.encoder is not None else 0,
+            self.motor.get_velocity(),
+            min(max(lag_ms, 0), 0xFFFF),
+        )
+        self._total += 1
+        if self.spill_path is not None and self._total - self._spilled >= self.spill_records:
+            self._spill()
+
+    def _append(self, path, data):
+        with open(path, "ab" if data is not None else "wb") as f:
+            if data is not None:
+                f.write(data)
+        return True
+
+    def _spill(self):
+        """write the samples not written yet, oldest first, in one block"""
+        if self.spill_path is None or self._written * RECORD_SIZE >= self.max_spill_bytes:
+            return
+        oldest = self._total - self.capacity
+        if self._spilled < oldest:
+            self.lost += oldest - self._spilled
+            self._spilled = oldest
+        count = self._total - self._spilled
+        if count <= 0:
+            return
+        view = memoryview(self._buffer)
+        start = self._spilled % self.capacity
+        first = min(count, self.capacity - start)
+        data = bytes(view[start * RECORD_SIZE:(start + first) * RECORD_SIZE])
+        if first < count:  # wraps around the end of the buffer
+            data += bytes(view[:(count - first) * RECORD_SIZE])
+        if self.write(self.spill_path, data) is not False:
+            self._spilled = self._total
+            self._written += count
+
+    def _file_records(self):
+        """samples written to the spill file (so far)"""
+        try:
+            with open(self.spill_path, "rb") as f:
+                f.seek(0, 2)
+                return f.tell() // RECORD_SIZE
+        except OSError:
+            return 0
+
+    def records(self):
+        """Generate the recorded samples as tuples, oldest first: those in
+        the spill file, then those in RAM after them
+        """
+        first = max(0, self._total - self.capacity)
+        if self.spill_path is not None:
+            on_file = self._file_records()
+            if on_file:
+                with open(self.spill_path, "rb") as f:
+                    record = bytearray(RECORD_SIZE)
+                    for _ in range(on_file):
+                        f.readinto(record)
+                        yield struct.unpack(RECORD, record)
+            # written blocks still queued (see <write>) are in RAM only
+            first = max(first, self._spilled - (self._written - on_file))
+        end = self._total
+        for sequence in range(first, end):
+            if sequence < self._total - self.capacity:  # overwritten meanwhile
+                continue
+            yield struct.unpack_from(RECORD, self._buffer, (sequence % self.capacity) * RECORD_SIZE)
+
+    def csv(self):
+        """Generate the recording as CSV text, a few rows per chunk"""
+        yield CSV_HEADER
+        rows = []
+        for record in self.records():
+            rows.append("%d,%d,%d,%.1f,%d\n" % record)
+            if len(rows) == _CSV_ROWS:
+                yield "".join(rows)
+                rows = []
+        if rows:
+            yield "".join(rows)
+
+    def stats(self):
+        """recording state and sample counts"""
+        return {
+            "recording": self.recording,
+            "samples": self._total,
+            "in_ram": min(self._total, self.capacity),
+            "capacity": self.capacity,
+            "spilled": self._written,
+            "lost": self.lost,
+        }
@@ -1,13 +1,20 @@
-from phew import access_point, connect_to_wifi, is_connected_to_wifi, dns, server
-from phew.template import render_template
+from phew import access_point, connect_to_wifi, is_connected_to_wifi, dns, flash, logging, mdns, memory, ntp, profiler, server, sync, trace
+from phew.journal import Journal
+from phew.state import State
+from phew.template import preload, render_template
+from phew.trace import const
 import json
 import machine
 import os
 import utime
 import _thread
 import drivers.drv8825_setup as drv8825_setup
+from drivers.calibrate import SpeedTable, calibrate
+from drivers.encoder_portable import Encoder
+from drivers.settle import SettleDetector
+from drivers.telemetry import TelemetryRecorder
 import sys
-import gc  # Garbage collection for memory management
+import uasyncio
 
 AP_NAME = "pi pico"
 AP_DOMAIN = "pipico.net"
@@ -15,6 +22,10 @@ AP_TEMPLATE_PATH = "ap_templates"
 APP_TEMPLATE_PATH = "app_templates"
 WIFI_FILE = "wifi.json"
 WIFI_MAX_ATTEMPTS = 3
+MDNS_HOSTNAME = "picow"  # The web interface is at http://picow.local
+# NTP server, looked up once (retried with backoff while that fails). The lookup
+# blocks the event loop, on a LAN without internet use a dotted IP address
+NTP_HOST = "pool.ntp.org"
 
 # Global microstepping configuration
 current_microsteps = 32  # Maximum 32x microstepping for ultra-smooth, quiet operation!
@@ -31,6 +42,173 @@ timelapse_total_steps = 0
 # Global command execution tracking
 command_executing = False
 
+# Set while a non-blocking jog/nudge move runs, new jogs extend it in place
+jog_active = False
+JOG_DPS = 15  # Turntable degrees per second for press-and-hold jogging
+
+# Continuous rotation (video mode) speed in turntable degrees per second, 0 = off
+video_dps = 0
+VIDEO_ACCEL_DPS2 = 10  # Turntable acceleration used to blend speed changes
+
+# Full turns switch to coarse microstepping while fast (see DRV8825.move_to),
+# so they are no longer limited by the step rate at 32x microstepping
+FULL_TURN_DPS = 60  # Turntable degrees per second for 360° rotations
+
+# Emergency stop: braking rate, and a UDP port that stops on a b"STOP" datagram
+# without going through the HTTP server (the GP2 button stops from its IRQ)
+STOP_DECEL_DPS2 = 180  # Turntable degrees per second per second
+STOP_UDP_PORT = 4210
+
+# Debug tracing instead of print() in the hot paths (a print to a connected
+# USB REPL blocks). _TRACE = const(0) compiles the trace points out; with 1
+# the categories in TRACE_CATEGORIES (motion, timelapse, http, template,
+# net or all) are recorded in a ring buffer of TRACE_RECORDS entries,
+# formatted only when read at /trace. /trace?enable=...&disable=... switches
+# categories at runtime, TRACE_ECHO prints them too
+_TRACE = const(1)
+TRACE_CATEGORIES = ""
+TRACE_RECORDS = 64
+TRACE_ECHO = False
+
+# /log serves log.txt from flash: a Range header gets that byte range,
+# ?tail=<bytes> the last lines and ?follow=<seconds> keeps streaming new lines
+# for up to LOG_FOLLOW_MAX_S (holding a connection, but not a request slot,
+# while it waits for them). At most LOG_FOLLOWERS_MAX follow at once, further
+# ones get a 503
+LOG_TAIL_BYTES = 2048
+LOG_FOLLOW_MAX_S = 600
+LOG_FOLLOWERS_MAX = 2
+log_followers = 0  # /log?follow= streams running
+
+# Web server profiling, off by default: time every request phase and route
+# handler, and sample what's running PROFILE_SAMPLE_HZ times a second.
+# Results at /profile (JSON) and /profile.folded (for flamegraphs)
+PROFILE = False
+PROFILE_SAMPLE_HZ = 200
+
+# Synchronised starts of several units over UDP: one "leader" schedules
+# the /sync/... commands on every "follower" and itself, SYNC_LEAD_MS ahead
+# so that they all start within a few ms. Followers find the leader by its
+# broadcast beacon, unless SYNC_LEADER is set to its IP address. None = off
+SYNC_ROLE = None
+SYNC_LEADER = None
+SYNC_PORT = 4211
+SYNC_LEAD_MS = 300
+
+# Idle power: "hold" (the default) keeps the holding current on, "sleep" puts
+# the driver asleep after IDLE_SLEEP_S seconds without motion (on a full step,
+# so the platter keeps its position). MOTOR_ENABLED_WATTS only feeds the energy
+# estimate.
+IDLE_POLICY = "hold"
+IDLE_SLEEP_S = 30
+MOTOR_ENABLED_WATTS = 2.5
+PREWAKE_MS = 10  # Wake the driver this long before a timelapse frame moves
+
+# Optional quadrature encoder on the platter (pins, e.g. (16, 17)) for the
+# settle detection and the speed calibration below
+PLATTER_ENCODER_PINS = None
+ENCODER_COUNTS_PER_REV = 2400  # Encoder counts per turntable revolution
+
+# Settle detection for timelapses started with ?settle=1: each frame fires
+# as soon as the platter is still after its move, and the pause then runs
+# from the frame. With the platter encoder "still" is measured, otherwise
+# SETTLE_STEP_MS after the last step is assumed. The wait stays between
+# SETTLE_MIN_MS and SETTLE_MAX_MS.
+# SHUTTER_PIN pulses the camera's remote release (through an optocoupler).
+SETTLE_MIN_MS = 100
+SETTLE_MAX_MS = 3000
+SETTLE_STEP_MS = 400
+SHUTTER_PIN = None
+SHUTTER_PULSE_MS = 100
+
+# Timelapse progress journal on flash, an interrupted timelapse (brown out,
+# watchdog reset) resumes at its next frame on boot. The job parameters are
+# recorded once, then 8 bytes before and after each frame's move:
+#   A angle, N frames, W pause, M microsteps, S start position, H indexer
+#   home, T/t scheduled start (s/ms), D settle detection, G frame being moved
+#   to, F frames completed
+# A reset during a move (G > F) leaves the rotor somewhere between two frames,
+# the position is only recovered from there when frames are under 4 full steps
+TIMELAPSE_JOURNAL = "timelapse.jnl"
+TIMELAPSE_JOURNAL_WAIT_MS = 500  # Longest wait for the G record before a move
+timelapse_journal = Journal(TIMELAPSE_JOURNAL, {
+    "A": "f", "N": "I", "W": "f", "M": "I", "S": "i", "H": "i", "T": "I", "t": "I", "D": "I",
+    "G": "I", "F": "I",
+})
+
+# Motion telemetry: while the motor moves, and TELEMETRY_TAIL_MS after to see
+# it settle, the commanded and encoder positions, the step rate and the event
+# loop lag are sampled TELEMETRY_HZ times a second into a RAM ring buffer of
+# TELEMETRY_RECORDS samples (18 bytes each). Download it at /telemetry.csv,
+# /telemetry/reset clears it. TELEMETRY_SPILL appends the samples to
+# TELEMETRY_FILE too, in blocks, for recordings longer than the buffer.
+# TELEMETRY_HZ = 0 turns it off
+TELEMETRY_HZ = 50
+TELEMETRY_RECORDS = 512
+TELEMETRY_TAIL_MS = 1000
+TELEMETRY_SPILL = False
+TELEMETRY_FILE = "telemetry.bin"
+
+# Speed calibration: /calibrate (needs the platter encoder) sweeps the step
+# rate of every microstep mode, finds where the motor stalls and the bands
+# where it resonates with the load, and stores them in SPEED_TABLE_FILE.
+# Moves then run at the fastest safe speed and out of the resonant bands,
+# without a table the default speeds are used as they are
+SPEED_TABLE_FILE = "speeds.bin"
+speed_table = SpeedTable.load(SPEED_TABLE_FILE)
+calibration_running = False
+
+# Flash writes stall the CPU (up to a sector erase, tens of ms), they're
+# queued while a move steps faster than this many pulses per second
+FLASH_QUIET_STEP_HZ = 200
+
+# Snapshot of the globals above served to every /status and /progress poll,
+# serialised once per change (see publish_state)
+state = State(
+    microsteps=current_microsteps,
+    motor_enabled=True,  # Could be enhanced to check actual motor status
+    ramping_enabled=True,
+    system="ready",
+    network={},
+    running=False,
+    current_step=0,
+    total_steps=0,
+    percentage=0,
+    command_executing=False,
+    video_dps=0,
+    clock={"synced": False},
+    last_stop_latency_ms=None,
+    power={},
+    settle={},
+    memory={},
+    flash={},
+    sync={},
+    calibration={},
+    telemetry={},
+)
+
+
+def publish_state():
+    """Copy the motion and progress globals into the shared state snapshot"""
+    state.update(
+        microsteps=current_microsteps,
+        running=timelapse_running,
+        current_step=timelapse_current_step,
+        total_steps=timelapse_total_steps,
+        percentage=int((timelapse_current_step / timelapse_total_steps * 100)) if timelapse_total_steps > 0 else 0,
+        command_executing=command_executing,
+        video_dps=video_dps,
+    )
+
+def calibration_state(progress=None):
+    """The speed table and calibration progress for the shared state"""
+    return {
+        "running": calibration_running,
+        "progress": progress,
+        "modes": {microsteps: {"max_hz": max_hz, "resonant": bands}
+                  for microsteps, (max_hz, bands) in speed_table.modes.items()},
+    }
+
 # Try to reduce logging to save memory (if supported)
 try:
     import phew.logging
@@ -44,6 +222,7 @@ except:
 
 def machine_reset():
     utime.sleep(1)
+    flash.flush()  # Queued writes, e.g. new wifi credentials
     print("Resetting...")
     machine.reset()
 
@@ -62,9 +241,7 @@ def setup_mode():
     def ap_configure(request):
         print("Saving wifi credentials...")
 
-        with open(WIFI_FILE, "w") as f:
-            json.dump(request.form, f)
-            f.close()
+        flash.replace(WIFI_FILE, json.dumps(request.form))
 
         # Schedule reboot to attempt connection with new credentials
         _thread.start_new_thread(machine_reset, ())
@@ -84,6 +261,14 @@ def setup_mode():
     server.add_route("/configure", handler=ap_configure, methods=["POST"])
     server.set_callback(ap_catch_all)
 
+    # Read the pages once now, while the heap is still unfragmented
+    preload(f"{AP_TEMPLATE_PATH}/index.html", f"{AP_TEMPLATE_PATH}/redirect.html",
+            f"{AP_TEMPLATE_PATH}/configured.html")
+
+    # Phones fire bursts of connectivity probes at a new network, answer
+    # them with a precomputed redirect instead of rendering redirect.html
+    server.add_captive_portal_probes(f"http://{AP_DOMAIN}/")
+
     ap = access_point(AP_NAME)
     ip = ap.ifconfig()[0]
     dns.run_catchall(ip)
@@ -114,47 +299,20 @@ def application_mode():
         print("ERROR: Could not get valid IP address - network may be unstable")
         ip_address = "unknown"
     
-    # Set hostname and use lwIP's built-in mDNS (if available) - but be gentle with CYW43
+    # DHCP hostname, and our own mDNS responder so picow.local resolves
+    # (answering the AAAA lookups too, which would otherwise time out)
     hostname_set = False
-    try:
-        # The Pico W defaults to 'picow.local' which works well
-        # No need to override - just verify it's working
-        if ip_address and ip_address != "unknown":
-            import lwip_mdns
-            if lwip_mdns.setup_lwip_mdns('picow'):  # Use default hostname
-                print("Hostname and mDNS configured (using picow.local)")
-                hostname_set = True
-            else:
-                print("WARNING: Hostname setup had issues")
-    except Exception as e:
-        print(f"ERROR: Hostname/mDNS setup error: {e}")
-    
-    # Fallback to basic hostname setting if needed
-    if not hostname_set and ip_address != "unknown":
+    if ip_address != "unknown":
         try:
-            wlan.config(hostname='picow')  # Ensure default hostname
-            print("Basic hostname confirmed as 'picow'")
+            wlan.config(hostname=MDNS_HOSTNAME)
+        except Exception as e:
+            print(f"WARNING: Could not set the DHCP hostname: {e}")
+        if mdns.run(MDNS_HOSTNAME, ip_address):
+            print(f"mDNS responder answering {MDNS_HOSTNAME}.local")
             hostname_set = True
-        except Exception as e2:
-            print(f"ERROR: Even basic hostname failed: {e2}")
-    
-    # Temporarily disable custom mDNS to avoid socket conflicts with lwIP
-    print("INFO: Custom mDNS announcer disabled to avoid lwIP conflicts")
-    # Skip custom mDNS if network is unstable to avoid overloading CYW43
-    if False:  # Temporarily disabled
-        if ip_address == "unknown":
-            print("WARNING: Skipping mDNS due to network instability")
-        else:
-            # Only use minimal mDNS announcer if network seems stable
-            try:
-                import mdns_announcer
-                if mdns_announcer.start_mdns_announcer('twirly', ip_address, 180):  # Longer interval
-                    print("mDNS announcer started (reduced frequency)")
-            except Exception as e:
-                print(f"INFO: mDNS announcer not started: {e}")
-    
+
     if not hostname_set:
-        print("WARNING: No hostname configured - use IP address directly")
+        print("WARNING: No mDNS hostname - use the IP address directly")
     
     # Set up DNS catchall as backup (but only if network is stable)
     if ip_address != "unknown":
@@ -187,183 +345,376 @@ def application_mode():
     print("=" * 50)
     print("Web interface starting...")
     print("=" * 50 + "\n")
+
+    state.update(network={
+        "ip_address": ip_address,
+        "primary_url": "http://picow.local",
+        "access_methods": [
+            "http://picow.local (recommended)",
+            f"http://{ip_address} (direct IP)",
+            "http://any-domain.com (DNS catchall)"
+        ]
+    })
     
-    def action(steps, microsteps=None, speed=50, use_ramping=True):
-        """Execute stepper motor movement with proper microstepping"""
+    def on_clock_sync(clock):
+        state.update(clock={"synced": True, "utc_ms": clock.now_ms(), "drift_ppm": int(clock.drift_ppm)})
+
+    # Keep the clock disciplined for scheduled starts and log timestamps
+    ntp.start(NTP_HOST, on_sync=on_clock_sync)
+
+    def turntable_dps_to_stepfreq(dps, microsteps):
+        """Convert turntable degrees per second to motor (micro)steps per second"""
+        return dps / 360 * mot.steps_per_revolution * microsteps * GEAR_RATIO
+
+    def safe_speed(microsteps, speed, use_ramping=True):
+        """<speed> in (micro)steps per second at <microsteps>, brought within
+        the speed calibration of the resolution the move cruises in (coarser
+        while fast when ramping, see DRV8825.move_to): at most its maximum and
+        below its resonant bands. Unchanged without a calibration.
+        """
+        cruise = microsteps
+        if use_ramping:
+            for band_microsteps in (32, 16, 8, 4, 2, 1):
+                if mot.coarsest_microsteps <= band_microsteps <= microsteps:
+                    cruise = band_microsteps
+                    if abs(speed) * band_microsteps / microsteps <= mot.max_step_hz:
+                        break
+        return speed_table.limit(cruise, speed * cruise / microsteps) * microsteps / cruise
+
+    def fastest_speed(microsteps, default, use_ramping=True):
+        """The fastest safe speed of a move ending at <microsteps>, in
+        (micro)steps per second, <default> without a calibration
+        """
+        modes = (32, 16, 8, 4, 2, 1) if use_ramping else (microsteps,)
+        speeds = [speed_table.max_hz(m) * microsteps / m for m in modes
+                  if mot.coarsest_microsteps <= m <= microsteps and speed_table.calibrated(m)]
+        if not speeds:
+            return default
+        return safe_speed(microsteps, max(speeds), use_ramping)
+
+    def start_move(steps, microsteps, speed, use_ramping=True):
+        """Start moving <steps> microsteps at <speed> Hz, returns a timeout in ms
+
+        With ramping the move accelerates and decelerates and runs at coarser
+        microstepping while fast, ending at <microsteps>.
+        """
+        unit = 32 // microsteps  # Driver positions are in 1/32 steps
+        speed = max(safe_speed(microsteps, speed, use_ramping), 1)
+        if use_ramping:
+            mot.move(steps * unit, speed * unit, microsteps=microsteps)
+        else:
+            mot.move(steps * unit, speed * unit, min_speed=speed * unit,
+                     microsteps=microsteps, auto_microsteps=False)
+
+        # Expected duration plus a margin for the ramps
+        return abs(steps) * 1000 // speed * 2 + 2000
+
+    def run_move(steps, microsteps, speed, use_ramping=True, should_continue=None):
+        """Move and wait for it to finish, for worker threads (see start_move)
+
+        Returns False if it timed out or should_continue() turned False.
+        """
+        timeout_ms = start_move(steps, microsteps, speed, use_ramping)
+        start = utime.ticks_ms()
+        while mot.is_moving():
+            if utime.ticks_diff(utime.ticks_ms(), start) > timeout_ms:
+                print("WARNING: Movement timed out, forcing completion")
+                mot.stop()
+                return False
+            if should_continue is not None and not should_continue():
+                return False
+            utime.sleep_ms(20)
+        return True
+
+    async def action(steps, microsteps=None, speed=50, use_ramping=True):
+        """Execute stepper motor movement with proper microstepping
+
+        Awaits the move instead of blocking, so the server keeps answering
+        /stop and /status while the motor turns. Returns True if the move
+        completed, False if it was stopped or timed out.
+        """
         global command_executing
         
         # Use global microsteps if not specified
         if microsteps is None:
             microsteps = current_microsteps
             
-        print(f"DEBUG: Action - {steps} steps, {microsteps}x microsteps at {speed}Hz")
+        if _TRACE:
+            trace.point(trace.MOTION, "action {} steps, {}x microsteps at {}Hz", steps, microsteps, speed)
         
         # Set executing state
         command_executing = True
+        publish_state()
+        stop_count = mot.stop_count
         
         try:
-            # Use proper microstepping - this is the key fix!
-            mot.steps(steps, microsteps, speed)
-            
-            # Wait for completion with timeout.
-            # get_progress() is signed position, so compare against target steps.
-            timeout_count = 0
-            max_timeout = 100  # 5 seconds at 50ms intervals
-            while mot.get_progress() != steps and timeout_count < max_timeout:
-                utime.sleep_ms(50)
-                timeout_count += 1
-                
-            if timeout_count >= max_timeout:
-                print("DEBUG: Movement timed out, forcing completion")
-                mot.disable()  # Force stop
-                utime.sleep_ms(100)
-                mot.enable()   # Re-enable for next movement
-            else:
-                print("DEBUG: Movement completed normally")
-                
+            timeout_ms = start_move(steps, microsteps, speed, use_ramping)
+            start = utime.ticks_ms()
+            while mot.is_moving():
+                if utime.ticks_diff(utime.ticks_ms(), start) > timeout_ms:
+                    print("WARNING: Movement timed out, forcing completion")
+                    mot.stop()
+                    return False
+                await uasyncio.sleep_ms(20)
+            if mot.stop_count != stop_count:
+                return False
+            if _TRACE:
+                trace.point(trace.MOTION, "action completed at {}", mot.position())
+            return True
         except Exception as e:
-            print(f"DEBUG: Exception: {e}")
+            print(f"Action error: {e}")
+            return False
         finally:
             command_executing = False
-            gc.collect()
+            publish_state()
+            memory.request_collect()  # Runs once the motor is idle
 
-    def action_with_ramping(steps, microsteps, target_speed):
-        """Execute movement with smooth acceleration and deceleration curves"""
-        if steps == 0:
-            return
-            
-        # Simplified ramping for MicroPython constraints
-        total_steps = abs(steps)
-        direction = 1 if steps > 0 else -1
-        
-        # Ramping configuration - keep it simple for real-time performance
-        start_speed = max(target_speed * 0.3, 30)  # Start at 30% of target speed
-        ramp_ratio = 0.15  # Use 15% of total movement for ramping
-        ramp_steps = max(int(total_steps * ramp_ratio), microsteps)
-        
-        if total_steps < microsteps * 6:  # Too short for effective ramping
-            mot.steps(steps, microsteps, target_speed)
-            while mot.get_progress() > 0:
-                utime.sleep_ms(20)
-            return
-        
-        # Simple 3-phase movement: accelerate -> constant -> decelerate
-        try:
-            # Phase 1: Acceleration (gradual speed increase)
-            accel_steps = min(ramp_steps, total_steps // 3)
-            mot.steps(direction * accel_steps, microsteps, start_speed)
-            while mot.get_progress() > 0:
-                utime.sleep_ms(10)
-            
-            # Phase 2: Constant speed (main movement)
-            constant_steps = total_steps - 2 * accel_steps
-            if constant_steps > 0:
-                mot.steps(direction * constant_steps, microsteps, target_speed)
-                while mot.get_progress() > 0:
-                    utime.sleep_ms(15)
-            
-            # Phase 3: Deceleration (gradual speed decrease)
-            if accel_steps > 0:
-                mot.steps(direction * accel_steps, microsteps, start_speed)
-                while mot.get_progress() > 0:
-                    utime.sleep_ms(10)
-                    
-        except Exception as e:
-            print(f"Ramping error: {e}")
-            # Fallback to simple movement
-            remaining = total_steps - mot.get_progress() if mot.get_progress() > 0 else 0
-            if remaining > 0:
-                mot.steps(direction * remaining, microsteps, target_speed // 2)
-                while mot.get_progress() > 0:
-                    utime.sleep_ms(20)
-
-    def app_cw_360(request):
-        global command_executing, timelapse_running
+    async def rotate_360(direction, name):
+        """One turntable revolution, <direction> 1 for CW or -1 for CCW"""
         try:
-            # Check if another command is already running
-            if command_executing or timelapse_running:
-                return "Error: Another command is already executing"
-            
             # 360 degree turntable rotation accounting for gear ratio
             # Calculate steps: 200 full steps * gear ratio for actual 360° turntable rotation
-            full_steps = int(200 * GEAR_RATIO)  # Account for 3.0:1 gear reduction
-            # Slow full-circle speed by 5x for smoother rotation
-            speed = max(50, (200 * (current_microsteps // 4)) // 5)
-            action(full_steps * current_microsteps, current_microsteps, min(speed, 800), use_ramping=True)
-            return f"360° CW turntable rotation completed ({current_microsteps}x microsteps, {min(speed, 800)}Hz)"
-        except KeyboardInterrupt:
-            print("Interrupted from Keyboard")
-            return "360° CW rotation interrupted"
+            full_steps = direction * int(200 * GEAR_RATIO)  # Account for 3.0:1 gear reduction
+            speed = int(turntable_dps_to_stepfreq(FULL_TURN_DPS, current_microsteps))
+            if await action(full_steps * current_microsteps, current_microsteps, speed, use_ramping=True):
+                return f"360° {name} turntable rotation completed (ending at {current_microsteps}x microsteps, {FULL_TURN_DPS}°/s)"
+            return f"360° {name} turntable rotation stopped"
         except Exception as e:
-            return f"360° CW rotation failed: {str(e)}"
+            return f"360° {name} rotation failed: {str(e)}"
+
+    def app_cw_360(request):
+        # Check if another command is already running
+        if command_executing or timelapse_running:
+            return "Error: Another command is already executing"
+        return server.AsyncResponse(rotate_360(1, "CW"))
 
     def app_ccw_360(request):
-        global command_executing, timelapse_running
+        # Check if another command is already running
+        if command_executing or timelapse_running:
+            return "Error: Another command is already executing"
+        return server.AsyncResponse(rotate_360(-1, "CCW"))
+
+    def nudge(full_steps, name):
+        """Nudge by <full_steps>, extending a nudge that is still running
+
+        Returns immediately; repeated presses update the running move's target
+        so the platter keeps moving instead of stopping between presses.
+        """
+        global command_executing, jog_active
         try:
-            # Check if another command is already running
-            if command_executing or timelapse_running:
+            # Check if another (non-jog) command is already running
+            if (command_executing and not jog_active) or timelapse_running:
                 return "Error: Another command is already executing"
-            
-            # 360 degree turntable rotation accounting for gear ratio (counter-clockwise)
-            full_steps = -int(200 * GEAR_RATIO)  # Account for 3.0:1 gear reduction
-            # Slow full-circle speed by 5x for smoother rotation
-            speed = max(50, (200 * (current_microsteps // 4)) // 5)
-            action(full_steps * current_microsteps, current_microsteps, min(speed, 800), use_ramping=True)
-            return f"360° CCW turntable rotation completed ({current_microsteps}x microsteps, {min(speed, 800)}Hz)"
-        except KeyboardInterrupt:
-            print("Interrupted from Keyboard")
-            return "360° CCW rotation interrupted"
+
+            speed = fastest_speed(current_microsteps,
+                                  100 * (current_microsteps // 8) if current_microsteps >= 8 else 50)
+            unit = 32 // current_microsteps  # Driver positions are in 1/32 steps
+            mot.jog(full_steps * 32, max(speed, 50) * unit, microsteps=current_microsteps)
+            jog_active = True
+            command_executing = True
+            publish_state()
+            if _TRACE:
+                trace.point(trace.MOTION, "{} nudge at {}Hz", name, speed)
+            return f"{name} nudge ({current_microsteps}x microsteps)"
         except Exception as e:
-            return f"360° CCW rotation failed: {str(e)}"
+            return f"{name} nudge error: {e}"
 
     def app_cw_nudge(request):
-        global command_executing, timelapse_running
-        try:
-            # Check if another command is already running
-            if command_executing or timelapse_running:
-                return "Error: Another command is already executing"
-            
-            print("CW nudge button pressed")
-            # Small nudge movement with microsteps (clockwise) - no ramping for precision
-            full_steps = 6
-            speed = 100 * (current_microsteps // 8) if current_microsteps >= 8 else 50
-            action(full_steps * current_microsteps, current_microsteps, max(speed, 50), use_ramping=False)
-            return f"CW nudge completed ({current_microsteps}x microsteps)"
-        except KeyboardInterrupt:
-            print("Interrupted from Keyboard")
-            return "CW nudge interrupted"
-        except Exception as e:
-            return f"CW nudge error: {e}"
+        return nudge(6, "CW")
 
     def app_ccw_nudge(request):
-        global command_executing, timelapse_running
+        return nudge(-6, "CCW")
+
+    def app_jog(request):
+        """Press-and-hold jogging: ?dir=1 or ?dir=-1 heartbeats, ?dir=0 releases"""
+        global command_executing, jog_active
         try:
-            # Check if another command is already running
-            if command_executing or timelapse_running:
+            direction = int(request.query.get('dir', 0))
+            if direction == 0:
+                if not jog_active:
+                    return "Not jogging"
+                mot.jog_release()
+                return "Jog released"
+            if (command_executing and not jog_active) or timelapse_running:
                 return "Error: Another command is already executing"
-            
-            # Small nudge movement with microsteps (counter-clockwise) - no ramping for precision
-            full_steps = -6
-            speed = 100 * (current_microsteps // 8) if current_microsteps >= 8 else 50
-            action(full_steps * current_microsteps, current_microsteps, max(speed, 50), use_ramping=False)
-            return f"CCW nudge completed ({current_microsteps}x microsteps)"
-        except KeyboardInterrupt:
-            print("Interrupted from Keyboard")
-            return "CCW nudge interrupted"
+
+            unit = 32 // current_microsteps  # Driver positions are in 1/32 steps
+            speed = safe_speed(current_microsteps, turntable_dps_to_stepfreq(JOG_DPS, current_microsteps))
+            mot.jog_hold(direction, int(speed * unit), microsteps=current_microsteps)
+            jog_active = True
+            command_executing = True
+            publish_state()
+            return "Jogging"
         except Exception as e:
-            return f"CCW nudge failed: {str(e)}"
+            return f"Jog error: {e}"
+
+    def halt_operations():
+        """Clear all running operations after an emergency stop"""
+        global timelapse_running, command_executing, video_dps, jog_active, calibration_running
+        timelapse_running = False
+        calibration_running = False
+        command_executing = False
+        video_dps = 0
+        jog_active = False
+        publish_state()
+
+    async def motion_monitor():
+        """Clear the executing state once a non-blocking jog move has finished
+
+        Also notices emergency stops requested outside the server (button,
+        UDP), halts the running operations and publishes the stop latency,
+        and runs the driver's idle power management.
+        """
+        global command_executing, jog_active
+        stop_count = mot.stop_count
+        stop_pending = False
+        power_state = None
+        power_published = utime.ticks_ms()
+        while True:
+            # Apply the idle policy, publish power stats on a change of
+            # state and otherwise only every 10s to spare /status pollers
+            mot.idle_poll()
+            now = utime.ticks_ms()
+            if mot.power_state() != power_state or utime.ticks_diff(now, power_published) >= 10000:
+                power_state = mot.power_state()
+                power_published = now
+                state.update(power=mot.power_stats(), memory=memory.stats(), flash=flash.stats())
+                if telemetry is not None:
+                    state.update(telemetry=telemetry.stats())
+                if sync_node is not None:
+                    state.update(sync=sync_node.stats())
+            if mot.stop_count != stop_count:
+                stop_count = mot.stop_count
+                stop_pending = True
+                halt_operations()
+            if stop_pending and not mot.is_moving():
+                stop_pending = False
+                latency_us = mot.last_stop_latency_us
+                state.update(last_stop_latency_ms=None if latency_us is None else latency_us / 1000)
+                print(f"Emergency stop: standstill after {latency_us}us")
+            if jog_active and not mot.is_moving():
+                jog_active = False
+                command_executing = False
+                publish_state()
+            await uasyncio.sleep_ms(50)
+
+    server.loop.create_task(motion_monitor())
+
+    async def udp_stop_listener(sock):
+        """Emergency stop on a b"STOP" datagram, independent of the HTTP queue"""
+        while True:
+            try:
+                request, client = sock.recvfrom(16)
+            except OSError:
+                await uasyncio.sleep_ms(5)  # Nothing received yet
+                continue
+            if request.strip().upper() == b"STOP":
+                mot.emergency_stop()
+                try:
+                    sock.sendto(b"STOPPING", client)
+                except OSError:
+                    pass
+
+    try:
+        import socket
+        stop_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        stop_socket.setblocking(False)
+        stop_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        stop_socket.bind(("0.0.0.0", STOP_UDP_PORT))
+        server.loop.create_task(udp_stop_listener(stop_socket))
+        print(f"UDP emergency stop listening on port {STOP_UDP_PORT}")
+    except Exception as e:
+        print(f"WARNING: UDP emergency stop not available: {e}")
+
+    # Platter settle detection and camera release for ?settle=1 timelapses
+    platter_encoder = None
+    if PLATTER_ENCODER_PINS is not None:
+        platter_encoder = Encoder(*(machine.Pin(pin, machine.Pin.IN, machine.Pin.PULL_UP)
+                                    for pin in PLATTER_ENCODER_PINS))
+    settle = SettleDetector(mot, platter_encoder, step_settle_ms=SETTLE_STEP_MS,
+                            min_dwell_ms=SETTLE_MIN_MS, max_dwell_ms=SETTLE_MAX_MS)
+    shutter = machine.Pin(SHUTTER_PIN, machine.Pin.OUT, value=0) if SHUTTER_PIN is not None else None
 
-    def timelapse_worker(angle, steps, pause):
-        """Worker function that runs timelapse in background thread"""
+    def write_telemetry(path, data):
+        """Spill telemetry through the flash coordinator, a block at a time so
+        blocks deferred during a move don't pile up in RAM
+        """
+        if data is None:
+            flash.remove(path)
+        elif flash.pending_bytes(path):
+            return False  # The previous block is still queued, retry later
+        else:
+            flash.append(path, data)
+        return True
+
+    # Motion telemetry, sampled by a task so the lag of the event loop shows
+    telemetry = None
+    if TELEMETRY_HZ:
+        telemetry = TelemetryRecorder(mot, platter_encoder, TELEMETRY_RECORDS,
+                                      spill_path=TELEMETRY_FILE if TELEMETRY_SPILL else None,
+                                      write=write_telemetry)
+        telemetry.start()
+
+    async def telemetry_sampler():
+        """Sample the motion while moving and for TELEMETRY_TAIL_MS after"""
+        interval_ms = 1000 // TELEMETRY_HZ
+        last_moving = None
+        while True:
+            start = utime.ticks_ms()
+            await uasyncio.sleep_ms(interval_ms)
+            now = utime.ticks_ms()
+            if mot.is_moving():
+                last_moving = now
+            if last_moving is not None and utime.ticks_diff(now, last_moving) <= TELEMETRY_TAIL_MS:
+                telemetry.sample(utime.ticks_diff(now, start) - interval_ms)
+
+    if telemetry is not None:
+        server.loop.create_task(telemetry_sampler())
+
+    def fire_frame():
+        """Pulse the camera's remote release, if one is wired"""
+        if shutter is not None:
+            shutter.on()
+            utime.sleep_ms(SHUTTER_PULSE_MS)
+            shutter.off()
+
+    def timelapse_worker(angle, steps, pause, start_at_ms=None, resume=None, settle_mode=False):
+        """Worker function that runs timelapse in background thread
+
+        <resume> is the journal of an interrupted timelapse to continue,
+        otherwise a new one is started from the current position.
+        <settle_mode> fires each frame once the platter has settled and
+        runs <pause> from the frame, otherwise <pause> is the whole step.
+        """
         global timelapse_running, timelapse_current_step, timelapse_total_steps, command_executing
         
         current_step = 0
         
         try:
+            if resume is None:
+                microsteps = current_microsteps
+                start_pos = mot.position()
+                first_step = 0
+                timelapse_journal.start(A=angle, N=steps, W=pause, M=microsteps, S=start_pos,
+                                        H=mot.home_position(),
+                                        T=start_at_ms // 1000 if start_at_ms else 0,
+                                        t=start_at_ms % 1000 if start_at_ms else 0,
+                                        D=1 if settle_mode else 0)
+                settle.reset_stats()
+            else:
+                microsteps = resume["M"]
+                start_pos = resume["S"]
+                first_step = resume.get("F", 0)
+
+            if start_at_ms is not None and first_step == 0:
+                print(f"Timelapse scheduled, starting in {ntp.clock.ms_until(start_at_ms)}ms")
+                if not ntp.clock.wait_until(start_at_ms, lambda: timelapse_running):
+                    return
+
             print(f"Starting timelapse: {angle}° in {steps} steps, {pause}s pause")
             
             # Calculate steps per movement accounting for gear ratio
-            steps_per_rotation = int(200 * current_microsteps * GEAR_RATIO)
+            steps_per_rotation = int(200 * microsteps * GEAR_RATIO)
             steps_per_movement = int((angle / 360.0) * steps_per_rotation / steps)
             
             # Ensure minimum movement for very small angles
@@ -377,19 +728,40 @@ def application_mode():
             else:
                 steps_per_movement = abs(steps_per_movement)
             
-            # Speed calculation
-            base_speed = 400 if current_microsteps >= 32 else 200
+            # Speed calculation, the calibrated fastest safe speed if any
+            base_speed = fastest_speed(microsteps, 400 if microsteps >= 32 else 200)
             
             print(f"Movement: {steps_per_movement} microsteps at {base_speed}Hz per step")
+
+            # Frames move to absolute positions from the start, so a resumed
+            # timelapse lands exactly where the uninterrupted one would have
+            unit = 32 // microsteps  # Driver positions are in 1/32 steps
+            if resume is not None:
+                position = start_pos + first_step * steps_per_movement * unit
+                if resume.get("G", first_step) > first_step:
+                    # Reset during the move to the next frame: the rotor is
+                    # between the two, recover_position() can only tell where
+                    # from the middle when they're less than 4 full steps apart
+                    if abs(steps_per_movement) * unit >= 4 * 32:
+                        print(f"Can't resume timelapse: reset during the move to step {first_step + 1}, "
+                              f"frames of {abs(steps_per_movement) * unit // 32} full steps are too far apart")
+                        return
+                    position += steps_per_movement * unit // 2
+                mot.recover_position(position, resume["H"])
+                print(f"Resuming timelapse at step {first_step + 1} of {steps}")
             
-            # Execute timelapse sequence
-            for step in range(steps):
-                if not timelapse_running:
+            # Execute timelapse sequence, an emergency stop (button, UDP)
+            # ends it even before the monitor has cleared timelapse_running
+            stop_count = mot.stop_count
+            for step in range(first_step, steps):
+                if not timelapse_running or mot.stop_count != stop_count:
                     break
                     
                 current_step = step + 1
                 timelapse_current_step = current_step
-                print(f"Step {current_step} of {steps}")
+                publish_state()
+                if _TRACE:
+                    trace.point(trace.TIMELAPSE, "step {} of {}", current_step, steps)
                 
                 # Start timing for total step duration (movement + pause)
                 import time
@@ -397,36 +769,53 @@ def application_mode():
                 
                 # Direct motor control to avoid command_executing flag conflicts
                 try:
-                    print(f"DEBUG: Timelapse step {current_step} - {steps_per_movement} microsteps at {base_speed}Hz")
-                    mot.steps(steps_per_movement, current_microsteps, base_speed)
-                    
-                    # Wait for completion; progress is signed, so wait for target.
-                    timeout_count = 0
-                    max_timeout = 100
-                    while mot.get_progress() != steps_per_movement and timeout_count < max_timeout:
-                        # Use simple loop for timing to avoid any scoping issues
-                        for i in range(5000):
-                            pass
-                        timeout_count += 1
-                        
-                    print(f"DEBUG: Step {current_step} movement completed")
+                    # The move is marked on flash first, a reset during it
+                    # then isn't taken for one while standing at the frame
+                    timelapse_journal.append("G", current_step)
+                    wait_start = time.ticks_ms()
+                    while flash.pending_bytes(TIMELAPSE_JOURNAL) and \
+                            time.ticks_diff(time.ticks_ms(), wait_start) < TIMELAPSE_JOURNAL_WAIT_MS:
+                        time.sleep_ms(5)
+                    target = start_pos + current_step * steps_per_movement * unit
+                    if run_move((target - mot.position()) // unit, microsteps, base_speed,
+                                should_continue=lambda: timelapse_running):
+                        timelapse_journal.append("F", current_step)
+                    if _TRACE:
+                        trace.point(trace.TIMELAPSE, "step {} moved {} microsteps at {}Hz", current_step,
+                                    steps_per_movement, base_speed)
                 except Exception as e:
                     print(f"Movement error in step {current_step}: {e}")
+
+                # Fire the frame as soon as the platter is still, the pause
+                # then runs from the frame rather than from the step start
+                if settle_mode and timelapse_running:
+                    settle_ms = settle.wait(lambda: timelapse_running)
+                    if settle_ms is not None:
+                        fire_frame()
+                        step_start = time.ticks_ms()
+                        state.update(settle=settle.stats())
+                        if _TRACE:
+                            trace.point(trace.TIMELAPSE, "frame {} fired after settling for {}ms",
+                                        current_step, settle_ms)
                 
                 # Wait for total step duration (pause includes movement time)
                 if current_step < steps and timelapse_running:
                     elapsed_ms = time.ticks_diff(time.ticks_ms(), step_start)
                     remaining_ms = (pause * 1000) - elapsed_ms
                     
+                    if _TRACE:
+                        trace.point(trace.TIMELAPSE, "step took {}ms, waiting {}ms more", elapsed_ms,
+                                    max(0, remaining_ms))
                     if remaining_ms > 0:
-                        print(f"Step took {elapsed_ms}ms, waiting {remaining_ms}ms more for {pause}s total")
                         wait_start = time.ticks_ms()
                         while time.ticks_diff(time.ticks_ms(), wait_start) < remaining_ms:
                             if not timelapse_running:
                                 break
-                            time.sleep_ms(100)  # Small sleep to prevent busy waiting
-                    else:
-                        print(f"Step took {elapsed_ms}ms (longer than {pause}s duration), continuing immediately")
+                            left_ms = remaining_ms - time.ticks_diff(time.ticks_ms(), wait_start)
+                            if left_ms <= PREWAKE_MS:
+                                # Wake a sleeping driver so the next move starts at once
+                                mot.prewake()
+                            time.sleep_ms(max(1, min(100, left_ms - PREWAKE_MS)))  # Small sleep to prevent busy waiting
                     
             print(f"Timelapse completed: {steps} steps")
             
@@ -439,18 +828,30 @@ def application_mode():
             command_executing = False
             timelapse_current_step = 0
             timelapse_total_steps = 0
+            publish_state()
+            # Finished or stopped, nothing to resume
+            timelapse_journal.remove()
             print("All timelapse flags cleared")
             
             # Longer delay to ensure web interface has time to poll and see the changes
             for i in range(50000):  # Increased delay
                 pass
             
-            # Force garbage collection
-            gc.collect()
+            memory.request_collect()  # Runs once the motor is idle
             print("Timelapse cleanup complete")
 
-    def app_timelapse(request):
+    def start_timelapse(angle, steps, pause, start_at_ms=None, settle_mode=False):
+        """Set the progress tracking and run the timelapse in a background thread"""
         global timelapse_running, timelapse_current_step, timelapse_total_steps, command_executing
+        timelapse_running = True
+        command_executing = True
+        timelapse_current_step = 0
+        timelapse_total_steps = steps
+        publish_state()
+        _thread.start_new_thread(timelapse_worker, (angle, steps, pause, start_at_ms, None, settle_mode))
+
+    def app_timelapse(request):
+        global timelapse_running, command_executing
         try:
             # Check if a timelapse is already running
             if timelapse_running or command_executing:
@@ -460,42 +861,193 @@ def application_mode():
             angle = float(request.query.get('angle', 360))
             steps = int(request.query.get('steps', 160))
             pause = float(request.query.get('pause', 3.0))
-            
-            # Set progress tracking and execution state
-            timelapse_running = True
-            command_executing = True
-            timelapse_current_step = 0
-            timelapse_total_steps = steps
-            
-            # Start timelapse in background thread
-            _thread.start_new_thread(timelapse_worker, (angle, steps, pause))
+            # Fire each frame once the platter has settled, pause after it
+            settle_mode = request.query.get('settle', '0') == '1'
+
+            # Optional absolute start time, unix seconds (fractions allowed)
+            start_at_ms = None
+            if 'start_at' in request.query:
+                if not ntp.clock.synced():
+                    return "Error: Clock not synchronised yet, cannot schedule a start"
+                start_at_ms = int(float(request.query['start_at']) * 1000)
+
+            start_timelapse(angle, steps, pause, start_at_ms, settle_mode)
             
             # Return immediately while timelapse runs in background
+            if start_at_ms is not None:
+                return f"Timelapse scheduled: {angle}° in {steps} steps, {pause}s pause, starting at {start_at_ms / 1000}"
             return f"Timelapse started: {angle}° in {steps} steps, {pause}s pause"
             
         except Exception as e:
             print(f"Timelapse start error: {str(e)}")
             timelapse_running = False
             command_executing = False
+            publish_state()
             return f"Failed to start timelapse: {str(e)}"
 
+    async def stopped_response():
+        """Reply to /stop once the motor has braked to a standstill"""
+        while mot.is_moving():
+            await uasyncio.sleep_ms(10)
+        latency_us = mot.last_stop_latency_us or 0
+        return f"Emergency stop executed - standstill after {latency_us // 1000}ms, timelapse stopped"
+
     def app_stop(request):
-        global timelapse_running, command_executing
         try:
-            # Stop any running timelapse
-            timelapse_running = False
-            command_executing = False
-            
-            # Emergency stop motor
-            mot.stop()
+            # Brake at the emergency deceleration rather than cutting the
+            # step pulses, which could make the loaded platter lose steps
+            mot.emergency_stop()
+            halt_operations()
             print("Emergency stop: all operations halted")
-            return "Emergency stop executed - motor disabled, timelapse stopped"
+            return server.AsyncResponse(stopped_response())
         except KeyboardInterrupt:
             print("Interrupted from Keyboard")
             return "Stop command interrupted"
         except Exception as e:
             return f"Stop command failed: {str(e)}"
 
+    def app_video(request):
+        """Continuous rotation for video, speed can be changed while running
+
+        ?dps=<turntable degrees per second> or ?spr=<seconds per revolution>,
+        negative values turn counter-clockwise and 0 ramps down to a stop.
+        """
+        try:
+            if 'spr' in request.query:
+                spr = float(request.query['spr'])
+                dps = 360 / spr if spr else 0
+            else:
+                dps = float(request.query.get('dps', 0))
+            return set_video(dps)
+        except Exception as e:
+            return f"Video mode error: {e}"
+
+    def set_video(dps):
+        """Start, change or stop (<dps> 0) the continuous rotation"""
+        global video_dps, command_executing
+        if video_dps == 0 and dps != 0 and (command_executing or timelapse_running):
+            return "Error: Another command is already executing"
+
+        # Velocity mode keeps its resolution, so only that one's limits apply
+        stepfreq = safe_speed(current_microsteps, turntable_dps_to_stepfreq(dps, current_microsteps),
+                              use_ramping=False)
+        accel = turntable_dps_to_stepfreq(VIDEO_ACCEL_DPS2, current_microsteps)
+        mot.velocity(stepfreq, current_microsteps, accel)
+        video_dps = dps
+        command_executing = dps != 0
+        publish_state()
+        if dps == 0:
+            return "Video mode stopping"
+        return f"Video mode: {dps:.2f}°/s ({stepfreq:.1f}Hz at {current_microsteps}x microsteps)"
+
+    def calibration_worker():
+        """Worker thread sweeping the speeds of every microstep mode"""
+        global calibration_running, command_executing, speed_table
+        stop_count = mot.stop_count
+        try:
+            counts_per_step = ENCODER_COUNTS_PER_REV / (mot.steps_per_revolution * GEAR_RATIO)
+            table = calibrate(
+                mot, platter_encoder, counts_per_step,
+                on_progress=lambda microsteps, hz: state.update(
+                    calibration=calibration_state({"microsteps": microsteps, "hz": hz})),
+                should_continue=lambda: calibration_running and mot.stop_count == stop_count)
+            if table is not None:
+                speed_table = table
+                flash.replace(SPEED_TABLE_FILE, table.pack())
+                print(f"Calibration stored in {SPEED_TABLE_FILE}")
+            else:
+                print("Calibration stopped, keeping the previous speed table")
+        except Exception as e:
+            print(f"Calibration error: {e}")
+        finally:
+            calibration_running = False
+            command_executing = False
+            state.update(calibration=calibration_state())
+            publish_state()
+            memory.request_collect()  # Runs once the motor is idle
+
+    def app_calibrate(request):
+        """Start the speed calibration, the platter turns for a few minutes
+
+        The swept speeds stall the motor at the end of each microstep mode,
+        so the position is lost: set it again afterwards.
+        """
+        global calibration_running, command_executing
+        if platter_encoder is None:
+            return "Error: Calibration needs the platter encoder (PLATTER_ENCODER_PINS)"
+        if command_executing or timelapse_running:
+            return "Error: Another command is already executing"
+        calibration_running = True
+        command_executing = True
+        publish_state()
+        _thread.start_new_thread(calibration_worker, ())
+        return "Speed calibration started, progress in /status"
+
+    def app_telemetry_csv(request):
+        """Stream the motion telemetry as CSV, row chunks straight from the buffer"""
+        if telemetry is None:
+            return "Error: Telemetry is off (TELEMETRY_HZ = 0)"
+        return telemetry.csv(), 200, "text/csv"
+
+    def app_telemetry_reset(request):
+        if telemetry is None:
+            return "Error: Telemetry is off (TELEMETRY_HZ = 0)"
+        telemetry.start()
+        state.update(telemetry=telemetry.stats())
+        return "Telemetry cleared"
+
+    def followed(chunks):
+        """<chunks> counted in log_followers while they're generated"""
+        global log_followers
+        log_followers += 1
+        try:
+            for chunk in chunks:
+                yield chunk
+        finally:
+            log_followers -= 1
+
+    def app_log(request):
+        """The log file, streamed from flash a chunk at a time
+
+        A Range header gets that byte range (206 Partial Content),
+        ?tail=<bytes> the last lines, ?follow=<seconds> the tail and then
+        the lines written for that long.
+        """
+        query = request.query
+        try:
+            if "tail" not in query and "follow" not in query:
+                return server.serve_file(logging.log_file, range_header=request.headers.get("range"))
+            size = logging.file_size(logging.log_file) or 0
+            start = max(0, size - int(query.get("tail", LOG_TAIL_BYTES)))
+            follow_ms = min(int(query.get("follow", 0)), LOG_FOLLOW_MAX_S) * 1000
+        except ValueError:
+            return "Invalid tail or follow value", 400
+        if follow_ms <= 0:
+            return logging.stream(start), 200, "text/plain"
+        if log_followers >= LOG_FOLLOWERS_MAX:
+            return server.Response("Too many log followers", 503, {"Retry-After": 10})
+        # counted from the first chunk, which the server asks for before it
+        # next awaits, so no other request can get past the check meanwhile
+        return followed(logging.stream(start, follow_ms)), 200, "text/plain"
+
+    def app_trace(request):
+        """The recorded trace points, oldest first
+
+        ?enable=<categories> and ?disable=<categories> (comma separated, or
+        all) switch categories, ?clear=1 empties the buffer.
+        """
+        query = request.query
+        try:
+            if "enable" in query:
+                trace.enable(trace.parse(query["enable"]))
+            if "disable" in query:
+                trace.disable(trace.parse(query["disable"]))
+        except KeyError as e:
+            return f"Unknown trace category {e}", 400
+        if query.get("clear") == "1":
+            trace.clear()
+        return trace.lines(), 200, "text/plain"
+
     def app_set_microsteps(request):
         """Set microstepping resolution"""
         global current_microsteps
@@ -505,6 +1057,7 @@ def application_mode():
                 new_microsteps = int(request.query['microsteps'])
                 if new_microsteps in [1, 2, 4, 8, 16, 32]:
                     current_microsteps = new_microsteps
+                    publish_state()
                     return f"Microstepping set to {current_microsteps}"
                 else:
                     return "Invalid microstepping value. Use: 1, 2, 4, 8, 16, or 32"
@@ -513,59 +1066,43 @@ def application_mode():
         except Exception as e:
             return f"Error setting microsteps: {e}"
 
-    def app_get_status(request):
-        """Get current system status including microstepping setting and network info"""
-        try:
-            import network
-            wlan = network.WLAN(network.STA_IF)
-            ip_address = wlan.ifconfig()[0]
-            
-            status = {
-                "microsteps": current_microsteps,
-                "motor_enabled": True,  # Could be enhanced to check actual motor status
-                "ramping_enabled": True,
-                "system": "ready",
-                "network": {
-                    "ip_address": ip_address,
-                    "primary_url": "http://picow.local",
-                    "access_methods": [
-                        "http://picow.local (recommended)",
-                        f"http://{ip_address} (direct IP)",
-                        "http://any-domain.com (DNS catchall)"
-                    ]
-                }
-            }
-            return json.dumps(status)
-        except Exception as e:
-            return f"Error getting status: {e}"
+    def state_response():
+        version, body = state.snapshot()
+        return server.Response(body, headers={
+            "Content-Type": "application/json",
+            "Content-Length": len(body),
+            "ETag": server.version_etag(version),
+        })
+
+    async def state_response_when_changed(since):
+        await state.wait(since, 25000)
+        return state_response()
+
+    def app_get_state(request):
+        """Serve the shared status/progress snapshot
 
-    def app_get_progress(request):
-        """Get timelapse progress and command execution status"""
+        ?since=<version> holds the request open (long poll) until the state
+        is newer than that version or 25 seconds pass.
+        """
         try:
-            print(f"DEBUG: /progress endpoint called - running={timelapse_running}, step={timelapse_current_step}/{timelapse_total_steps}, executing={command_executing}")
-            progress = {
-                "running": timelapse_running,
-                "current_step": timelapse_current_step,
-                "total_steps": timelapse_total_steps,
-                "percentage": int((timelapse_current_step / timelapse_total_steps * 100)) if timelapse_total_steps > 0 else 0,
-                "command_executing": command_executing
-            }
-            response_json = json.dumps(progress)
-            print(f"DEBUG: Progress response: {response_json}")
-            return response_json
-        except Exception as e:
-            print(f"DEBUG: Progress error: {e}")
-            return f"Error getting progress: {e}"
+            since = int(request.query.get("since", 0))
+        except ValueError:
+            return "Invalid since version", 400
+        if since >= state.version:
+            return server.AsyncResponse(state_response_when_changed(since))
+        return state_response()
             
     def app_debug_mdns(request):
         """Debug mDNS functionality"""
-        return """<!DOCTYPE html>
+        stats = mdns.stats()
+        return f"""<!DOCTYPE html>
 <html>
 <head><title>mDNS Debug</title></head>
 <body>
-<h1>mDNS Debug - Simplified</h1>
-<p>The system now uses <strong>picow.local</strong> as the default hostname.</p>
-<p>Try accessing: <a href="http://picow.local">http://picow.local</a></p>
+<h1>mDNS Debug</h1>
+<p>The responder answers <strong>{MDNS_HOSTNAME}.local</strong>.</p>
+<p>Queries: {stats['queries']}, answered: {stats['answered']}, unicast: {stats['unicast']}, rate limited: {stats['rate_limited']}</p>
+<p>Try accessing: <a href="http://{MDNS_HOSTNAME}.local">http://{MDNS_HOSTNAME}.local</a></p>
 <p><a href="/">Back to Home</a></p>
 </body>
 </html>"""
@@ -637,66 +1174,199 @@ def application_mode():
 </body>
 </html>"""
             
-    def app_test_ramping(request):
-        """Test ramping with a controlled movement sequence"""
+    async def ramping_test():
         try:
             print("Testing speed ramping...")
             # Test sequence: small move without ramping, large move with ramping
             
             # Small move (no ramping)
-            action(3 * current_microsteps, current_microsteps, 100, use_ramping=False)
-            utime.sleep(1)
+            await action(3 * current_microsteps, current_microsteps, 100, use_ramping=False)
+            await uasyncio.sleep(1)
             
             # Large move (with ramping)
-            action(50 * current_microsteps, current_microsteps, 300, use_ramping=True)
-            utime.sleep(1)
+            await action(50 * current_microsteps, current_microsteps, 300, use_ramping=True)
+            await uasyncio.sleep(1)
             
             # Return to start (with ramping)
-            action(-53 * current_microsteps, current_microsteps, 250, use_ramping=True)
+            await action(-53 * current_microsteps, current_microsteps, 250, use_ramping=True)
             
             return "Ramping test completed successfully"
         except Exception as e:
             return f"Ramping test failed: {e}"
 
+    def app_test_ramping(request):
+        """Test ramping with a controlled movement sequence"""
+        if command_executing or timelapse_running:
+            return "Error: Another command is already executing"
+        return server.AsyncResponse(ramping_test())
+
     def app_index(request):
         try:
-            print(f"DEBUG: Serving index page from {APP_TEMPLATE_PATH}/index.html")
-            return render_template(f"{APP_TEMPLATE_PATH}/index.html")
+            # index.html has no template tags, serve it as a file so it gets
+            # an ETag and repeat visits are answered with a 304
+            return server.serve_file(f"{APP_TEMPLATE_PATH}/index.html", "no-cache")
         except Exception as e:
             print(f"ERROR: Failed to render index template: {e}")
             return f"Template error: {e}"
 
+    def app_static(request, name):
+        # Asset names carry a content hash (see tools/build_web.py) so a
+        # given URL never changes content and can be cached indefinitely.
+        # Not a 404 though, the asset may be copied to the Pico later
+        response = server.serve_file(f"{APP_TEMPLATE_PATH}/static/{name}")
+        if response.status == 200:
+            response.add_header("Cache-Control", "public, max-age=31536000, immutable")
+        return response
+
     def app_toggle_led(request):
         onboard_led.toggle()
         return "OK"
 
+    def prepare_synced(command):
+        """Wake the driver just before a synchronised move starts"""
+        if not command.startswith("stop"):
+            mot.prewake()
+
+    async def run_synced(command):
+        """Run a command scheduled by the sync leader, at its start time"""
+        name, *args = command.split()
+        args = [float(arg) for arg in args]
+        try:
+            if name == "stop":
+                mot.emergency_stop()
+                halt_operations()
+            elif name == "video":
+                print(f"Sync: {set_video(args[0])}")
+            elif command_executing or timelapse_running:
+                print(f"Sync: {name} skipped, another command is executing")
+            elif name == "turn":
+                degrees, dps = args
+                steps = int(degrees / 360 * mot.steps_per_revolution * GEAR_RATIO * current_microsteps)
+                speed = int(turntable_dps_to_stepfreq(dps, current_microsteps))
+                await action(steps, current_microsteps, speed)
+            elif name == "timelapse":
+                angle, steps, pause = args
+                start_timelapse(angle, int(steps), pause)
+        except Exception as e:
+            print(f"Sync: {command} failed: {e}")
+
+    def app_sync(request, command):
+        """Run a command on all synchronised units at once, leader only
+
+        /sync/turn?angle=90&dps=30, /sync/video?dps=10,
+        /sync/timelapse?angle=360&steps=160&pause=3 or /sync/stop
+        """
+        if SYNC_ROLE != "leader" or sync_node is None:
+            return "Error: This unit is not the sync leader"
+        try:
+            query = request.query
+            if command == "stop":
+                sync_node.schedule("stop", lead_ms=0)  # As soon as received
+                return f"Stop sent to {len(sync_node.followers())} followers"
+            if command == "turn":
+                text = f"turn {float(query.get('angle', 360))} {float(query.get('dps', FULL_TURN_DPS))}"
+            elif command == "video":
+                text = f"video {float(query.get('dps', 0))}"
+            elif command == "timelapse":
+                text = f"timelapse {float(query.get('angle', 360))} {int(query.get('steps', 160))} {float(query.get('pause', 3.0))}"
+            else:
+                return f"Error: Unknown sync command {command}"
+            sync_node.schedule(text)
+            return f"{command} scheduled on {len(sync_node.followers()) + 1} units in {SYNC_LEAD_MS}ms"
+        except Exception as e:
+            return f"Sync error: {e}"
+
+    sync_node = None
+    try:
+        if SYNC_ROLE == "leader":
+            sync_node = sync.Leader(run_synced, SYNC_PORT, SYNC_LEAD_MS, on_prepare=prepare_synced,
+                                    prepare_ms=PREWAKE_MS)
+        elif SYNC_ROLE == "follower":
+            sync_node = sync.Follower(run_synced, SYNC_PORT, SYNC_LEADER, on_prepare=prepare_synced,
+                                      prepare_ms=PREWAKE_MS)
+        if sync_node is not None:
+            sync_node.start()
+            print(f"Sync {SYNC_ROLE} on UDP port {SYNC_PORT}")
+    except Exception as e:
+        print(f"WARNING: Sync not available: {e}")
+        sync_node = None
+
     def app_catch_all(request):
         # For any unmatched route, serve the main page (DNS catchall behavior)
         try:
-            print(f"DEBUG: Catch-all serving index for: {request.path}")
-            return render_template(f"{APP_TEMPLATE_PATH}/index.html")
+            if _TRACE:
+                trace.point(trace.HTTP, "catch-all serving index for {}", request.path)
+            return server.serve_file(f"{APP_TEMPLATE_PATH}/index.html", "no-cache")
         except Exception as e:
             print(f"ERROR: Catch-all template error: {e}")
             return f"Catch-all template error: {e}"
 
     server.add_route("/", handler=app_index, methods=["GET"])
+    server.add_route("/static/<name>", handler=app_static, methods=["GET"])
     server.add_route("/cw_a_bit", handler=app_cw_nudge, methods=["GET"])
     server.add_route("/ccw_a_bit", handler=app_ccw_nudge, methods=["GET"])
+    server.add_route("/jog", handler=app_jog, methods=["GET"], priority=True)
     server.add_route("/ccw_360", handler=app_ccw_360, methods=["GET"])
     server.add_route("/cw_360", handler=app_cw_360, methods=["GET"])
     server.add_route("/timelapse", handler=app_timelapse, methods=["GET"])
-    server.add_route("/stop", handler=app_stop, methods=["GET"])
+    server.add_route("/video", handler=app_video, methods=["GET"])
+    server.add_route("/stop", handler=app_stop, methods=["GET"], priority=True)
     server.add_route("/toggle", handler=app_toggle_led, methods=["GET"])
     server.add_route("/microsteps", handler=app_set_microsteps, methods=["GET"])
-    server.add_route("/status", handler=app_get_status, methods=["GET"])
-    server.add_route("/progress", handler=app_get_progress, methods=["GET"])
+    server.add_route("/status", handler=app_get_state, methods=["GET"], cache_control="no-cache")
+    server.add_route("/progress", handler=app_get_state, methods=["GET"], cache_control="no-cache")
     server.add_route("/test_ramping", handler=app_test_ramping, methods=["GET"])
     server.add_route("/debug_mdns", handler=app_debug_mdns, methods=["GET"])
     server.add_route("/debug_network", handler=app_debug_network, methods=["GET"])
     server.add_route("/debug_lwip", handler=app_debug_lwip, methods=["GET"])
     server.add_route("/debug_hostname", handler=app_debug_hostname, methods=["GET"])
+    server.add_route("/sync/<command>", handler=app_sync, methods=["GET"])
+    server.add_route("/calibrate", handler=app_calibrate, methods=["GET"])
+    server.add_route("/log", handler=app_log, methods=["GET"], cache_control="no-cache")
+    server.add_route("/trace", handler=app_trace, methods=["GET"], cache_control="no-cache")
+    server.add_route("/telemetry.csv", handler=app_telemetry_csv, methods=["GET"], cache_control="no-cache")
+    server.add_route("/telemetry/reset", handler=app_telemetry_reset, methods=["GET"])
     # Add other routes for your application...
     server.set_callback(app_catch_all)
+
+    if PROFILE:
+        def app_profile(request):
+            body = json.dumps(profiler.stats())
+            return body, 200, "application/json"
+
+        def app_profile_folded(request):
+            return profiler.folded(), 200, "text/plain"
+
+        profiler.wrap_routes()  # Before adding its own, which needn't be timed
+        server.add_route("/profile", handler=app_profile, methods=["GET"], cache_control="no-cache")
+        server.add_route("/profile.folded", handler=app_profile_folded, methods=["GET"], cache_control="no-cache")
+        profiler.enable(PROFILE_SAMPLE_HZ)
+        print(f"Profiling requests, sampling at {PROFILE_SAMPLE_HZ}Hz")
+
+    def resume_timelapse():
+        """Continue a timelapse that was interrupted by a reset"""
+        global timelapse_running, timelapse_current_step, timelapse_total_steps, command_executing
+        job = timelapse_journal.load()
+        if "N" not in job:  # No journal, or torn before the job was recorded
+            return
+        start_at_ms = job["T"] * 1000 + job["t"] if job.get("T") else None
+        if start_at_ms is not None and not ntp.clock.synced():
+            start_at_ms = None  # Can't wait for a wall clock time yet, start now
+        timelapse_running = True
+        command_executing = True
+        timelapse_current_step = job.get("F", 0)
+        timelapse_total_steps = job["N"]
+        publish_state()
+        print(f"Found interrupted timelapse at step {timelapse_current_step} of {job['N']}")
+        _thread.start_new_thread(timelapse_worker, (job["A"], job["N"], job["W"], start_at_ms, job,
+                                                    job.get("D", 0) == 1))
+
+    resume_timelapse()
+    state.update(calibration=calibration_state())
+
+    # Connectivity probes routed here by the DNS catchall get the answer they
+    # expect rather than the full index page
+    server.add_captive_portal_probes()
     
     print("Application mode routes configured")
 
@@ -709,6 +1379,25 @@ if (mot := drv8825_setup.setup_stepper()) is None:
 # Start with full steps for testing, then enable microstepping
 print(f"Motor initialized - testing with {current_microsteps} microstepping")
 
+# Emergency stop from the button interrupt, braking at a precomputed rate
+mot.set_stop_decel(STOP_DECEL_DPS2 / 360 * mot.steps_per_revolution * 32 * GEAR_RATIO)
+mot.set_idle_policy(IDLE_POLICY, IDLE_SLEEP_S, MOTOR_ENABLED_WATTS)
+trace.set_size(TRACE_RECORDS)
+trace.enable(trace.parse(TRACE_CATEGORIES))
+trace.echo = TRACE_ECHO
+switches = drv8825_setup.setup_switches(mot.emergency_stop)
+
+# Collect garbage only while the motor isn't stepping, and shed requests
+# before a fragmented heap can fail an allocation. The heap probe waits
+# for the worker threads (timelapse, calibration) and commands to finish
+memory.start(is_busy=mot.is_moving,
+             hold_probe=lambda: timelapse_running or calibration_running or command_executing)
+# Write logs, config and journals to flash (which stalls the CPU) only
+# while stepping is idle or slow enough not to notice. Started before
+# application_mode() so a resumed timelapse and boot moves are covered too,
+# the writes are committed once the event loop runs
+flash.start(is_quiet=lambda: not mot.is_moving() or abs(mot.get_velocity()) < FLASH_QUIET_STEP_HZ)
+
 try:
     os.stat(WIFI_FILE)
 
@@ -745,7 +1434,7 @@ try:
             print("Bad wifi connection!")
             print("This might be due to CYW43 WiFi chip issues")
             print(wifi_credentials)
-            os.remove(WIFI_FILE)
+            flash.remove(WIFI_FILE)
             machine_reset()
 
 except Exception:
@@ -10,8 +10,38 @@ except ImportError:
         print("WARNING: No socket module available")
         socket = None
 from . import logging
+try:
+  from .native import build_dns_response as _build_response
+except Exception: # no native emitter (or not micropython), pure python
+  _build_response = None
+
+def _answer(ip_address):
+  # the answer record appended to every query, built once
+  answer = b"\xC0\x0C" # pointer to domain name at byte 12
+  answer += b"\x00\x01\x00\x01" # type and class (A record / IN class)
+  answer += b"\x00\x00\x00\x3C" # time to live 60 seconds
+  answer += b"\x00\x04" # response length (4 bytes = 1 ipv4 address)
+  answer += bytes(map(int, ip_address.split("."))) # ip address parts
+  return answer
+
+def _build_response_py(request, answer, out):
+  # write the response into out, returns its length
+  length = len(request)
+  out[0:2] = request[:2] # request id
+  out[2:4] = b"\x81\x80" # response flags
+  out[4:8] = request[4:6] + request[4:6] # qd/an count
+  out[8:12] = b"\x00\x00\x00\x00" # ns/ar count
+  out[12:length] = request[12:] # origional request body
+  out[length:length + len(answer)] = answer
+  return length + len(answer)
+
+if _build_response is None:
+  _build_response = _build_response_py
 
 async def _handler(socket_obj, ip_address):
+  answer = _answer(ip_address)
+  out = bytearray(256 + len(answer))
+  response = memoryview(out)
   while True:
     try:
       # Simple approach - poll for data availability
@@ -21,18 +51,11 @@ async def _handler(socket_obj, ip_address):
       except OSError:
         # No data available, continue loop
         continue
-        
-      response = request[:2] # request id
-      response += b"\x81\x80" # response flags
-      response += request[4:6] + request[4:6] # qd/an count
-      response += b"\x00\x00\x00\x00" # ns/ar count
-      response += request[12:] # origional request body
-      response += b"\xC0\x0C" # pointer to domain name at byte 12
-      response += b"\x00\x01\x00\x01" # type and class (A record / IN class)
-      response += b"\x00\x00\x00\x3C" # time to live 60 seconds
-      response += b"\x00\x04" # response length (4 bytes = 1 ipv4 address)
-      response += bytes(map(int, ip_address.split("."))) # ip address parts
-      socket_obj.sendto(response, client)
+      if len(request) < 12: # shorter than a dns header
+        continue
+
+      length = _build_response(request, answer, out)
+      socket_obj.sendto(response[:length], client)
     except Exception as e:
       logging.error(f"DNS handler error: {e}")
       await uasyncio.sleep_ms(100)  # Prevent tight error loops
@@ -0,0 +1,181 @@
+# flash write coordinator. on the rp2040 every flash program or erase
+# stalls execution from flash (XIP) with interrupts off, so a log line or
+# a config file written while the timer interrupt is stepping a motor
+# delays steps by up to a sector erase (tens of ms).
+#
+# every writer (logging, config files, journals) goes through here: a
+# write is queued in RAM and committed by an idle task only while the
+# application says writing is safe, e.g. no move is active or the step
+# rate is low. writes queued while it isn't are counted as deferred.
+# consecutive appends to the same file are merged, so a burst of log
+# lines during a move costs one write afterwards.
+#
+# until start() is called (and for scripts that never call it) writes
+# are committed immediately, as if there was no coordinator
+import os, uasyncio, _thread
+
+# droppable writes (log lines) are discarded oldest first once more than
+# this is queued, the others are kept whatever the size
+max_queued_bytes = 4096
+# milliseconds between checks for a safe window
+poll_interval_ms = 50
+
+_APPEND = 0
+_REPLACE = 1
+_REMOVE = 2
+_CALL = 3
+
+_is_quiet = None
+_queue = [] # [kind, path, data, droppable]
+_queued_bytes = 0
+_lock = _thread.allocate_lock() # the queue, writers may run in threads
+_commit_lock = _thread.allocate_lock() # keeps commits in queue order
+_deferred_bytes = 0
+_dropped_bytes = 0
+_commits = 0
+_errors = 0
+
+
+def _size(entry):
+  return len(entry[2]) if entry[0] == _APPEND or entry[0] == _REPLACE else 0
+
+
+def _enqueue(kind, path, data, droppable=False):
+  global _queued_bytes, _deferred_bytes, _dropped_bytes
+  with _lock:
+    last = _queue[-1] if _queue else None
+    if kind == _APPEND and last and last[0] == _APPEND and last[1] == path and last[3] == droppable:
+      last[2] += data
+    else:
+      if kind == _REPLACE or kind == _REMOVE:
+        # supersedes whatever is still queued for the file
+        for entry in [e for e in _queue if e[1] == path and e[0] != _CALL]:
+          _queue.remove(entry)
+          _queued_bytes -= _size(entry)
+      _queue.append([kind, path, data, droppable])
+    size = len(data) if kind != _CALL and data else 0
+    _queued_bytes += size
+    if _is_quiet is not None and not _is_quiet():
+      _deferred_bytes += size
+    while _queued_bytes > max_queued_bytes:
+      entry = next((e for e in _queue if e[3]), None)
+      if entry is None:
+        break
+      excess = _queued_bytes - max_queued_bytes
+      if len(entry[2]) <= excess:
+        _queue.remove(entry)
+        dropped = len(entry[2])
+      else:
+        # drop whole lines from the front of the oldest droppable append
+        cut = entry[2].find(b"\n", excess - 1) + 1 or len(entry[2])
+        entry[2] = entry[2][cut:]
+        dropped = cut
+        if not entry[2]:
+          _queue.remove(entry)
+      _queued_bytes -= dropped
+      _dropped_bytes += dropped
+  if _is_quiet is None:
+    flush()
+
+
+# queue data (str or bytes) to be appended to the file at path.
+# droppable data (e.g. log lines) may be discarded if the queue overflows
+def append(path, data, droppable=False):
+  _enqueue(_APPEND, path, data.encode() if isinstance(data, str) else bytes(data), droppable)
+
+
+# queue replacing the file at path with data. the new file is written
+# aside and renamed over the old one, so a reset leaves either of them
+def replace(path, data):
+  _enqueue(_REPLACE, path, data.encode() if isinstance(data, str) else bytes(data))
+
+
+# queue deleting the file at path, if there is one
+def remove(path):
+  _enqueue(_REMOVE, path, None)
+
+
+# queue a call of function(*args) that writes to flash itself, e.g. to
+# truncate a file. it runs in order with the other queued writes
+def call(function, *args):
+  _enqueue(_CALL, None, (function, args))
+
+
+# bytes queued for the file at path, or for all files
+def pending_bytes(path=None):
+  with _lock:
+    return sum(_size(e) for e in _queue if path is None or e[1] == path)
+
+
+def _commit(entry):
+  kind, path, data, _ = entry
+  if kind == _APPEND:
+    with open(path, "ab") as f:
+      f.write(data)
+  elif kind == _REPLACE:
+    with open(path + ".tmp", "wb") as f:
+      f.write(data)
+    try:
+      os.rename(path + ".tmp", path)
+    except OSError: # filesystems that don't rename over an existing file
+      os.remove(path)
+      os.rename(path + ".tmp", path)
+  elif kind == _REMOVE:
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+  else:
+    data[0](*data[1])
+
+
+# commit the oldest queued write, False when there was none
+def _commit_next():
+  global _queued_bytes, _commits, _errors
+  with _commit_lock:
+    with _lock:
+      if not _queue:
+        return False
+      entry = _queue.pop(0)
+      _queued_bytes -= _size(entry)
+    try:
+      _commit(entry)
+      _commits += 1
+    except Exception as e:
+      # not through logging, which would queue another write
+      _errors += 1
+      print("flash write failed:", entry[1], e)
+  return True
+
+
+# commit everything queued now, safe window or not, e.g. before a reset
+def flush():
+  while _commit_next():
+    pass
+
+
+def stats():
+  return {
+    "queued": len(_queue),
+    "queued_bytes": _queued_bytes,
+    "deferred_bytes": _deferred_bytes,
+    "dropped_bytes": _dropped_bytes,
+    "commits": _commits,
+    "errors": _errors,
+  }
+
+
+async def _commit_task():
+  while True:
+    await uasyncio.sleep_ms(poll_interval_ms)
+    # one write at a time, a move may have started in between
+    while _queue and _is_quiet() and _commit_next():
+      pass
+
+
+# start queueing writes. is_quiet() is polled before each commit, return
+# True from it while flash can be written without disturbing anything
+def start(is_quiet=lambda: True):
+  global _is_quiet
+  _is_quiet = is_quiet
+  uasyncio.get_event_loop().create_task(_commit_task())
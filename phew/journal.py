@@ -0,0 +1,98 @@
+# append-only journal of small fixed size records on flash, for state that
+# has to survive a reset or power loss (e.g. the progress of a long job).
+#
+# every record is 8 bytes: a one letter kind, a 4 byte value and a
+# checksum, so recording progress costs a few bytes per append rather
+# than rewriting a file. a write torn by power loss fails its checksum
+# and only that record is lost. a journal holds the latest value of each
+# kind, which is all that compaction keeps when the file has grown to
+# max_records - rare, and a rewrite of a few records only.
+#
+# writes go through the flash coordinator (phew.flash), so an append
+# reaches flash in the next safe window rather than in the middle of a move
+import struct
+from . import flash
+
+_RECORD_SIZE = 8
+
+
+# fletcher-16 of the kind and value, scrambled so erased (0xff) and zeroed
+# flash never pass as a valid record
+def _checksum(data):
+  a = b = 0
+  for byte in data:
+    a = (a + byte) % 255
+    b = (b + a) % 255
+  return ((b << 8) | a) ^ 0xa5a5
+
+
+class Journal:
+  # formats maps each record kind (a letter) to the struct format of its
+  # value: "i" (signed), "I" (unsigned) or "f" (float)
+  def __init__(self, path, formats, max_records=512):
+    self.path = path
+    self.formats = formats
+    self.max_records = max_records
+    self._values = {}
+    self._count = 0
+
+  def _pack(self, kind, value):
+    record = struct.pack("<Bx" + self.formats[kind], ord(kind), value)
+    return record + struct.pack("<H", _checksum(record))
+
+  # the latest value of each kind in the journal on flash, {} when there
+  # is none. a torn record at the end is dropped by compacting
+  def load(self):
+    values = {}
+    count = 0
+    torn = False
+    try:
+      with open(self.path, "rb") as f:
+        while True:
+          record = f.read(_RECORD_SIZE)
+          if not record:
+            break
+          if len(record) < _RECORD_SIZE or \
+              struct.unpack("<H", record[6:])[0] != _checksum(record[:6]):
+            torn = True
+            break
+          kind = chr(record[0])
+          if kind in self.formats:
+            values[kind] = struct.unpack("<" + self.formats[kind], record[2:6])[0]
+          count += 1
+    except OSError:
+      pass
+    self._values = values
+    self._count = count
+    if torn:
+      self.compact()
+    return dict(values)
+
+  # replace the journal with the given values, e.g. to start a new job
+  def start(self, **values):
+    self._rewrite(values)
+
+  # record a value, on flash once the coordinator commits it
+  def append(self, kind, value):
+    flash.append(self.path, self._pack(kind, value))
+    self._values[kind] = value
+    self._count += 1
+    if self._count >= self.max_records:
+      self.compact()
+
+  # rewrite the journal with just the latest value of each kind
+  def compact(self):
+    self._rewrite(self._values)
+
+  def _rewrite(self, values):
+    # replaced in one step (a rename on littlefs), so a reset leaves
+    # either the old or the new journal
+    flash.replace(self.path, b"".join(self._pack(kind, value) for kind, value in values.items()))
+    self._values = dict(values)
+    self._count = len(values)
+
+  # delete the journal, e.g. when its job has finished
+  def remove(self):
+    flash.remove(self.path)
+    self._values = {}
+    self._count = 0
@@ -1,4 +1,5 @@
-import machine, os, gc
+import machine, os, gc, time
+from . import flash
 
 log_file = "log.txt"
 
@@ -41,6 +42,10 @@ def disable_logging_types(types):
   global _logging_types
   _logging_types = _logging_types & ~types
 
+# whether messages of types are logged, to skip formatting them otherwise
+def enabled(types):
+  return bool(_logging_types & types)
+
 # truncates the log file down to a target size while maintaining
 # clean line breaks
 def truncate(file, target_size):
@@ -80,15 +85,61 @@ def truncate(file, target_size):
   os.rename(file + ".tmp", file)
 
 
+_truncate_queued = False
+
+def _truncate_log():
+  global _truncate_queued
+  _truncate_queued = False
+  truncate(log_file, _log_truncate_to)
+
+# generate the log from byte offset position on, a chunk at a time, for
+# streaming it without loading the file. a position inside a line starts
+# at the next line. with follow_ms the lines written later are streamed
+# too for that long, yielding the ms to wait (an int) while there's
+# nothing new, see server. when the log is truncated meanwhile the
+# stream carries on from its new end
+def stream(position=0, follow_ms=0, poll_ms=250):
+  buffer = bytearray(256)
+  view = memoryview(buffer)
+  started = time.ticks_ms()
+  partial_line = position > 0
+  while True:
+    size = file_size(log_file) or 0
+    if size < position:
+      position = size
+    while position < size:
+      # reopened for every chunk, the file may be rewritten between them
+      with open(log_file, "rb") as f:
+        f.seek(position)
+        count = f.readinto(buffer)
+      if not count:
+        break
+      position += count
+      start = 0
+      if partial_line:
+        start = bytes(view[:count]).find(b"\n") + 1
+        if start == 0:
+          continue # still inside the first line
+        partial_line = False
+      if start < count:
+        yield view[start:count]
+    if time.ticks_diff(time.ticks_ms(), started) >= follow_ms:
+      return
+    yield poll_ms
+
 def log(level, text):
+  global _truncate_queued
   datetime = datetime_string()
   log_entry = "{0} [{1:8} /{2:>4}kB] {3}".format(datetime, level, round(gc.mem_free() / 1024), text)
   print(log_entry)
-  with open(log_file, "a") as logfile:
-    logfile.write(log_entry + '\n')
-
-  if _log_truncate_at and file_size(log_file) > _log_truncate_at:
-    truncate(log_file, _log_truncate_to)
+  # written by the flash coordinator when it's safe, and dropped if too
+  # many lines pile up before then
+  flash.append(log_file, log_entry + '\n', droppable=True)
+
+  if _log_truncate_at and not _truncate_queued and \
+      (file_size(log_file) or 0) + flash.pending_bytes(log_file) > _log_truncate_at:
+    _truncate_queued = True
+    flash.call(_truncate_log)
 
 def info(*items):
   if _logging_types & LOG_INFO:
@@ -0,0 +1,201 @@
+# minimal mdns responder for <hostname>.local, a uasyncio task polling its
+# socket next to phew.dns.
+#
+# the responses are built once: an A record for the hostname, and an NSEC
+# record saying it has no other addresses. without the NSEC, clients
+# asking for the AAAA record (as browsers do alongside A) wait for their
+# query to time out before connecting, seconds on the first page load.
+# multicast answers of the same packet are rate limited to one per second
+# (rfc 6762) and the hostname is announced at start and every
+# announce_interval_s after. legacy unicast queries (not from port 5353,
+# e.g. nslookup) get a unicast response echoing their question
+import time, uasyncio
+try:
+  import socket
+except ImportError:
+  import usocket as socket
+from . import logging
+
+MDNS_GROUP = "224.0.0.251"
+MDNS_PORT = 5353
+TTL = 120 # seconds, as rfc 6762 recommends for host records
+
+# reannounce well within the ttl so caches don't expire it
+announce_interval_s = 60
+
+_TYPE_A = 1
+_TYPE_AAAA = 28
+_TYPE_NSEC = 47
+_TYPE_ANY = 255
+_CLASS_ANY = 255
+_CLASS_IN = 1
+_CACHE_FLUSH = 0x8000 # in a record class: replaces cached records
+_UNICAST_RESPONSE = 0x8000 # in a question class: "answer me directly"
+
+_stats = {"queries": 0, "answered": 0, "unicast": 0, "rate_limited": 0}
+
+
+def _encode_name(name):
+  encoded = b""
+  for label in name.split("."):
+    encoded += bytes([len(label)]) + label.encode()
+  return encoded + b"\x00"
+
+
+def _record(rtype, rclass, ttl, rdata):
+  # name is a pointer to the first name in the packet, at byte 12
+  return b"\xc0\x0c" + rtype.to_bytes(2, "big") + rclass.to_bytes(2, "big") + \
+    ttl.to_bytes(4, "big") + len(rdata).to_bytes(2, "big") + rdata
+
+
+def _a_record(ip_address, rclass, ttl):
+  return _record(_TYPE_A, rclass, ttl, bytes(map(int, ip_address.split("."))))
+
+
+def _nsec_record(rclass, ttl):
+  # next name (the hostname), window block 0 with only the A type bit set
+  return _record(_TYPE_NSEC, rclass, ttl, b"\xc0\x0c\x00\x01\x40")
+
+
+def _header(query_id, questions, answers, additional):
+  return query_id.to_bytes(2, "big") + b"\x84\x00" + questions.to_bytes(2, "big") + \
+    answers.to_bytes(2, "big") + b"\x00\x00" + additional.to_bytes(2, "big")
+
+
+# multicast responses: (answer for A queries, answer for AAAA queries)
+def _responses(hostname, ip_address):
+  name = _encode_name(hostname)
+  rclass = _CLASS_IN | _CACHE_FLUSH
+  # the hostname is spelled out in the first record, the others point to it
+  a_first = name + _a_record(ip_address, rclass, TTL)[2:]
+  nsec_first = name + _nsec_record(rclass, TTL)[2:]
+  return (
+    _header(0, 0, 1, 1) + a_first + _nsec_record(rclass, TTL),
+    _header(0, 0, 1, 1) + nsec_first + _a_record(ip_address, rclass, TTL),
+  )
+
+
+# a legacy unicast response repeats the question, no cache flush bit and a
+# short ttl (rfc 6762 6.7)
+def _unicast_response(query_id, question, qtype, ip_address):
+  if qtype == _TYPE_AAAA:
+    answer = _nsec_record(_CLASS_IN, 10)
+  else:
+    answer = _a_record(ip_address, _CLASS_IN, 10)
+  return _header(query_id, 1, 1, 0) + question + answer
+
+
+# (lower case name, offset after it) of the name at offset, following
+# compression pointers
+def _read_name(packet, offset):
+  labels = []
+  end = None
+  for _ in range(16): # bounds the pointers followed
+    length = packet[offset]
+    if length & 0xc0 == 0xc0:
+      if end is None:
+        end = offset + 2
+      offset = ((length & 0x3f) << 8) | packet[offset + 1]
+      continue
+    if length == 0:
+      return b".".join(labels).lower(), end if end is not None else offset + 1
+    labels.append(bytes(packet[offset + 1:offset + 1 + length]))
+    offset += 1 + length
+  raise ValueError("name too long")
+
+
+# the first question about hostname: (question bytes, type, wants unicast)
+def _match(packet, hostname):
+  if len(packet) < 12 or packet[2] & 0x80: # short, or a response
+    return None
+  offset = 12
+  for _ in range(packet[4] << 8 | packet[5]):
+    name, offset = _read_name(packet, offset)
+    qtype = packet[offset] << 8 | packet[offset + 1]
+    qclass = packet[offset + 2] << 8 | packet[offset + 3]
+    offset += 4
+    if name == hostname and qclass & ~_UNICAST_RESPONSE in (_CLASS_IN, _CLASS_ANY) and \
+        qtype in (_TYPE_A, _TYPE_AAAA, _TYPE_ANY):
+      # a question with a compressed name is echoed with it spelled out
+      question = _encode_name(name.decode()) + packet[offset - 4:offset - 2] + b"\x00\x01"
+      return question, qtype, qclass & _UNICAST_RESPONSE
+  return None
+
+
+async def _handler(sock, hostname, ip_address):
+  hostname = hostname.lower().encode()
+  responses = _responses(hostname.decode(), ip_address)
+  group = (MDNS_GROUP, MDNS_PORT)
+  sent = {} # response: ticks_ms of its last multicast
+  announced = None
+  announcements = 0
+  while True:
+    try:
+      await uasyncio.sleep_ms(10)
+      now = time.ticks_ms()
+      # announce twice a second apart at start (rfc 6762 8.3), then
+      # periodically
+      interval_ms = 1000 if announcements < 2 else announce_interval_s * 1000
+      if announced is None or time.ticks_diff(now, announced) >= interval_ms:
+        sock.sendto(responses[0], group)
+        sent[responses[0]] = announced = now
+        announcements += 1
+
+      try:
+        packet, client = sock.recvfrom(512)
+      except OSError:
+        continue # nothing received
+      try:
+        match = _match(packet, hostname)
+      except (IndexError, ValueError): # malformed, not worth logging
+        match = None
+      if match is None:
+        continue
+      _stats["queries"] += 1
+      question, qtype, unicast = match
+      if client[1] != MDNS_PORT:
+        query_id = packet[0] << 8 | packet[1]
+        sock.sendto(_unicast_response(query_id, question, qtype, ip_address), client)
+        _stats["unicast"] += 1
+        continue
+      response = responses[1] if qtype == _TYPE_AAAA else responses[0]
+      if unicast:
+        sock.sendto(response, client)
+        _stats["unicast"] += 1
+      elif response in sent and time.ticks_diff(now, sent[response]) < 1000:
+        _stats["rate_limited"] += 1
+        continue
+      else:
+        sock.sendto(response, group)
+        sent[response] = now
+      _stats["answered"] += 1
+    except Exception as e:
+      logging.error(f"mDNS handler error: {e}")
+      await uasyncio.sleep_ms(100) # prevent tight error loops
+
+
+def stats():
+  return dict(_stats)
+
+
+# answer <hostname>.local with ip_address. returns False if the responder
+# couldn't start, e.g. when lwip's own responder already has the port
+def run(hostname, ip_address):
+  if socket is None:
+    logging.error("No socket module available - mDNS responder cannot start")
+    return False
+  try:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", MDNS_PORT))
+    # join the group on the interface with ip_address (lwip's values when
+    # the port doesn't name them)
+    membership = bytes(map(int, MDNS_GROUP.split("."))) + bytes(map(int, ip_address.split(".")))
+    sock.setsockopt(getattr(socket, "IPPROTO_IP", 0), getattr(socket, "IP_ADD_MEMBERSHIP", 0x400), membership)
+  except Exception as e:
+    logging.error(f"Failed to start mDNS responder: {e}")
+    return False
+  uasyncio.get_event_loop().create_task(_handler(sock, hostname + ".local", ip_address))
+  logging.info(f"> mDNS responder answering {hostname}.local with {ip_address}")
+  return True
@@ -0,0 +1,174 @@
+# heap management for long running servers. micropython's heap doesn't
+# compact, so a unit that keeps allocating large short lived blocks
+# (file chunks, request bodies, templates) slowly fragments it until a
+# large allocation fails with MemoryError even though plenty is free.
+#
+# - the large buffers are preallocated once at boot and reused (pools)
+# - garbage is collected in idle windows, when the application says it
+#   isn't busy (e.g. not stepping a motor), rather than whenever the
+#   allocator crosses gc.threshold in the middle of something
+# - the largest free block is probed periodically, up to probe_max_bytes,
+#   and while it's below shed_below_bytes the server sheds new requests
+#   with a 503 before an allocation that matters can. the probe never
+#   takes more than probe_max_bytes, so it can't starve anything else of
+#   memory, and it's held back while other threads may allocate (see
+#   start). a low result only sheds until it's probe_interval_s old, a
+#   long busy spell without probes doesn't shed throughout
+import gc, time, uasyncio
+from . import logging
+
+# collect in an idle window once this much was allocated since the last
+# collection (or when request_collect() was called)
+collect_after_bytes = 16384
+# automatic collection by the allocator, only a safety net
+safety_threshold_bytes = 65536
+# shed requests while the largest free block is smaller than this
+shed_below_bytes = 8192
+# the probe looks for free blocks up to this size, not beyond
+probe_max_bytes = 16384
+# seconds between largest free block probes, and how long a result holds
+probe_interval_s = 10
+
+_is_busy = None
+_hold_probe = None
+_collect_requested = False
+_collections = 0
+_shed = 0
+_largest_free = None # up to probe_max_bytes, None before the first probe
+_probed_at = 0
+_history = [] # (ticks_ms, largest free block) of recent probes
+_HISTORY_LENGTH = 12
+
+
+class BufferPool:
+  # a fixed set of equal sized buffers allocated up front. get() hands out
+  # a free one (or allocates a temporary one when all are in use, which is
+  # counted as a miss), put() returns it
+  def __init__(self, size, count):
+    self.size = size
+    self.count = count
+    self.misses = 0
+    self._free = [bytearray(size) for _ in range(count)]
+
+  def get(self):
+    if self._free:
+      return self._free.pop()
+    self.misses += 1
+    return bytearray(self.size)
+
+  def put(self, buffer):
+    if len(self._free) < self.count and len(buffer) == self.size:
+      self._free.append(buffer)
+
+
+# preallocated at import, i.e. at boot before the heap fragments
+chunk_pool = BufferPool(1024, 2) # streaming files to clients
+body_pool = BufferPool(2048, 1) # reading request bodies
+
+
+# ask for a collection at the next idle window, e.g. after a move
+def request_collect():
+  global _collect_requested
+  _collect_requested = True
+
+
+# find the largest block up to limit bytes that can be allocated right
+# now, by bisection. every probe leaves garbage, so this collects before
+# and after
+def largest_free_block(limit, resolution=256):
+  gc.collect()
+  low, high = 0, min(limit, gc.mem_free()) + 1
+  while high - low > resolution:
+    size = (low + high) // 2
+    try:
+      block = bytearray(size)
+      block = None
+      low = size
+    except MemoryError:
+      high = size
+  gc.collect()
+  return low
+
+
+# True while requests should be shed to keep the heap from failing, i.e.
+# the last probe was low and isn't older than probe_interval_s
+def low_memory():
+  return _largest_free is not None and _largest_free < shed_below_bytes and \
+    time.ticks_diff(time.ticks_ms(), _probed_at) < probe_interval_s * 1000
+
+
+def count_shed():
+  global _shed
+  _shed += 1
+
+
+# change of the largest free block in bytes per minute over the recent
+# probes, negative while the heap is fragmenting. blocks beyond
+# probe_max_bytes aren't seen, so it's flat while there is plenty
+def trend():
+  if len(_history) < 2:
+    return 0
+  (first_ms, first), (last_ms, last) = _history[0], _history[-1]
+  elapsed = time.ticks_diff(last_ms, first_ms)
+  return (last - first) * 60000 // elapsed if elapsed > 0 else 0
+
+
+def stats():
+  return {
+    "free": gc.mem_free(),
+    "largest_free": _largest_free,
+    "trend_per_min": trend(),
+    "collections": _collections,
+    "shed": _shed,
+    "pool_misses": chunk_pool.misses + body_pool.misses,
+  }
+
+
+def _probe():
+  global _largest_free, _probed_at
+  _largest_free = largest_free_block(probe_max_bytes)
+  _probed_at = time.ticks_ms()
+  _history.append((_probed_at, _largest_free))
+  if len(_history) > _HISTORY_LENGTH:
+    _history.pop(0)
+  if _largest_free < shed_below_bytes:
+    logging.warn(f"> low memory: largest free block {_largest_free} bytes, shedding requests")
+
+
+async def _idle_task():
+  global _collect_requested, _collections
+  collected_at = gc.mem_alloc()
+  probed_at = time.ticks_ms()
+  while True:
+    await uasyncio.sleep_ms(100)
+    if _is_busy is not None and _is_busy():
+      continue
+    if _collect_requested or gc.mem_alloc() - collected_at >= collect_after_bytes:
+      gc.collect()
+      _collections += 1
+      _collect_requested = False
+      collected_at = gc.mem_alloc()
+    # a probe collects too, so it's held back until idle as well, and
+    # while hold_probe() asks for it
+    if _hold_probe is not None and _hold_probe():
+      continue
+    if time.ticks_diff(time.ticks_ms(), probed_at) >= probe_interval_s * 1000:
+      _probe()
+      _collections += 1
+      probed_at = time.ticks_ms()
+      collected_at = gc.mem_alloc()
+
+
+# start collecting in idle windows. is_busy() is polled before each
+# collection, return True from it while a collection must not run.
+# hold_probe() is polled before each probe, return True from it while
+# another thread (or a timer callback) may be allocating, so the probe's
+# block can't make that allocation fail
+def start(is_busy=None, hold_probe=None):
+  global _is_busy, _hold_probe
+  _is_busy = is_busy
+  _hold_probe = hold_probe
+  gc.threshold(safety_threshold_bytes)
+  if hold_probe is None or not hold_probe():
+    _probe()
+  uasyncio.get_event_loop().create_task(_idle_task())
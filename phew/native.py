@@ -0,0 +1,80 @@
+# viper (machine code) versions of phew's per request byte crunching.
+# server.py and dns.py use these when this module can be imported, that
+# fails on firmware without the native emitters and on CPython, and fall
+# back to their pure python versions
+import micropython
+
+
+@micropython.viper
+def urldecode_into(src, dst) -> int:
+  # decode the url encoded bytes src into the bytearray dst (at least as
+  # long as src), returns the decoded length. returns -1 for a malformed
+  # % escape, or one of a code above 127 (which the python version turns
+  # into chr(code), not a utf-8 byte), for the caller to fall back to it
+  s = ptr8(src)
+  d = ptr8(dst)
+  n = int(len(src))
+  i = 0
+  j = 0
+  while i < n:
+    c = int(s[i])
+    if c == 43: # '+'
+      c = 32
+    elif c == 37: # '%'
+      if i + 2 >= n:
+        return -1
+      code = 0
+      k = 1
+      while k < 3:
+        h = int(s[i + k])
+        if h >= 48 and h <= 57: # 0-9
+          h -= 48
+        elif h >= 97 and h <= 102: # a-f
+          h -= 87
+        elif h >= 65 and h <= 70: # A-F
+          h -= 55
+        else:
+          return -1
+        code = (code << 4) | h
+        k += 1
+      if code > 127:
+        return -1
+      c = code
+      i += 2
+    d[j] = c
+    j += 1
+    i += 1
+  return j
+
+
+@micropython.viper
+def build_dns_response(request, tail, out) -> int:
+  # write the answer to the dns query in request into the bytearray out:
+  # the query with the response flags and answer count set, followed by
+  # the precomputed answer record in tail. returns the response length
+  s = ptr8(request)
+  t = ptr8(tail)
+  d = ptr8(out)
+  n = int(len(request))
+  m = int(len(tail))
+  d[0] = s[0] # request id
+  d[1] = s[1]
+  d[2] = 0x81 # response flags
+  d[3] = 0x80
+  d[4] = s[4] # qd/an count
+  d[5] = s[5]
+  d[6] = s[4]
+  d[7] = s[5]
+  d[8] = 0 # ns/ar count
+  d[9] = 0
+  d[10] = 0
+  d[11] = 0
+  i = 12
+  while i < n: # original request body
+    d[i] = s[i]
+    i += 1
+  i = 0
+  while i < m:
+    d[n + i] = t[i]
+    i += 1
+  return n + m
@@ -1,4 +1,4 @@
-import machine, time, struct
+import machine, time, struct, uasyncio
 try:
     # Try modern socket import first
     import socket
@@ -9,6 +9,12 @@ except ImportError:
     except ImportError:
         print("WARNING: No socket module available")
         socket = None
+from . import logging, trace
+from .trace import const
+
+_TRACE = const(1) # 0 compiles the trace points out, see trace.py
+
+NTP_DELTA = 2208988800 # seconds between the ntp (1900) and unix (1970) epochs
 
 def fetch(synch_with_rtc=True, timeout=10):
   ntp_host = "pool.ntp.org"
@@ -27,7 +33,7 @@ def fetch(synch_with_rtc=True, timeout=10):
     sock.sendto(query, address)
     data = sock.recv(48)
     sock.close()
-    local_epoch = 2208988800 # selected by Chris - blame him. :-D
+    local_epoch = NTP_DELTA # selected by Chris - blame him. :-D
     timestamp = struct.unpack("!I", data[40:44])[0] - local_epoch
     timestamp = time.gmtime(timestamp)
   except Exception as e:
@@ -40,4 +46,202 @@ def fetch(synch_with_rtc=True, timeout=10):
       timestamp[0], timestamp[1], timestamp[2], timestamp[6], 
       timestamp[3], timestamp[4], timestamp[5], 0))      
 
-  return timestamp
\ No newline at end of file
+  return timestamp
+
+
+# maps time.ticks_ms() onto utc milliseconds since the unix epoch.
+#
+# each ntp exchange gives a sample (tick, utc_ms). a least squares fit of
+# the offset between the two over the recent samples gives the offset and
+# the drift of the local oscillator, so the mapping stays accurate between
+# syncs. samples are stored relative to the newest one so that the fit is
+# done on small numbers (floats are single precision on most ports)
+class Clock:
+  def __init__(self, max_samples=8):
+    self.max_samples = max_samples
+    self._samples = [] # (tick, utc_ms, delay_ms)
+    self._ref_tick = None
+    self._ref_utc_ms = 0
+    self._offset_ms = 0.0 # fitted offset at the reference tick
+    self._drift = 0.0 # fitted clock drift (ms per ms)
+    self._last_ms = 0
+
+  def synced(self):
+    return self._ref_tick is not None
+
+  @property
+  def drift_ppm(self):
+    return self._drift * 1000000
+
+  def add_sample(self, tick, utc_ms, delay_ms=0):
+    self._samples.append((tick, utc_ms, delay_ms))
+    if len(self._samples) > self.max_samples:
+      self._samples.pop(0)
+
+    # x: ms of local time before the newest sample,
+    # y: how far utc moved beyond that local time (relative offset)
+    xs, ys = [], []
+    for sample_tick, sample_utc_ms, _ in self._samples:
+      x = time.ticks_diff(sample_tick, tick)
+      xs.append(x)
+      ys.append((sample_utc_ms - utc_ms) - x)
+
+    n = len(xs)
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    sxx = sum((x - mean_x) * (x - mean_x) for x in xs)
+    drift = 0.0
+    if sxx > 0:
+      drift = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sxx
+
+    self._drift = drift
+    self._offset_ms = mean_y - drift * mean_x
+    self._ref_tick = tick
+    self._ref_utc_ms = utc_ms
+
+  def _utc_ms_at(self, tick):
+    x = time.ticks_diff(tick, self._ref_tick)
+    return self._ref_utc_ms + x + int(self._offset_ms + self._drift * x)
+
+  # current utc time in milliseconds, never goes backwards even when a new
+  # sample pulls the estimate back slightly
+  def now_ms(self):
+    if self._ref_tick is None:
+      return None
+    now = self._utc_ms_at(time.ticks_ms())
+    if now < self._last_ms:
+      return self._last_ms
+    self._last_ms = now
+    return now
+
+  # the time.ticks_ms() value at which utc_ms will be reached
+  def ticks_at(self, utc_ms):
+    x = (utc_ms - self._ref_utc_ms - self._offset_ms) / (1 + self._drift)
+    return time.ticks_add(self._ref_tick, int(x))
+
+  # ms until utc_ms, negative once it has passed
+  def ms_until(self, utc_ms):
+    return time.ticks_diff(self.ticks_at(utc_ms), time.ticks_ms())
+
+  # sleep until utc_ms, coarse async sleeps then a short spin on the
+  # tick counter for millisecond alignment
+  async def sleep_until(self, utc_ms, spin_ms=20):
+    while True:
+      remaining = self.ms_until(utc_ms)
+      if remaining <= spin_ms:
+        break
+      await uasyncio.sleep_ms(remaining - spin_ms)
+    target = self.ticks_at(utc_ms)
+    while time.ticks_diff(target, time.ticks_ms()) > 0:
+      await uasyncio.sleep_ms(0)
+
+  # blocking version of sleep_until for use from a worker thread, gives
+  # up early if keep_waiting() returns False
+  def wait_until(self, utc_ms, keep_waiting=None, spin_ms=20):
+    target = self.ticks_at(utc_ms)
+    while True:
+      remaining = time.ticks_diff(target, time.ticks_ms())
+      if remaining <= 0:
+        return True
+      if keep_waiting is not None and not keep_waiting():
+        return False
+      if remaining > spin_ms:
+        time.sleep_ms(min(remaining - spin_ms, 100))
+
+  # write the current time to the rtc so log timestamps are correct
+  def set_rtc(self):
+    now_ms = self.now_ms()
+    if now_ms is None:
+      return
+    t = time.gmtime(now_ms // 1000)
+    machine.RTC().datetime((t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0))
+
+
+clock = Clock()
+
+
+def _ntp_ms(data, offset):
+  seconds, fraction = struct.unpack("!II", data[offset:offset + 8])
+  return (seconds - NTP_DELTA) * 1000 + ((fraction * 1000) >> 32)
+
+
+# one ntp exchange on a non blocking socket, polling for the reply so the
+# event loop keeps running. returns (tick, utc_ms, delay_ms) or None
+async def _query(sock, address, timeout_ms):
+  query = bytearray(48)
+  query[0] = 0x1b
+  sent = time.ticks_ms()
+  # the server echoes our transmit timestamp back as the originate
+  # timestamp, use the send tick there to match replies to this query
+  struct.pack_into("!I", query, 40, sent)
+  sock.sendto(query, address)
+  while time.ticks_diff(time.ticks_ms(), sent) < timeout_ms:
+    try:
+      data, _ = sock.recvfrom(48)
+    except OSError:
+      await uasyncio.sleep_ms(1)
+      continue
+    received = time.ticks_ms()
+    if len(data) < 48 or data[24:32] != query[40:48]:
+      continue # short or stale reply
+    server_received = _ntp_ms(data, 32)
+    server_sent = _ntp_ms(data, 40)
+    delay = time.ticks_diff(received, sent) - (server_sent - server_received)
+    return received, server_sent + delay // 2, delay
+  return None
+
+
+# periodically sample the ntp server and discipline clock. each round
+# sends a small burst and keeps the sample with the lowest round trip
+# delay. resolving the host name blocks the whole event loop (up to the
+# dns timeout when there's no internet), so it's done once and the address
+# kept for good, timeouts included. a failed lookup is retried after 10s,
+# then twice as long each time up to interval_s. a dotted ip address
+# needs no lookup at all
+async def _sync_task(host, port, interval_s, burst, timeout_ms, on_sync):
+  address = None
+  sock = None
+  resolve_wait_s = 10
+  while True:
+    if address is None:
+      try:
+        address = socket.getaddrinfo(host, port, 0, socket.SOCK_DGRAM)[0][-1]
+      except Exception as e:
+        logging.error(f"NTP lookup of {host} failed: {e}, retrying in {resolve_wait_s}s")
+        await uasyncio.sleep_ms(resolve_wait_s * 1000)
+        resolve_wait_s = min(resolve_wait_s * 2, interval_s)
+        continue
+    try:
+      if sock is None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+
+      best = None
+      for _ in range(burst):
+        sample = await _query(sock, address, timeout_ms)
+        if sample and (best is None or sample[2] < best[2]):
+          best = sample
+        await uasyncio.sleep_ms(50)
+
+      if best:
+        first_sync = not clock.synced()
+        clock.add_sample(*best)
+        if first_sync:
+          clock.set_rtc()
+        if _TRACE:
+          trace.point(trace.NET, "ntp sample delay {}ms, drift {:.1f}ppm", best[2], clock.drift_ppm)
+        if on_sync:
+          on_sync(clock)
+    except Exception as e:
+      logging.error(f"NTP sync error: {e}")
+    await uasyncio.sleep_ms((interval_s if clock.synced() else 10) * 1000)
+
+
+# start the background ntp task on the event loop, on_sync(clock) is
+# called after every successful sample
+def start(host="pool.ntp.org", port=123, interval_s=600, burst=4, timeout_ms=1000, on_sync=None):
+  if socket is None:
+    logging.error("No socket module available - NTP sync cannot start")
+    return
+  uasyncio.get_event_loop().create_task(
+    _sync_task(host, port, interval_s, burst, timeout_ms, on_sync))
@@ -0,0 +1,170 @@
+# opt-in profiling of the web server. off by default, the server then
+# pays one check per phase.
+#
+# - phase timing: each request is split into phases (accept: waiting for
+#   the request line, headers, admit, body, route, handler, template:
+#   generating body chunks, write: writing and draining) with the count,
+#   total and longest time of each
+# - handler timing: wrap() (or wrap_routes() for all routes) records the
+#   calls and time of a handler, including an AsyncResponse coroutine
+# - sampling: a timer records what is active on every tick - the request,
+#   its phase and the template being rendered - and folded() dumps the
+#   counts as folded stacks ("frame;frame;frame count" lines), the input
+#   of flamegraph.pl and speedscope. samples outside any request are
+#   counted as "idle" (the other tasks of the event loop)
+import time
+
+enabled = False
+
+_phases = {} # name: [count, total us, max us]
+_handlers = {} # name: [calls, total us, max us]
+_samples = {} # folded stack: count
+_active = "idle" # folded stack of what is running now
+_current = None # the request that set it
+_timer = None
+
+
+def _add(table, name, elapsed):
+  entry = table.get(name)
+  if entry is None:
+    table[name] = [1, elapsed, elapsed]
+  else:
+    entry[0] += 1
+    entry[1] += elapsed
+    if elapsed > entry[2]:
+      entry[2] = elapsed
+
+
+class _Request:
+  # the phases of one request, next() ends the current phase and starts
+  # another
+  def __init__(self):
+    self.label = "request"
+    self.phase = "accept"
+    self.detail = None # e.g. the template being rendered, kept to the end
+    self.started = time.ticks_us()
+    self._set_active()
+
+  def _set_active(self):
+    global _active, _current
+    _current = self
+    if self.detail is None:
+      _active = f"{self.label};{self.phase}"
+    else:
+      _active = f"{self.label};{self.phase};{self.detail}"
+
+  def next(self, phase):
+    now = time.ticks_us()
+    _add(_phases, self.phase, time.ticks_diff(now, self.started))
+    self.phase = phase
+    self.started = now
+    self._set_active()
+
+  def done(self):
+    global _active, _current
+    _add(_phases, self.phase, time.ticks_diff(time.ticks_us(), self.started))
+    if _current is self:
+      _active = "idle"
+      _current = None
+
+
+# a new request's phase timer, None while profiling is off
+def request():
+  return _Request() if enabled else None
+
+
+# name the running request in the samples, e.g. "GET /status"
+def label(timing, text):
+  timing.label = text
+  timing._set_active()
+
+
+# add detail to the active sample frame, e.g. the template being rendered
+def detail(text):
+  if enabled and _current is not None:
+    _current.detail = text
+    _current._set_active()
+
+
+async def _timed_coroutine(name, coroutine, started):
+  try:
+    return await coroutine
+  finally:
+    _add(_handlers, name, time.ticks_diff(time.ticks_us(), started))
+
+
+# wrap a route handler to record its calls and cumulative time. when it
+# returns an AsyncResponse the time runs until its coroutine finishes
+def wrap(handler, name=None):
+  from .server import AsyncResponse
+  name = name or handler.__name__
+
+  def wrapper(request, **parameters):
+    if not enabled:
+      return handler(request, **parameters)
+    started = time.ticks_us()
+    response = handler(request, **parameters)
+    if isinstance(response, AsyncResponse):
+      return AsyncResponse(_timed_coroutine(name, response.coroutine, started))
+    _add(_handlers, name, time.ticks_diff(time.ticks_us(), started))
+    return response
+
+  return wrapper
+
+
+# wrap the handlers of every route added so far and of the catchall
+def wrap_routes():
+  from . import server
+  for route in server._routes:
+    route.handler = wrap(route.handler)
+  if server.catchall_handler is not None:
+    server.catchall_handler = wrap(server.catchall_handler)
+
+
+def _sample(timer):
+  _samples[_active] = _samples.get(_active, 0) + 1
+
+
+# start profiling, with a sampling timer of sample_hz if given
+def enable(sample_hz=None):
+  global enabled, _timer
+  enabled = True
+  if sample_hz and _timer is None:
+    from machine import Timer
+    _timer = Timer()
+    _timer.init(freq=sample_hz, mode=Timer.PERIODIC, callback=_sample)
+
+
+def disable():
+  global enabled, _timer
+  enabled = False
+  if _timer is not None:
+    _timer.deinit()
+    _timer = None
+
+
+def reset():
+  _phases.clear()
+  _handlers.clear()
+  _samples.clear()
+
+
+def _table(table):
+  return {
+    name: {"count": count, "total_ms": total / 1000, "max_ms": longest / 1000}
+    for name, (count, total, longest) in table.items()
+  }
+
+
+def stats():
+  return {
+    "phases": _table(_phases),
+    "handlers": _table(_handlers),
+    "samples": sum(_samples.values()),
+  }
+
+
+# the samples as folded stacks, one "frame;frame count" line each
+def folded():
+  for stack, count in list(_samples.items()): # the timer may add keys
+    yield f"{stack} {count}\n"
@@ -1,10 +1,56 @@
 import uasyncio, os, time
-from . import logging
+from . import logging, memory, profiler, trace
+from .trace import const
+try:
+  from . import native
+except Exception: # no native emitter (or not micropython), pure python
+  native = None
+
+_TRACE = const(1) # 0 compiles the trace points out, see trace.py
 
 _routes = []
 catchall_handler = None
 loop = uasyncio.get_event_loop()
 
+# per connection read deadlines in milliseconds, a client that doesn't
+# deliver its request line and headers (or its body) in time is sent a
+# 408 and dropped so it can't pin a coroutine and its buffers forever.
+# None disables the deadline
+header_timeout_ms = 5000
+body_timeout_ms = 10000
+
+# admission control, at most max_connections connections are served at
+# once, counted from accept so slow request heads take their slot too.
+# further requests wait up to queue_timeout_ms for a free slot and are
+# then shed with a 503. requests for priority paths skip the queue.
+# connections parked waiting (AsyncResponse, generator waits) move to a
+# limit of their own, max_parked, and keep their slot when it's full
+_max_connections = 4
+_queue_timeout_ms = 2000
+_active_connections = 0
+_max_parked = 4
+_parked_connections = 0
+_priority_paths = set()
+
+# precomputed raw responses keyed by path. these are written straight
+# after the request head is read, skipping admission, routing and
+# template rendering - intended for high rate, fixed answer requests
+# such as operating system captive portal probes
+_fast_responses = {}
+
+# well known connectivity check paths and the (status, content type,
+# body) each operating system expects when the internet is reachable
+captive_portal_probes = {
+  "/generate_204": (204, None, b""), # android / chrome
+  "/gen_204": (204, None, b""),
+  "/hotspot-detect.html": (200, "text/html", b"<HTML><HEAD><TITLE>Success</TITLE></HEAD><BODY>Success</BODY></HTML>"), # apple
+  "/library/test/success.html": (200, "text/html", b"<HTML><HEAD><TITLE>Success</TITLE></HEAD><BODY>Success</BODY></HTML>"),
+  "/connecttest.txt": (200, "text/plain", b"Microsoft Connect Test"), # windows
+  "/ncsi.txt": (200, "text/plain", b"Microsoft NCSI"),
+  "/success.txt": (200, "text/plain", b"success\n"), # firefox
+  "/canonical.html": (200, "text/html", b'<meta http-equiv="refresh" content="0;url=https://support.mozilla.org/kb/captive-portal"/>'),
+}
+
 
 def file_exists(filename):
   try:
@@ -13,21 +59,27 @@ def file_exists(filename):
     return False
 
 
-def urldecode(text):
+def _urldecode_py(text):
   text = text.replace("+", " ")
-  result = ""
-  token_caret = 0
-  # decode any % encoded characters
-  while True:
-    start = text.find("%", token_caret)
-    if start == -1:
-      result += text[token_caret:]
-      break
-    result += text[token_caret:start]
-    code = int(text[start + 1:start + 3], 16)
-    result += chr(code)
-    token_caret = start + 3
-  return result
+  if "%" not in text:
+    return text
+  # every % escape becomes the character of that code, chr(code)
+  parts = text.split("%")
+  result = [parts[0]]
+  for part in parts[1:]:
+    result.append(chr(int(part[:2], 16)))
+    result.append(part[2:])
+  return "".join(result)
+
+def _urldecode_native(text):
+  data = text.encode()
+  result = bytearray(len(data))
+  length = native.urldecode_into(data, result)
+  if length < 0: # malformed or non ascii escape, the python version decides
+    return _urldecode_py(text)
+  return result[:length].decode()
+
+urldecode = _urldecode_native if native is not None else _urldecode_py
 
 def _parse_query_string(query_string):
   result = {}
@@ -47,6 +99,7 @@ class Request:
     self.form = {}
     self.data = {}
     self.query = {}
+    self.parked = False # counted against the parked limit, see _park
     query_string_start = uri.find("?") if uri.find("?") != -1 else len(uri)
     self.path = uri[:query_string_start]
     self.query_string = uri[query_string_start + 1:]
@@ -62,9 +115,9 @@ data: {self.data}"""
 
 
 class Response:
-  def __init__(self, body, status=200, headers={}):
+  def __init__(self, body, status=200, headers=None):
     self.status = status
-    self.headers = headers
+    self.headers = headers if headers is not None else {}
     self.body = body
 
   def add_header(self, name, value):
@@ -77,6 +130,14 @@ headers: {self.headers}
 body: {self.body}"""
 
 
+# returned by a handler that needs to wait before it can respond (e.g. a
+# long poll), the coroutine is awaited to produce the real response. the
+# request's connection is parked meanwhile, see _park
+class AsyncResponse:
+  def __init__(self, coroutine):
+    self.coroutine = coroutine
+
+
 content_type_map = {
   "html": "text/html",
   "jpg": "image/jpeg",
@@ -87,17 +148,46 @@ content_type_map = {
   "css": "text/css",
   "js": "text/javascript",
   "csv": "text/csv",
+  "txt": "text/plain",
 }
 
 
+# the (first, last) byte positions of a "bytes=first-last", "bytes=first-"
+# or "bytes=-suffix" range header in a file of size bytes, None if the
+# range can't be satisfied. multiple ranges aren't supported
+def parse_range(header, size):
+  try:
+    unit, spec = header.strip().split("=", 1)
+    if unit.strip() != "bytes" or "," in spec:
+      return None
+    first, last = spec.strip().split("-", 1)
+    if first == "":
+      suffix = int(last)
+      if suffix <= 0:
+        return None
+      return max(0, size - suffix), size - 1
+    first = int(first)
+    last = int(last) if last else size - 1
+  except ValueError:
+    return None
+  if first >= size or last < first:
+    return None
+  return first, min(last, size - 1)
+
+
+# a file streamed from flash. with range_header (the request's Range) only
+# the requested bytes are sent, as a 206 partial response
 class FileResponse(Response):
-  def __init__(self, file, status=200, headers={}):
+  def __init__(self, file, status=200, headers=None, range_header=None):
     self.status = 404
-    self.headers = headers
+    self.headers = headers = headers if headers is not None else {}
     self.file = file
+    self.offset = 0
+    self.length = 0
 
     try:
-      if (os.stat(self.file)[0] & 0x4000) == 0:
+      stat = os.stat(self.file)
+      if (stat[0] & 0x4000) == 0:
         self.status = 200
 
         # auto set content type
@@ -105,16 +195,66 @@ class FileResponse(Response):
         if extension in content_type_map:
           headers["Content-Type"] = content_type_map[extension]
 
-        headers["Content-Length"] = os.stat(self.file)[6]
+        size = self.length = stat[6]
+        headers["Content-Length"] = size
+        headers["ETag"] = file_etag(self.file, stat)
+        headers["Accept-Ranges"] = "bytes"
+        if range_header:
+          byte_range = parse_range(range_header, size)
+          if byte_range is None:
+            self.status = 416
+            headers["Content-Range"] = f"bytes */{size}"
+            headers["Content-Length"] = 0
+          else:
+            first, last = byte_range
+            self.status = 206
+            self.offset = first
+            self.length = last - first + 1
+            headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+            headers["Content-Length"] = self.length
     except OSError:
       return False
 
 
+# etags for files are derived from their size and modification time and
+# cached so repeat requests only cost the stat() call
+_file_etags = {}
+
+def file_etag(file, stat=None):
+  if stat is None:
+    stat = os.stat(file)
+  cached = _file_etags.get(file)
+  if cached and cached[0] == stat[6] and cached[1] == stat[8]:
+    return cached[2]
+  etag = f'"{stat[8]:x}-{stat[6]:x}"'
+  _file_etags[file] = (stat[6], stat[8], etag)
+  return etag
+
+
+# etag for dynamic content that is versioned by a counter
+def version_etag(version):
+  return f'"v{version}"'
+
+
+# returns True if an If-None-Match header value matches the etag
+def _etag_matches(if_none_match, etag):
+  if not if_none_match:
+    return False
+  for candidate in if_none_match.split(","):
+    candidate = candidate.strip()
+    if candidate.startswith("W/"):
+      candidate = candidate[2:]
+    if candidate == etag or candidate == "*":
+      return True
+  return False
+
+
 class Route:
-  def __init__(self, path, handler, methods=["GET"]):
+  def __init__(self, path, handler, methods=["GET"], cache_control=None):
     self.path = path
     self.methods = methods
     self.handler = handler
+    self.cache_control = cache_control
     self.path_parts = path.split("/")
 
   # returns True if the supplied request matches this route
@@ -200,12 +340,32 @@ async def _parse_form_data(reader, headers):
   return None
 
 
+# reads a body of content_length bytes and passes it to parse(). bodies
+# that fit are read into a preallocated buffer (see memory.py) instead of
+# a new allocation for every request
+async def _read_pooled_body(reader, content_length, parse):
+  if content_length > memory.body_pool.size:
+    return parse(await reader.readexactly(content_length))
+  buffer = memory.body_pool.get()
+  try:
+    view = memoryview(buffer)
+    received = 0
+    while received < content_length:
+      count = await reader.readinto(view[received:content_length])
+      if not count:
+        raise EOFError
+      received += count
+    return parse(view[:content_length])
+  finally:
+    memory.body_pool.put(buffer)
+
+
 # if the content type is application/json then parse the body
 async def _parse_json_body(reader, headers):
   import json
   content_length_bytes = int(headers["content-length"])
-  body = await reader.readexactly(content_length_bytes)
-  return json.loads(body.decode())
+  # micropython's json.loads() takes any buffer, no copy needed
+  return await _read_pooled_body(reader, content_length_bytes, json.loads)
 
 
 status_message_map = {
@@ -220,40 +380,166 @@ status_message_map = {
   408: "Request Timeout", 409: "Conflict", 410: "Gone",
   414: "URI Too Long", 415: "Unsupported Media Type", 
   416: "Range Not Satisfiable", 418: "I'm a teapot",
-  500: "Internal Server Error", 501: "Not Implemented"
+  500: "Internal Server Error", 501: "Not Implemented",
+  503: "Service Unavailable"
 }
 
 
-# handle an incoming request to the web server
-async def _handle_request(reader, writer):
-  response = None
+# await the supplied coroutine, raising uasyncio.TimeoutError if it
+# doesn't complete within timeout_ms (None waits forever)
+async def _with_deadline(coroutine, timeout_ms):
+  if timeout_ms is None:
+    return await coroutine
+  return await uasyncio.wait_for_ms(coroutine, timeout_ms)
 
-  request_start_time = time.ticks_ms()
 
+# reads the request line and headers
+async def _read_request_head(reader, timing=None):
   request_line = await reader.readline()
-  try:
-    method, uri, protocol = request_line.decode().split()
-  except Exception as e:
-    logging.error(e)
-    return
-
+  method, uri, protocol = request_line.decode().split()
   request = Request(method, uri, protocol)
+  if timing:
+    profiler.label(timing, f"{method} {request.path}")
+    timing.next("headers")
   request.headers = await _parse_headers(reader)
+  return request
+
+
+async def _read_body(reader, request):
   if "content-length" in request.headers and "content-type" in request.headers:
     if request.headers["content-type"].startswith("multipart/form-data"):
       request.form = await _parse_form_data(reader, request.headers)
     if request.headers["content-type"].startswith("application/json"):
       request.data = await _parse_json_body(reader, request.headers)
     if request.headers["content-type"].startswith("application/x-www-form-urlencoded"):
-      form_data = await reader.read(int(request.headers["content-length"]))
-      request.form = _parse_query_string(form_data.decode()) 
+      request.form = await _read_pooled_body(reader, int(request.headers["content-length"]),
+        lambda body: _parse_query_string(str(body, "utf-8")))
+
+
+# the connection holds a slot from accept, once its path is known it
+# keeps it for a priority path or when the server isn't over the limit.
+# otherwise it gives the slot up and waits for a free one. returns False
+# (slot given up) if none became free within the queue timeout or the
+# heap is too fragmented to serve it safely (see memory.py)
+async def _admit(request):
+  global _active_connections
+  if request.path in _priority_paths:
+    return True
+  if memory.low_memory():
+    memory.count_shed()
+    _active_connections -= 1
+    return False
+  if _active_connections <= _max_connections:
+    return True
+  _active_connections -= 1
+  queued_at = time.ticks_ms()
+  while _active_connections >= _max_connections:
+    if time.ticks_diff(time.ticks_ms(), queued_at) >= _queue_timeout_ms:
+      return False
+    await uasyncio.sleep_ms(10)
+  _active_connections += 1
+  return True
+
+
+# moves a connection about to wait from its slot to the parked limit,
+# for the rest of the request. with the parked limit reached it waits
+# holding its slot
+def _park(request):
+  global _active_connections, _parked_connections
+  if not request.parked and _parked_connections < _max_parked:
+    _active_connections -= 1
+    _parked_connections += 1
+    request.parked = True
+
+
+# write a bodyless response with just a status line
+async def _write_status(writer, status, headers={}):
+  status_message = status_message_map.get(status, "Unknown")
+  writer.write(f"HTTP/1.1 {status} {status_message}\r\n".encode("ascii"))
+  for key, value in headers.items():
+    writer.write(f"{key}: {value}\r\n".encode("ascii"))
+  writer.write(b"Content-Length: 0\r\n\r\n")
+  await writer.drain()
+
+
+# handle an incoming request to the web server
+async def _handle_request(reader, writer):
+  global _active_connections, _parked_connections
+  _active_connections += 1
+  admitted = True # holding a slot
+  request = None
+  timing = profiler.request() # None unless profiling
+  try:
+    request_start_time = time.ticks_ms()
+
+    try:
+      request = await _with_deadline(_read_request_head(reader, timing), header_timeout_ms)
+    except uasyncio.TimeoutError:
+      await _write_status(writer, 408)
+      logging.info("> request headers timed out")
+      return
+    except Exception as e:
+      logging.error(e)
+      return
+
+    fast_response = _fast_responses.get(request.path)
+    if fast_response is not None:
+      writer.write(fast_response)
+      await writer.drain()
+      return
+
+    if timing:
+      timing.next("admit")
+    admitted = await _admit(request)
+    if not admitted:
+      await _write_status(writer, 503, {"Retry-After": 1})
+      if logging.enabled(logging.LOG_INFO):
+        logging.info(f"> {request.method} {request.path} (503 shed, {_active_connections} active)")
+      return
+
+    if timing:
+      timing.next("body")
+    try:
+      await _with_deadline(_read_body(reader, request), body_timeout_ms)
+    except uasyncio.TimeoutError:
+      await _write_status(writer, 408)
+      if logging.enabled(logging.LOG_INFO):
+        logging.info(f"> {request.method} {request.path} request body timed out")
+      return
+
+    await _respond(request, writer, request_start_time, timing)
+  finally:
+    if timing:
+      timing.done()
+    if admitted:
+      if request is not None and request.parked:
+        _parked_connections -= 1
+      else:
+        _active_connections -= 1
+    try:
+      writer.close()
+      await writer.wait_closed()
+    except Exception:
+      pass
+
+
+async def _respond(request, writer, request_start_time, timing=None):
+  response = None
 
+  if timing:
+    timing.next("route")
   route = _match_route(request)
+  if timing:
+    timing.next("handler")
   if route:
     response = route.call_handler(request)
   elif catchall_handler:
     response = catchall_handler(request)
 
+  if isinstance(response, AsyncResponse):
+    _park(request)
+    response = await response.coroutine
+
   # if shorthand body generator only notation used then convert to tuple
   if type(response).__name__ == "generator":
     response = (response,)
@@ -271,7 +557,23 @@ async def _handle_request(reader, writer):
     response.add_header("Content-Type", content_type)
     if hasattr(body, '__len__'):
       response.add_header("Content-Length", len(body))
-  
+
+  if route and route.cache_control and "Cache-Control" not in response.headers:
+    response.add_header("Cache-Control", route.cache_control)
+
+  # conditional get, if the client already holds the current version of
+  # the resource then reply with a bodyless 304 instead
+  etag = response.headers.get("ETag")
+  if etag and response.status == 200 and request.method == "GET" and \
+      _etag_matches(request.headers.get("if-none-match"), etag):
+    not_modified = Response("", status=304, headers={"ETag": etag})
+    if "Cache-Control" in response.headers:
+      not_modified.add_header("Cache-Control", response.headers["Cache-Control"])
+    response = not_modified
+
+  if timing:
+    timing.next("write")
+
   # write status line
   status_message = status_message_map.get(response.status, "Unknown")
   writer.write(f"HTTP/1.1 {response.status} {status_message}\r\n".encode("ascii"))
@@ -283,36 +585,78 @@ async def _handle_request(reader, writer):
   # blank line to denote end of headers
   writer.write("\r\n".encode("ascii"))
  
-  if isinstance(response, FileResponse):
-    # file
-    with open(response.file, "rb") as f:
-      while True:
-        chunk = f.read(1024)
-        if not chunk:
-          break
+  if response.status == 304:
+    # not modified, no body
+    await writer.drain()
+  elif isinstance(response, FileResponse):
+    if response.status != 200 and response.status != 206:
+      # missing file or unsatisfiable range, no body
+      await writer.drain()
+    else:
+      # file (or the requested range of it), streamed through a
+      # preallocated chunk buffer. the writer copies what it's given so the
+      # buffer can be refilled after drain
+      chunk = memory.chunk_pool.get()
+      try:
+        view = memoryview(chunk)
+        remaining = response.length
+        with open(response.file, "rb") as f:
+          if response.offset:
+            f.seek(response.offset)
+          while remaining > 0:
+            count = f.readinto(chunk)
+            if not count:
+              break
+            count = min(count, remaining)
+            remaining -= count
+            writer.write(view[:count])
+            await writer.drain()
+      finally:
+        memory.chunk_pool.put(chunk)
+  elif type(response.body).__name__ == "generator":
+    # generator, with the time spent generating chunks (e.g. rendering a
+    # template) told apart from writing them when profiling. an int
+    # yielded instead of a chunk is a wait in ms (e.g. following a file),
+    # the connection is parked as for an AsyncResponse
+    if timing:
+      timing.next("template")
+    try:
+      for chunk in response.body:
+        if timing:
+          timing.next("write")
+        if isinstance(chunk, int):
+          _park(request)
+          await uasyncio.sleep_ms(chunk)
+          continue
         writer.write(chunk)
         await writer.drain()
-  elif type(response.body).__name__ == "generator":
-    # generator
-    for chunk in response.body:
-      writer.write(chunk)
-      await writer.drain()
+        if timing:
+          timing.next("template")
+    finally:
+      # run the generator's cleanup when the client goes away mid stream
+      response.body.close()
   else:
     # string/bytes
     writer.write(response.body)
     await writer.drain()
-  
-  writer.close()
-  await writer.wait_closed()
-  
+
+  # formatted only when it's logged, this runs for every request
   processing_time = time.ticks_ms() - request_start_time
-  logging.info(f"> {request.method} {request.path} ({response.status} {status_message}) [{processing_time}ms]")
+  if _TRACE:
+    trace.point(trace.HTTP, "{} {} {} {}ms", request.method, request.path, response.status, processing_time)
+  if logging.enabled(logging.LOG_INFO):
+    logging.info(f"> {request.method} {request.path} ({response.status} {status_message}) [{processing_time}ms]")
 
 
-# adds a new route to the routing table
-def add_route(path, handler, methods=["GET"]):
+# adds a new route to the routing table, priority routes bypass the
+# admission queue so they are served even when the server is saturated.
+# cache_control is sent as the Cache-Control header of every response
+# from the route that doesn't set its own
+def add_route(path, handler, methods=["GET"], priority=False, cache_control=None):
   global _routes
-  _routes.append(Route(path, handler, methods))
+  _routes.append(Route(path, handler, methods, cache_control))
+  if priority:
+    _priority_paths.add(path)
   # descending complexity order so most complex routes matched first
   _routes = sorted(_routes, key=lambda route: len(route.path_parts), reverse=True)
 
@@ -323,9 +667,9 @@ def set_callback(handler):
 
 
 # decorator shorthand for adding a route
-def route(path, methods=["GET"]):
+def route(path, methods=["GET"], priority=False, cache_control=None):
   def _route(f):
-    add_route(path, f, methods=methods)
+    add_route(path, f, methods=methods, priority=priority, cache_control=cache_control)
     return f
   return _route
 
@@ -338,12 +682,58 @@ def catchall():
   return _catchall
   
 
+# serialises a complete response (status line, headers and body) to bytes
+def build_response(status, headers={}, body=b""):
+  status_message = status_message_map.get(status, "Unknown")
+  response = f"HTTP/1.1 {status} {status_message}\r\n"
+  for key, value in headers.items():
+    response += f"{key}: {value}\r\n"
+  response += f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+  return response.encode("ascii") + body
+
+
+def add_fast_response(path, response):
+  _fast_responses[path] = response
+
+
+# answer every known captive portal probe from a precomputed response.
+# with redirect_url the probes are redirected there so that clients pop
+# up their captive portal sign in page, otherwise they are given the
+# body they expect from an internet connected network
+def add_captive_portal_probes(redirect_url=None):
+  if redirect_url:
+    redirect_response = build_response(302, {"Location": redirect_url})
+  for path, (status, content_type, body) in captive_portal_probes.items():
+    if redirect_url:
+      add_fast_response(path, redirect_response)
+    else:
+      headers = {"Content-Type": content_type} if content_type else {}
+      add_fast_response(path, build_response(status, headers, body))
+
+
+def set_read_timeouts(header_ms, body_ms):
+  global header_timeout_ms, body_timeout_ms
+  header_timeout_ms = header_ms
+  body_timeout_ms = body_ms
+
+
+def set_connection_limits(max_connections, queue_timeout_ms=2000, max_parked=4):
+  global _max_connections, _queue_timeout_ms, _max_parked
+  _max_connections = max_connections
+  _queue_timeout_ms = queue_timeout_ms
+  _max_parked = max_parked
+
+
 def redirect(url, status = 301):
   return Response("", status, {"Location": url})
 
 
-def serve_file(file):
-  return FileResponse(file)
+# serve a file, or the byte range of it asked for by range_header
+def serve_file(file, cache_control=None, range_header=None):
+  response = FileResponse(file, range_header=range_header)
+  if cache_control:
+    response.add_header("Cache-Control", cache_control)
+  return response
 
 
 def run(host = "0.0.0.0", port = 80):
@@ -0,0 +1,65 @@
+import json, time, uasyncio, _thread
+
+# a versioned snapshot of application state shared by many readers.
+#
+# every change bumps a monotonically increasing version number, the
+# state is serialised to json bytes at most once per version and that
+# buffer is handed to every reader, so polling costs the same however
+# many clients are watching. readers can wait for a version newer than
+# the one they already hold (long polling).
+#
+# updates may come from another thread (e.g. a background worker) so the
+# field dict is never modified in place, a changed copy is swapped in.
+# readers take whichever dict is current without locking, writers hold a
+# lock from reading the current dict to swapping in its copy, so two of
+# them can't both make version v+1 and lose one's changes
+class State:
+  def __init__(self, **fields):
+    fields["version"] = 1
+    self._fields = fields
+    self._snapshot = None
+    self._snapshot_version = 0
+    self._lock = _thread.allocate_lock()
+
+  @property
+  def version(self):
+    return self._fields["version"]
+
+  def get(self, name, default=None):
+    return self._fields.get(name, default)
+
+  # apply changes, the version is only bumped if a value actually changed
+  def update(self, **changes):
+    with self._lock:
+      fields = self._fields
+      for name, value in changes.items():
+        if fields.get(name) != value:
+          break
+      else:
+        return fields["version"]
+
+      fields = dict(fields)
+      fields.update(changes)
+      fields["version"] += 1
+      self._fields = fields
+      return fields["version"]
+
+  # returns (version, json bytes) for the current state
+  def snapshot(self):
+    fields = self._fields
+    version = fields["version"]
+    if self._snapshot_version != version:
+      self._snapshot = json.dumps(fields).encode()
+      self._snapshot_version = version
+    return version, self._snapshot
+
+  # wait until the version is newer than since or timeout_ms passes,
+  # returns the current version. polls rather than using an event as
+  # updates may be made outside the event loop's thread
+  async def wait(self, since, timeout_ms=20000, poll_ms=50):
+    start = time.ticks_ms()
+    while self._fields["version"] <= since:
+      if time.ticks_diff(time.ticks_ms(), start) >= timeout_ms:
+        break
+      await uasyncio.sleep_ms(poll_ms)
+    return self._fields["version"]
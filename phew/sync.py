@@ -0,0 +1,294 @@
+# synchronised commands across several units over udp.
+#
+# one unit is the leader and its tick counter is the time base. followers
+# model the leader's clock: every few seconds a burst of ping/pong
+# exchanges, the one with the shortest round trip kept as a sample and
+# fitted with ntp.Clock, which follows the drift between the crystals
+# until the next burst. a command is scheduled at a leader time lead_ms
+# ahead and sent to every follower, each runs it when its own ticks reach
+# that time, and so does the leader. on_prepare(command) is called
+# prepare_ms earlier, e.g. to wake the motor drivers. a command scheduled
+# with no lead (e.g. a stop) is sent with the time _NOW and run by every
+# unit as soon as it has it, and isn't counted as late.
+#
+# commands are sent to each follower directly (repeated until acked)
+# rather than broadcast, wifi broadcasts are sent at the lowest rate and
+# never retried. the leader broadcasts a beacon for followers to find it
+# when they aren't given its address.
+#
+# every node takes a ticks_ms function, the simulation tool gives each
+# one its own skewed clock (tools/sync_sim.py)
+import struct, time, uasyncio
+try:
+  import socket
+except ImportError:
+  import usocket as socket
+from . import logging
+from .ntp import Clock
+
+_MAGIC = b"TWS1"
+_BEACON = 0 # leader ms
+_PING = 1 # follower ticks
+_PONG = 2 # follower ticks echoed, leader ms
+_COMMAND = 3 # sequence number, leader ms to run at, command text
+_ACK = 4 # sequence number
+
+_NOW = 0 # leader ms of a command to run as soon as it's received
+
+
+def _packet(kind, fmt, *values):
+  return _MAGIC + struct.pack("!B" + fmt, kind, *values)
+
+
+def _socket(port=0, reuse=False):
+  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  if reuse:
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  sock.bind(("0.0.0.0", port))
+  sock.setblocking(False)
+  return sock
+
+
+def _receive(sock):
+  try:
+    data, address = sock.recvfrom(256)
+  except OSError:
+    return None, None, None
+  if len(data) < 5 or data[:4] != _MAGIC:
+    return None, None, None
+  return data[4], data[5:], address
+
+
+# ticks_at(leader_ms) is the node's model of the leader's clock: the local
+# tick at which the leader's clock reaches leader_ms
+class _Node:
+  def __init__(self, on_command, port, on_prepare, prepare_ms, ticks_ms, ticks_at):
+    self.on_command = on_command
+    self.on_prepare = on_prepare
+    self.port = port
+    self.prepare_ms = prepare_ms
+    self.ticks_ms = ticks_ms
+    self._ticks_at = ticks_at
+    self.commands = 0
+    self.late = 0 # commands received too late to run on time
+    self.last_error_ms = None # how late the last command ran, in local ms
+    self._sock = None
+
+  # wait for the leader time at_ms, coarse sleeps then a spin on the tick
+  # counter (the target is recomputed as the clock model is updated)
+  async def _sleep_until(self, at_ms, spin_ms=20):
+    while True:
+      remaining = time.ticks_diff(self._ticks_at(at_ms), self.ticks_ms())
+      if remaining <= spin_ms:
+        break
+      await uasyncio.sleep_ms(remaining - spin_ms)
+    target = self._ticks_at(at_ms)
+    while time.ticks_diff(target, self.ticks_ms()) > 0:
+      await uasyncio.sleep_ms(0)
+
+  async def _run_at(self, at_ms, command):
+    if at_ms == _NOW:
+      if self.on_prepare is not None:
+        self.on_prepare(command)
+      self.commands += 1
+      await self.on_command(command)
+      return
+    if time.ticks_diff(self._ticks_at(at_ms), self.ticks_ms()) < 0:
+      self.late += 1
+    elif self.on_prepare is not None:
+      await self._sleep_until(at_ms - self.prepare_ms)
+      self.on_prepare(command)
+    await self._sleep_until(at_ms)
+    self.last_error_ms = time.ticks_diff(self.ticks_ms(), self._ticks_at(at_ms))
+    self.commands += 1
+    await self.on_command(command)
+
+  def stats(self):
+    return {
+      "commands": self.commands,
+      "late": self.late,
+      "last_error_ms": self.last_error_ms,
+    }
+
+
+# the leader answers pings, keeps a list of followers from them and sends
+# them the commands it schedules
+class Leader(_Node):
+  def __init__(self, on_command, port=4211, lead_ms=300, on_prepare=None, prepare_ms=20,
+               beacon_interval_s=2, follower_timeout_s=30, ticks_ms=time.ticks_ms):
+    super().__init__(on_command, port, on_prepare, prepare_ms, ticks_ms, self._local_ticks_at)
+    self.lead_ms = lead_ms
+    self.beacon_interval_s = beacon_interval_s
+    self.follower_timeout_s = follower_timeout_s
+    self._followers = {} # address: leader ms last heard from
+    self._sequence = 0
+    self._acked = {} # address: last sequence number acked
+    self._last_tick = ticks_ms()
+    self._now_ms = 0
+
+  # leader time: ms since start, accumulated so it doesn't wrap like ticks
+  def now_ms(self):
+    tick = self.ticks_ms()
+    self._now_ms += time.ticks_diff(tick, self._last_tick)
+    self._last_tick = tick
+    return self._now_ms
+
+  # the leader's clock is the local one
+  def _local_ticks_at(self, leader_ms):
+    return time.ticks_add(self.ticks_ms(), leader_ms - self.now_ms())
+
+  def followers(self):
+    now = self.now_ms()
+    timeout_ms = self.follower_timeout_s * 1000
+    return [address for address, heard in self._followers.items() if now - heard < timeout_ms]
+
+  # run command on every unit lead_ms from now, returns the leader time.
+  # with lead_ms 0 each unit runs it as soon as it has it
+  def schedule(self, command, lead_ms=None):
+    self._sequence += 1
+    if lead_ms is None:
+      lead_ms = self.lead_ms
+    now_ms = self.now_ms()
+    at_ms = now_ms + lead_ms if lead_ms > 0 else _NOW
+    loop = uasyncio.get_event_loop()
+    loop.create_task(self._send(self._sequence, at_ms, command))
+    loop.create_task(self._run_at(at_ms, command))
+    return now_ms + lead_ms
+
+  async def _send(self, sequence, at_ms, command, repeats=5, interval_ms=30):
+    packet = _packet(_COMMAND, "II", sequence, at_ms) + command.encode()
+    for _ in range(repeats):
+      pending = [a for a in self.followers() if self._acked.get(a) != sequence]
+      if not pending:
+        return
+      for address in pending:
+        try:
+          self._sock.sendto(packet, address)
+        except OSError:
+          pass
+      await uasyncio.sleep_ms(interval_ms)
+    logging.warn(f"> sync: command {sequence} not acked by {len(pending)} followers")
+
+  async def _serve(self):
+    while True:
+      kind, payload, address = _receive(self._sock)
+      if kind is None:
+        await uasyncio.sleep_ms(1)
+      elif kind == _PING and len(payload) >= 4:
+        if address not in self._followers:
+          logging.info(f"> sync: follower {address[0]}:{address[1]} joined")
+        self._followers[address] = self.now_ms()
+        self._sock.sendto(_packet(_PONG, "4sI", payload[:4], self.now_ms()), address)
+      elif kind == _ACK and len(payload) >= 4:
+        self._acked[address] = struct.unpack("!I", payload[:4])[0]
+
+  async def _beacon(self, address):
+    while True:
+      try:
+        self._sock.sendto(_packet(_BEACON, "I", self.now_ms()), (address, self.port))
+      except OSError:
+        pass # no broadcast route, followers need the leader's address
+      await uasyncio.sleep_ms(self.beacon_interval_s * 1000)
+
+  # beacons are broadcast to broadcast_address, None to send none
+  def start(self, broadcast_address="255.255.255.255"):
+    self._sock = _socket(self.port, reuse=True)
+    loop = uasyncio.get_event_loop()
+    loop.create_task(self._serve())
+    if broadcast_address:
+      if hasattr(socket, "SO_BROADCAST"):
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+      loop.create_task(self._beacon(broadcast_address))
+
+  def stats(self):
+    stats = super().stats()
+    followers = self.followers()
+    stats["followers"] = len(followers)
+    stats["acked"] = sum(1 for a in followers if self._acked.get(a) == self._sequence)
+    return stats
+
+
+# a follower keeps its model of the leader's clock up to date and runs the
+# commands the leader sends. without the leader's address it listens for
+# its beacon on port
+class Follower(_Node):
+  def __init__(self, on_command, port=4211, leader=None, on_prepare=None, prepare_ms=20,
+               interval_s=5, burst=8, max_delay_ms=50, ticks_ms=time.ticks_ms):
+    self.clock = Clock()
+    super().__init__(on_command, port, on_prepare, prepare_ms, ticks_ms, self.clock.ticks_at)
+    self.leader = (leader, port) if leader else None
+    self.interval_s = interval_s
+    self.burst = burst
+    self.max_delay_ms = max_delay_ms
+    self.samples = 0 # clock samples taken
+    self._samples = []
+    self._beacon_sock = None
+    self._seen = [] # recent (sequence, leader ms), commands are repeated
+
+  def synced(self):
+    return self.clock.synced()
+
+  def _handle(self, kind, payload, address):
+    if kind == _PONG and len(payload) >= 8:
+      sent, leader_ms = struct.unpack("!II", payload[:8])
+      received = self.ticks_ms()
+      delay = time.ticks_diff(received, sent)
+      if 0 <= delay <= self.max_delay_ms:
+        self._samples.append((received, leader_ms + delay // 2, delay))
+    elif kind == _COMMAND and len(payload) >= 8:
+      sequence, at_ms = struct.unpack("!II", payload[:8])
+      self._sock.sendto(_packet(_ACK, "I", sequence), address)
+      if (sequence, at_ms) in self._seen:
+        return
+      self._seen.append((sequence, at_ms))
+      if len(self._seen) > 8:
+        self._seen.pop(0)
+      if at_ms != _NOW and not self.synced():
+        logging.warn("> sync: command received before the clock synced, ignored")
+        return
+      uasyncio.get_event_loop().create_task(self._run_at(at_ms, payload[8:].decode()))
+    elif kind == _BEACON and self.leader is None:
+      self.leader = (address[0], self.port)
+      logging.info(f"> sync: leader found at {address[0]}")
+
+  async def _listen(self):
+    while True:
+      kind, payload, address = _receive(self._sock)
+      if kind is None and self._beacon_sock is not None:
+        kind, payload, address = _receive(self._beacon_sock)
+      if kind is None:
+        await uasyncio.sleep_ms(1)
+      else:
+        self._handle(kind, payload, address)
+
+  async def _sync(self):
+    while True:
+      if self.leader is not None:
+        self._samples = []
+        for _ in range(self.burst):
+          try:
+            self._sock.sendto(_packet(_PING, "I", self.ticks_ms()), self.leader)
+          except OSError:
+            pass
+          await uasyncio.sleep_ms(self.max_delay_ms)
+        if self._samples:
+          self.clock.add_sample(*min(self._samples, key=lambda sample: sample[2]))
+          self.samples += 1
+      # quick bursts until the drift can be fitted
+      interval_s = self.interval_s if self.samples >= 3 else 1
+      await uasyncio.sleep_ms(interval_s * 1000)
+
+  def start(self):
+    self._sock = _socket()
+    if self.leader is None:
+      self._beacon_sock = _socket(self.port, reuse=True)
+    loop = uasyncio.get_event_loop()
+    loop.create_task(self._listen())
+    loop.create_task(self._sync())
+
+  def stats(self):
+    stats = super().stats()
+    stats["synced"] = self.synced()
+    stats["leader"] = self.leader[0] if self.leader else None
+    stats["drift_ppm"] = int(self.clock.drift_ppm)
+    return stats
@@ -0,0 +1,125 @@
+# debug tracing for the hot paths, without the cost of print(): on a
+# connected usb repl print() blocks until the host has read the line, and
+# an f-string allocates whether or not anything reads it.
+#
+# a module with trace points declares its own compile time switch and
+# guards every point with it:
+#
+#   _TRACE = const(1) # 0 compiles this module's trace points out
+#   ...
+#   if _TRACE:
+#     trace.point(trace.MOTION, "move {} at {}Hz", steps, speed)
+#
+# with _TRACE = const(0) the compiler drops the whole if statement, the
+# point costs nothing at all. with 1 a point whose category is switched
+# off at runtime (see enable) costs a call and a mask test. enabled
+# points are recorded in a ring buffer as (ticks_us, category, message,
+# args) and only formatted (message.format(*args)) when read, by lines()
+# e.g. for an http endpoint. echo prints them as well, for a repl session
+import time
+try:
+  from micropython import const
+except ImportError: # cpython, e.g. for the tools
+  def const(value):
+    return value
+
+# categories, bits of the runtime mask
+MOTION = const(1)
+TIMELAPSE = const(2)
+HTTP = const(4)
+TEMPLATE = const(8)
+NET = const(16)
+ALL = const(31)
+
+names = {"motion": MOTION, "timelapse": TIMELAPSE, "http": HTTP, "template": TEMPLATE, "net": NET}
+
+mask = 0 # categories recorded, nothing by default
+echo = False # also print the recorded points
+
+_ring = [None] * 64
+_next = 0
+_recorded = 0
+
+
+# record the points of categories (a mask) from now on
+def enable(categories):
+  global mask
+  mask |= categories
+
+
+def disable(categories):
+  global mask
+  mask &= ~categories
+
+
+# the mask of a comma separated list of category names, e.g. "motion,http"
+def parse(text):
+  categories = 0
+  for name in text.split(","):
+    name = name.strip().lower()
+    if name == "all":
+      categories |= ALL
+    elif name:
+      categories |= names[name]
+  return categories
+
+
+# keep the last size points, clears the buffer
+def set_size(size):
+  global _ring
+  _ring = [None] * size
+  clear()
+
+
+def clear():
+  global _next, _recorded
+  for i in range(len(_ring)):
+    _ring[i] = None
+  _next = 0
+  _recorded = 0
+
+
+# record a trace point, message is a str.format() template for args
+def point(category, message, *args):
+  global _next, _recorded
+  if not mask & category:
+    return
+  entry = (time.ticks_us(), category, message, args)
+  _ring[_next] = entry
+  _next = (_next + 1) % len(_ring)
+  _recorded += 1
+  if echo:
+    print(_format(entry))
+
+
+def _format(entry):
+  ticks, category, message, args = entry
+  for name, bit in names.items():
+    if bit == category:
+      break
+  else:
+    name = str(category)
+  try:
+    text = message.format(*args) if args else message
+  except (IndexError, KeyError, ValueError):
+    text = f"{message} {args}"
+  return f"{ticks} {name} {text}"
+
+
+# the recorded points, oldest first, as text lines
+def lines():
+  size = len(_ring)
+  start = _next if _recorded >= size else 0
+  for i in range(min(_recorded, size)):
+    entry = _ring[(start + i) % size]
+    if entry is not None:
+      yield _format(entry) + "\n"
+
+
+def stats():
+  return {
+    "categories": [name for name, bit in names.items() if mask & bit],
+    "recorded": _recorded,
+    "kept": min(_recorded, len(_ring)),
+    "echo": echo,
+  }
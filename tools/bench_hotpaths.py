@@ -0,0 +1,118 @@
+"""
+    Benchmark the hot paths in their Python and native code versions
+
+    Reports the cost per call of each routine that has a native code
+    version (drivers/drv8825_native.py, drivers/encoder_native.py,
+    phew/native.py) next to its pure Python fallback, and the speedup.
+    Meant to run on the Pico with the drivers/ and phew/ packages on it:
+
+        mpremote run tools/bench_hotpaths.py
+
+    The stepper benchmarks toggle BENCH_STEP_PIN and BENCH_DIR_PIN and the
+    encoder one installs interrupts on BENCH_ENC_PINS, use spare GPIOs with
+    nothing connected. Where there is no native emitter (or no machine
+    module) only the Python versions that can run are reported.
+"""
+
+import sys
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:  # CPython
+    from time import perf_counter
+
+    def ticks_us():
+        return int(perf_counter() * 1000000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+BENCH_STEP_PIN = 20  # spare GPIOs, nothing must be connected
+BENCH_DIR_PIN = 21
+BENCH_ENC_PINS = (26, 27)
+CALLS = 2000
+
+
+def per_call_us(function, *args):
+    """average microseconds per call of function(*args)"""
+    start = ticks_us()
+    for _ in range(CALLS):
+        function(*args)
+    elapsed = ticks_diff(ticks_us(), start)
+    # subtract the loop and call overhead
+    start = ticks_us()
+    for _ in range(CALLS):
+        _nothing(*args)
+    overhead = ticks_diff(ticks_us(), start)
+    return max(0, elapsed - overhead) / CALLS
+
+
+def _nothing(*args):
+    pass
+
+
+def report(name, python, native, *args):
+    """print the per call cost of both versions and the speedup"""
+    python_us = per_call_us(python, *args)
+    if native is None:
+        print(f"{name:28s} python {python_us:8.2f}us   native     n/a")
+        return
+    native_us = per_call_us(native, *args)
+    speedup = python_us / native_us if native_us else 0
+    print(f"{name:28s} python {python_us:8.2f}us   native {native_us:8.2f}us   x{speedup:.1f}")
+
+
+def bench_phew():
+    from phew import server, dns
+    text = "name=My+Network%21&password=p%C3%A4ss+word%2F123"
+    native = server._urldecode_native if server.native is not None else None
+    report("phew urldecode", server._urldecode_py, native, text)
+
+    request = b"\x12\x34\x01\x00\x00\x01\x00\x00\x00\x00\x00\x00\x07example\x03com\x00\x00\x01\x00\x01"
+    answer = dns._answer("192.168.4.1")
+    out = bytearray(256 + len(answer))
+    native = dns._build_response if dns._build_response is not dns._build_response_py else None
+    report("dns response builder", dns._build_response_py, native, request, answer, out)
+
+
+def bench_drivers():
+    try:
+        from machine import Pin
+    except ImportError:
+        print("no machine module, skipping the driver benchmarks")
+        return
+    from drivers import drv8825, encoder_portable
+
+    mot = drv8825.DRV8825(BENCH_STEP_PIN, BENCH_DIR_PIN)
+    native = drv8825._native
+    report("DRV8825.one_step", drv8825.DRV8825._one_step_py,
+           native.one_step if native else None, mot, 1)
+    mot._free_run_mode = 1  # each callback takes a step
+    report("DRV8825._timer_callback", drv8825.DRV8825._timer_callback_py,
+           native.timer_callback if native else None, mot, None)
+    mot._free_run_mode = 0
+
+    pin_x = Pin(BENCH_ENC_PINS[0], Pin.IN, Pin.PULL_UP)
+    pin_y = Pin(BENCH_ENC_PINS[1], Pin.IN, Pin.PULL_UP)
+    enc = encoder_portable.Encoder(pin_x, pin_y)
+
+    class Toggling:
+        """a pin whose level changes on every read, so each call counts"""
+
+        def __init__(self):
+            self.level = 0
+
+        def __call__(self):
+            self.level ^= 1
+            return self.level
+
+    native = encoder_portable._native
+    report("Encoder.x_callback", encoder_portable.Encoder._x_callback_py,
+           native.x_callback if native else None, enc, Toggling())
+    report("Encoder.y_callback", encoder_portable.Encoder._y_callback_py,
+           native.y_callback if native else None, enc, Toggling())
+
+
+print(f"{CALLS} calls each on {sys.platform}")
+bench_phew()
+bench_drivers()
@@ -0,0 +1,109 @@
+"""
+    Measure the request latency of phew.server with tracing off and on
+
+    Requests are fed to the server's request handler through in-memory
+    streams (no network, so only the server's own work is timed) with a
+    route that records a few trace points, like the motion handlers of
+    main.py. Each configuration is timed over REQUESTS requests:
+
+    - trace off: the points are compiled in (_TRACE = const(1)) but no
+      category is enabled, each point costs a call and a mask test
+    - ring buffer: every category recorded, formatted only when read
+    - ring + echo: the points printed as well, as print() debugging did
+
+    Points compiled out (_TRACE = const(0) in phew/server.py) cost nothing
+    at all, the "trace off" row is the upper bound for them. It runs on
+    the Pico only, with the phew/ package on it (phew needs MicroPython's
+    uasyncio, machine and network modules, CPython can't import it), from
+    a connected REPL so the echo row includes its blocking:
+
+        mpremote run tools/bench_trace.py
+
+    No figures are quoted here or in FEATURES.md: the on/off latency has
+    not been measured on a device yet.
+"""
+
+import sys
+
+sys.path.insert(0, ".")
+
+from time import ticks_us, ticks_diff
+import uasyncio
+from phew import logging, server, trace
+
+REQUESTS = 200
+REQUEST = b"GET /bench?steps=320 HTTP/1.1\r\nHost: picow.local\r\nAccept: */*\r\n\r\n"
+
+
+class Reader:
+    """the request as a stream"""
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    async def readline(self):
+        end = self.data.find(b"\n", self.position) + 1 or len(self.data)
+        line = self.data[self.position:end]
+        self.position = end
+        return line
+
+    async def readinto(self, buffer):
+        count = min(len(buffer), len(self.data) - self.position)
+        buffer[:count] = self.data[self.position:self.position + count]
+        self.position += count
+        return count
+
+
+class Writer:
+    """discards the response"""
+
+    def write(self, data):
+        pass
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+def bench_route(request):
+    steps = int(request.query.get("steps", 0))
+    trace.point(trace.MOTION, "action {} steps, {}x microsteps at {}Hz", steps, 32, 400)
+    trace.point(trace.MOTION, "action completed at {}", steps * 32)
+    return "OK"
+
+
+async def measure(name):
+    times = []
+    for _ in range(REQUESTS):
+        start = ticks_us()
+        await server._handle_request(Reader(REQUEST), Writer())
+        times.append(ticks_diff(ticks_us(), start))
+    times.sort()
+    mean = sum(times) / len(times)
+    return f"{name:14s} mean {mean:8.1f}us   median {times[len(times) // 2]:6d}us   p90 {times[len(times) * 9 // 10]:6d}us"
+
+
+async def main():
+    server.add_route("/bench", handler=bench_route, methods=["GET"])
+    logging.disable_logging_types(logging.LOG_ALL)  # log lines would be written to flash
+    results = []
+    trace.mask = 0
+    results.append(await measure("trace off"))
+    trace.enable(trace.ALL)
+    results.append(await measure("ring buffer"))
+    trace.echo = True
+    results.append(await measure("ring + echo"))
+    trace.echo = False
+    trace.mask = 0
+    print(f"{REQUESTS} requests each on {sys.platform}")
+    for line in results:
+        print(line)
+
+
+uasyncio.run(main())
@@ -0,0 +1,138 @@
+"""
+    Build a precompiled (.mpy) bundle of Twirly for the Pico
+
+    On every boot MicroPython compiles main.py, phew/ and drivers/ from
+    source, which takes seconds and a large heap spike while WiFi is
+    also allocating its buffers. This script (run on the host with
+    CPython, not on the Pico) cross-compiles them with mpy-cross into
+    build/mpy/, together with the templates, ready to be copied to the
+    Pico as is:
+
+        python tools/build_mpy.py
+        mpremote cp -r build/mpy/. :
+
+    MicroPython imports a .py in preference to an .mpy of the same name,
+    so remove the source files from the Pico first (a fresh filesystem is
+    simplest). main.py always runs from source, so the application is
+    compiled as twirly_main.mpy and the bundle's main.py only imports it.
+
+    --freeze writes build/frozen/ with a manifest.py to build a firmware
+    image with the modules frozen in flash, which saves the RAM their
+    code would take as well:
+
+        make -C ports/rp2 BOARD=RPI_PICO_W FROZEN_MANIFEST=<path>/build/frozen/manifest.py
+
+    then copy only main.py and the templates of build/mpy/ to the Pico.
+
+    Run tools/measure_imports.py on the Pico before and after to compare
+    import times and heap use.
+
+    Requires mpy-cross matching the firmware version: pip install mpy-cross
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUILD_DIR = os.path.join(ROOT, "build")
+PACKAGES = ("phew", "drivers")
+# example and test scripts in drivers/ that the application doesn't import
+SCRIPTS = {
+    "drv8825_followme.py",
+    "drv8825_speeds.py",
+    "drv8825_steps.py",
+    "drv8825_turns.py",
+    "test_microstepping.py",
+}
+DATA_DIRS = ("ap_templates", "app_templates")
+APP_MODULE = "twirly_main"
+MAIN_STUB = f"""# Runs the precompiled application, see tools/build_mpy.py
+import {APP_MODULE}
+"""
+
+
+def sources():
+    """(source path, module path without extension) of every module"""
+    yield os.path.join(ROOT, "main.py"), APP_MODULE
+    for package in PACKAGES:
+        for name in sorted(os.listdir(os.path.join(ROOT, package))):
+            if name.endswith(".py") and name not in SCRIPTS:
+                yield os.path.join(ROOT, package, name), f"{package}/{name[:-3]}"
+
+
+def find_mpy_cross(path):
+    """command to run mpy-cross, from --mpy-cross, PATH or the pip package"""
+    if path:
+        return [path]
+    if shutil.which("mpy-cross"):
+        return ["mpy-cross"]
+    try:
+        import mpy_cross  # noqa: F401 - pip install mpy-cross
+        return [sys.executable, "-m", "mpy_cross"]
+    except ImportError:
+        sys.exit("mpy-cross not found, install it with: pip install mpy-cross")
+
+
+def compile_bundle(mpy_cross, march, out_dir):
+    """cross-compile every module into out_dir, returns the sizes"""
+    sizes = []
+    for source, module in sources():
+        target = os.path.join(out_dir, module + ".mpy")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        relative = os.path.relpath(source, ROOT).replace(os.sep, "/")
+        # -march lets the @micropython.native/viper functions compile,
+        # -s keeps the file name in tracebacks
+        subprocess.run(mpy_cross + [f"-march={march}", "-s", relative, "-o", target, source], check=True)
+        sizes.append((module, os.stat(source).st_size, os.stat(target).st_size))
+    with open(os.path.join(out_dir, "main.py"), "w") as f:
+        f.write(MAIN_STUB)
+    for data_dir in DATA_DIRS:
+        shutil.copytree(os.path.join(ROOT, data_dir), os.path.join(out_dir, data_dir))
+    return sizes
+
+
+def write_freeze_manifest(freeze_dir):
+    """copy the sources into freeze_dir and write a manifest for them"""
+    for source, module in sources():
+        target = os.path.join(freeze_dir, module + ".py")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(source, target)
+    modules = sorted(module for _, module in sources() if "/" not in module)
+    lines = [
+        "# Generated by tools/build_mpy.py, see there for the build command",
+        'include("$(BOARD_DIR)/manifest.py")',
+    ]
+    lines += [f'package("{package}", base_path="{freeze_dir}")' for package in PACKAGES]
+    lines += [f'module("{module}.py", base_path="{freeze_dir}")' for module in modules]
+    with open(os.path.join(freeze_dir, "manifest.py"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def build():
+    parser = argparse.ArgumentParser(description="Build the precompiled Twirly bundle")
+    parser.add_argument("--march", default="armv6m",
+                        help="native code architecture: armv6m (Pico W) or armv7emsp (Pico 2 W)")
+    parser.add_argument("--mpy-cross", help="path of the mpy-cross executable")
+    parser.add_argument("--freeze", action="store_true", help="also write build/frozen/manifest.py")
+    args = parser.parse_args()
+
+    mpy_dir = os.path.join(BUILD_DIR, "mpy")
+    shutil.rmtree(mpy_dir, ignore_errors=True)
+    sizes = compile_bundle(find_mpy_cross(args.mpy_cross), args.march, mpy_dir)
+    for module, source_size, mpy_size in sizes:
+        print(f"{module + '.mpy':32} {source_size:7d} -> {mpy_size:6d} bytes")
+    print(f"{'total':32} {sum(s[1] for s in sizes):7d} -> {sum(s[2] for s in sizes):6d} bytes")
+    print(f"bundle written to {os.path.relpath(mpy_dir, ROOT)}/")
+
+    if args.freeze:
+        freeze_dir = os.path.join(BUILD_DIR, "frozen")
+        shutil.rmtree(freeze_dir, ignore_errors=True)
+        write_freeze_manifest(freeze_dir)
+        print(f"freeze manifest written to {os.path.relpath(freeze_dir, ROOT)}/manifest.py")
+
+
+if __name__ == "__main__":
+    sys.exit(build())
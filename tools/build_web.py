@@ -0,0 +1,140 @@
+"""
+    Build the web interface served from app_templates/
+
+    web/index.html is the editable source of the interface with its CSS
+    and JavaScript inline. This script (run on the host with CPython, not
+    on the Pico) pulls the <style> and <script> blocks out of it, minifies
+    them and writes them to app_templates/static/ under names that contain
+    a hash of their content, e.g. app.1a2b3c4d.css. The page shell written
+    to app_templates/index.html links to those files.
+
+    The server can then tell browsers to cache the assets forever, a new
+    build produces new names so a changed asset is always fetched fresh.
+
+    Usage: python tools/build_web.py
+"""
+
+import hashlib
+import os
+import re
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE = os.path.join(ROOT, "web", "index.html")
+OUTPUT_DIR = os.path.join(ROOT, "app_templates")
+STATIC_DIR = os.path.join(OUTPUT_DIR, "static")
+STATIC_URL = "/static/"
+
+STYLE_RE = re.compile(r"<style>(.*?)</style>\s*", re.S)
+SCRIPT_RE = re.compile(r"<script>(.*?)</script>\s*", re.S)
+
+
+def minify_css(css):
+    """strip comments and collapse whitespace"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    css = css.replace(";}", "}")
+    return css.strip()
+
+
+def minify_js(js):
+    """strip comments and indentation, keep line breaks
+
+    A small tokenizer tracks string and template literals so that comment
+    markers and whitespace inside them are left alone. Line breaks are
+    kept so automatic semicolon insertion still works.
+    """
+    out = []
+    i = 0
+    n = len(js)
+    quote = None  # active string delimiter
+    at_line_start = True
+    while i < n:
+        c = js[i]
+        if quote:
+            out.append(c)
+            if c == "\\" and i + 1 < n:
+                out.append(js[i + 1])
+                i += 2
+                continue
+            if c == quote:
+                quote = None
+            i += 1
+            continue
+        if c in "'\"`":
+            quote = c
+            out.append(c)
+            at_line_start = False
+            i += 1
+            continue
+        if js.startswith("//", i):
+            while i < n and js[i] != "\n":
+                i += 1
+            continue
+        if js.startswith("/*", i):
+            end = js.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            continue
+        if c == "\n":
+            while out and out[-1] in " \t":
+                out.pop()
+            if out and out[-1] != "\n":
+                out.append("\n")
+            at_line_start = True
+            i += 1
+            continue
+        if c in " \t\r":
+            if not at_line_start and out and out[-1] not in " \n":
+                out.append(" ")
+            i += 1
+            continue
+        out.append(c)
+        at_line_start = False
+        i += 1
+    return "".join(out).strip() + "\n"
+
+
+def write_asset(content, extension):
+    """write content to a fingerprinted file, returns its url"""
+    data = content.encode("utf-8")
+    digest = hashlib.sha1(data).hexdigest()[:8]
+    name = f"app.{digest}.{extension}"
+    with open(os.path.join(STATIC_DIR, name), "wb") as f:
+        f.write(data)
+    return STATIC_URL + name, name
+
+
+def build():
+    with open(SOURCE, encoding="utf-8") as f:
+        html = f.read()
+
+    os.makedirs(STATIC_DIR, exist_ok=True)
+
+    css = minify_css("\n".join(STYLE_RE.findall(html)))
+    js = minify_js("\n;\n".join(SCRIPT_RE.findall(html)))
+    css_url, css_name = write_asset(css, "css")
+    js_url, js_name = write_asset(js, "js")
+
+    # the stylesheet replaces the first <style> block, the script replaces
+    # the first <script> block, any further inline blocks are dropped
+    links = [f'<link rel="stylesheet" href="{css_url}">\n', f'<script src="{js_url}"></script>\n']
+    html = STYLE_RE.sub(lambda m: links.pop(0) if links and links[0].startswith("<link") else "", html)
+    html = SCRIPT_RE.sub(lambda m: links.pop(0) if links else "", html)
+
+    with open(os.path.join(OUTPUT_DIR, "index.html"), "w", encoding="utf-8") as f:
+        f.write(html)
+
+    # remove assets left over from previous builds
+    for name in os.listdir(STATIC_DIR):
+        if name.startswith("app.") and name not in (css_name, js_name):
+            os.remove(os.path.join(STATIC_DIR, name))
+
+    for name in ("index.html", "static/" + css_name, "static/" + js_name):
+        size = os.stat(os.path.join(OUTPUT_DIR, name)).st_size
+        print(f"{name:32} {size:6d} bytes")
+
+
+if __name__ == "__main__":
+    sys.exit(build())
@@ -0,0 +1,84 @@
+"""
+    Measure import time and heap use of Twirly's modules on the Pico
+
+    Run it on the Pico as deployed, from source or from the bundle built
+    by tools/build_mpy.py, to compare the two:
+
+        mpremote run tools/measure_imports.py
+
+    Each module is imported with the garbage collector disabled, so the
+    heap it takes is everything the import allocated (the compiler's
+    working memory included, which is the peak). The application itself
+    can't be imported without starting it: from source its compile cost
+    is measured instead, which an .mpy bundle doesn't pay at all.
+"""
+
+import gc
+import os
+import sys
+import time
+
+MODULES = (
+    "phew",
+    "phew.server",
+    "phew.dns",
+    "phew.ntp",
+    "phew.state",
+    "phew.template",
+    "drivers.drv8825",
+    "drivers.drv8825_setup",
+    "drivers.stepgen",
+)
+
+
+def measure(action):
+    """(milliseconds, heap bytes allocated) of running action()"""
+    gc.collect()
+    gc.disable()
+    free = gc.mem_free()
+    start = time.ticks_us()
+    try:
+        action()
+    finally:
+        elapsed = time.ticks_diff(time.ticks_us(), start)
+        allocated = free - gc.mem_free()
+        gc.enable()
+    return elapsed / 1000, allocated
+
+
+def variant(module):
+    """'mpy', 'py' or 'frozen', by the file the module came from"""
+    path = getattr(sys.modules[module], "__file__", "")
+    if path.startswith(".frozen"):
+        return "frozen"
+    return path.rsplit(".", 1)[-1] if path else "frozen"
+
+
+def compile_main():
+    with open("main.py") as f:
+        compile(f.read(), "main.py", "exec")
+
+
+gc.collect()
+print(f"heap free at start: {gc.mem_free()} bytes")
+total_ms = total_bytes = 0
+for module in MODULES:
+    if module in sys.modules:  # already imported by a package before it
+        continue
+    ms, allocated = measure(lambda: __import__(module))
+    total_ms += ms
+    total_bytes += allocated
+    print(f"{module:24} {variant(module):6} {ms:8.1f}ms {allocated:7d} bytes")
+
+try:
+    os.stat("twirly_main.mpy")
+    print(f"{'main':24} {'mpy':6}  (precompiled, no compile cost)")
+except OSError:
+    ms, allocated = measure(compile_main)
+    total_ms += ms
+    total_bytes += allocated
+    print(f"{'main (compile only)':24} {'py':6} {ms:8.1f}ms {allocated:7d} bytes")
+
+gc.collect()
+print(f"{'total':31} {total_ms:8.1f}ms {total_bytes:7d} bytes")
+print(f"heap free after imports: {gc.mem_free()} bytes")
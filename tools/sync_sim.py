@@ -0,0 +1,102 @@
+"""
+    Simulate a leader and several followers of phew.sync on one host
+
+    Every node runs in this process on its own UDP socket over localhost,
+    with its own clock: a random offset and a crystal error of up to
+    --drift-ppm, as separate Picos would have. The leader schedules a
+    command every few seconds and each node records when it ran it by the
+    host's clock, the spread between the first and the last node is the
+    start alignment. Run it from the repository root with the MicroPython
+    unix port:
+
+        micropython tools/sync_sim.py --followers 4
+
+    Packets are delivered by the host's network stack, so wifi latency
+    and loss aren't part of the result, only the clock modelling and the
+    scheduling of the nodes.
+"""
+
+import sys
+
+sys.path.insert(0, ".")
+
+import random
+import time
+import uasyncio
+from phew import logging, sync
+
+COMMANDS = 5
+COMMAND_INTERVAL_S = 3
+PORT = 4211
+
+
+def skewed_clock(offset_ms, drift_ppm):
+    """ticks_ms() of a node whose clock is offset and runs fast or slow"""
+    start = time.ticks_ms()
+
+    def ticks_ms():
+        elapsed = time.ticks_diff(time.ticks_ms(), start)
+        return time.ticks_add(start, offset_ms + elapsed + elapsed * drift_ppm // 1000000)
+
+    return ticks_ms
+
+
+def recorder(runs, name):
+    """on_command of a node, records the host time the command ran at"""
+
+    async def on_command(command):
+        runs.setdefault(command, {})[name] = time.ticks_us()
+
+    return on_command
+
+
+async def simulate(followers, drift_ppm):
+    runs = {}
+    leader = sync.Leader(recorder(runs, "leader"), port=PORT)
+    leader.start(broadcast_address=None)
+    nodes = []
+    for i in range(followers):
+        ticks_ms = skewed_clock(random.randint(0, 1 << 20), random.randint(-drift_ppm, drift_ppm))
+        node = sync.Follower(recorder(runs, f"follower {i + 1}"), port=PORT,
+                             leader="127.0.0.1", ticks_ms=ticks_ms)
+        node.start()
+        nodes.append(node)
+
+    while not all(node.synced() for node in nodes):
+        await uasyncio.sleep_ms(100)
+    print(f"{followers} followers synced, clock drift up to {drift_ppm}ppm")
+
+    worst_ms = 0
+    for i in range(COMMANDS):
+        await uasyncio.sleep_ms(COMMAND_INTERVAL_S * 1000)
+        command = f"command {i + 1}"
+        leader.schedule(command)
+        await uasyncio.sleep_ms(leader.lead_ms + 100)
+        times = runs.get(command, {})
+        if len(times) < followers + 1:
+            print(f"{command}: ran on {len(times)} of {followers + 1} nodes")
+            continue
+        spread_ms = time.ticks_diff(max(times.values()), min(times.values())) / 1000
+        worst_ms = max(worst_ms, spread_ms)
+        print(f"{command}: start spread {spread_ms:.2f}ms")
+    print(f"worst start spread {worst_ms:.2f}ms")
+
+
+def main():
+    followers = 3
+    drift_ppm = 100
+    args = sys.argv[1:]
+    while args:
+        option = args.pop(0)
+        if option == "--followers":
+            followers = int(args.pop(0))
+        elif option == "--drift-ppm":
+            drift_ppm = int(args.pop(0))
+        else:
+            sys.exit(f"usage: {sys.argv[0]} [--followers N] [--drift-ppm PPM]")
+    # log lines would go to log.txt in the current directory
+    logging.disable_logging_types(logging.LOG_ALL)
+    uasyncio.run(simulate(followers, drift_ppm))
+
+
+main()